@@ -0,0 +1,239 @@
+"""
+Benchmarks the REST and websocket endpoints against stub_server.py and prints the results as JSON.
+
+    python benchmarks/run.py --servers 20 --output results.json
+
+Compare the output of two commits to find regressions. The numbers depend on the machine,
+so only compare results from the same machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+import psutil
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def summarize(latencies: List[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0
+    }
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_until_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if process.poll() is not None:
+            raise RuntimeError("Stub server exited")
+        try:
+            if (await client.get("/api/servers")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Stub server did not start")
+
+
+async def bench_rest(client: httpx.AsyncClient, path: str, requests: int, concurrency: int) -> dict:
+    """
+    Throughput and latency of GET requests with a fixed number of concurrent clients
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    # warm up caches
+    await client.get(path)
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - started
+    return {"path": path, "concurrency": concurrency, "errors": errors,
+            "throughput_rps": requests / duration, **summarize(latencies)}
+
+
+async def bench_fanout(base_url: str, client: httpx.AsyncClient, sid: str, clients: int, lines: int,
+                       rate: float) -> dict:
+    """
+    Connects many websocket clients to one server and measures the delay between emitting a console line
+    and receiving it
+    """
+    ws_url = base_url.replace("http", "ws", 1) + f"/api/servers/{sid}/websocket"
+    connections = [await websockets.connect(ws_url, max_queue=None) for _ in range(clients)]
+    latencies = []
+    received = 0
+
+    async def read(connection):
+        nonlocal received
+        count = 0
+        while count < lines:
+            try:
+                message = json.loads(await asyncio.wait_for(connection.recv(), 30))
+            except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                return
+            if message.get("type") != "output" or not message["value"].startswith("benchmark "):
+                continue
+            latencies.append(time.time() - float(message["value"].split()[2]))
+            count += 1
+        received += count
+
+    readers = [asyncio.create_task(read(connection)) for connection in connections]
+    started = time.perf_counter()
+    emitted = (await client.post("/bench/emit", params={"sid": sid, "lines": lines, "rate": rate},
+                                 timeout=None)).json()
+    await asyncio.gather(*readers)
+    duration = time.perf_counter() - started
+    subscriptions = (await client.get(f"/api/servers/{sid}/subscriptions")).json()["subscriptions"]
+    for connection in connections:
+        await connection.close()
+    return {
+        "clients": clients,
+        "lines": lines,
+        "rate": rate,
+        "emit_duration_s": emitted["duration"],
+        "duration_s": duration,
+        "delivered": received,
+        "expected": clients * lines,
+        "dropped": sum(subscription["dropped"] for subscription in subscriptions),
+        "messages_per_s": received / duration,
+        **summarize(latencies)
+    }
+
+
+async def bench_connection_cycles(base_url: str, process: psutil.Process, sid: str, clients: int,
+                                  cycles: int) -> dict:
+    """
+    Memory of the server process before and after connecting and disconnecting clients repeatedly
+    """
+    ws_url = base_url.replace("http", "ws", 1) + f"/api/servers/{sid}/websocket"
+
+    async def cycle():
+        connections = await asyncio.gather(*[websockets.connect(ws_url) for _ in range(clients)])
+        # wait for the initial messages, so the subscriptions are registered
+        await asyncio.gather(*[connection.recv() for connection in connections])
+        await asyncio.gather(*[connection.close() for connection in connections])
+
+    # the first cycle allocates caches and buffers that are kept
+    await cycle()
+    await asyncio.sleep(0.5)
+    rss_before = process.memory_info().rss
+    samples = []
+    for i in range(cycles):
+        await cycle()
+        samples.append(process.memory_info().rss)
+    await asyncio.sleep(1)
+    rss_after = process.memory_info().rss
+    return {
+        "clients": clients,
+        "cycles": cycles,
+        "rss_before_bytes": rss_before,
+        "rss_after_bytes": rss_after,
+        "rss_max_bytes": max(samples),
+        "rss_growth_bytes": rss_after - rss_before,
+        "rss_growth_per_cycle_bytes": (rss_after - rss_before) / cycles
+    }
+
+
+async def run(args) -> dict:
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen([
+        sys.executable, str(ROOT / "benchmarks" / "stub_server.py"), "--port", str(port),
+        "--servers", str(args.servers), "--worlds", str(args.worlds), "--players", str(args.players)
+    ])
+    results = {
+        "commit": get_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": vars(args)
+    }
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            await wait_until_ready(client, process)
+            results["rest"] = [
+                await bench_rest(client, path, args.requests, args.concurrency)
+                for path in ("/api/servers", "/api/worlds", "/api/servers/0")
+            ]
+            results["websocket_fanout"] = await bench_fanout(base_url, client, "0", args.clients, args.lines,
+                                                             args.rate)
+            results["connection_cycles"] = await bench_connection_cycles(
+                base_url, psutil.Process(process.pid), "1", args.clients, args.cycles
+            )
+    finally:
+        process.terminate()
+        process.wait(10)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=20, help="Number of fake servers")
+    parser.add_argument("--worlds", type=int, default=3, help="Worlds per server")
+    parser.add_argument("--players", type=int, default=20, help="Op and banned players per server")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per REST endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent REST clients")
+    parser.add_argument("--clients", type=int, default=200, help="Websocket clients")
+    parser.add_argument("--lines", type=int, default=1000, help="Console lines emitted in the fan-out benchmark")
+    parser.add_argument("--rate", type=float, default=500, help="Console lines per second")
+    parser.add_argument("--cycles", type=int, default=20, help="Connect/disconnect cycles")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Runs the API with a stub ServerManager, that contains fake servers with worlds, players and backups.
+All files are created in a temporary home directory, no Minecraft server is started.
+
+Used by run.py, can also be started on its own:
+
+    python benchmarks/stub_server.py --port 8765 --servers 20
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _nbt_string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack(">H", len(data)) + data
+
+
+def _nbt_compound(items: dict) -> bytes:
+    data = b""
+    for name, value in items.items():
+        if isinstance(value, dict):
+            data += b"\x0a" + _nbt_string(name) + _nbt_compound(value)
+        elif isinstance(value, str):
+            data += b"\x08" + _nbt_string(name) + _nbt_string(value)
+        else:
+            data += b"\x04" + _nbt_string(name) + struct.pack(">q", value)
+    return data + b"\x00"
+
+
+def write_level_dat(path: Path, version: str):
+    data = {"Data": {"LevelName": path.parent.name, "LastPlayed": int(time.time() * 1000), "Version": {"Name": version}}}
+    with gzip.open(path, "wb") as f:
+        f.write(b"\x0a" + _nbt_string("") + _nbt_compound(data))
+
+
+def create_server_files(path: Path, worlds: int, players: int, version: str):
+    (path / "worlds").mkdir(parents=True)
+    with open(path / "server.properties", "w") as f:
+        f.write("level-name=worlds/world0\nserver-port=25565\nmotd=Benchmark\n")
+    for i in range(worlds):
+        world = path / "worlds" / f"world{i}"
+        (world / "region").mkdir(parents=True)
+        write_level_dat(world / "level.dat", version)
+        with open(world / "region" / "r.0.0.mca", "wb") as f:
+            f.write(os.urandom(64 * 1024))
+    created = time.strftime("%Y-%m-%d %H:%M:%S +0000")
+    with open(path / "ops.json", "w") as f:
+        json.dump([{"uuid": f"00000000-0000-0000-0000-{i:012d}", "name": f"op{i}", "level": 4,
+                    "bypassesPlayerLimit": False} for i in range(players)], f)
+    with open(path / "banned-players.json", "w") as f:
+        json.dump([{"uuid": f"00000000-0000-0000-0001-{i:012d}", "name": f"banned{i}", "created": created,
+                    "source": "Server", "expires": "forever", "reason": "Benchmark"} for i in range(players)], f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--worlds", type=int, default=3, help="Worlds per server")
+    parser.add_argument("--players", type=int, default=20, help="Op and banned players per server")
+    parser.add_argument("--backups", type=int, default=5, help="Backups per server")
+    args = parser.parse_args()
+
+    # mc_server_interaction computes its data directories from the home directory on import
+    home = tempfile.mkdtemp(prefix="mcsm-benchmark-")
+    os.environ["HOME"] = home
+    sys.path.insert(0, str(ROOT))
+    os.chdir(home)
+
+    import mc_server_interaction.manager
+    from mc_server_interaction.interaction import MinecraftServer
+    from mc_server_interaction.interaction.models import ServerConfig
+    from mc_server_interaction.manager import ServerManager
+    from mc_server_interaction.manager.backup_manager import Backup, BackupManager
+
+    class StubConfig:
+        server_data_dir = str(Path(home) / "servers")
+
+        def __init__(self, servers: dict):
+            self._servers = servers
+
+        def get_servers(self):
+            return {sid: server.server_config for sid, server in self._servers.items()}
+
+        def get_latest_sid(self):
+            return len(self._servers) - 1
+
+        def save(self):
+            pass
+
+    class StubServerManager(ServerManager):
+        def __init__(self):
+            self.logger = logging.getLogger("Benchmark.StubServerManager")
+            self._servers = {}
+            self.config = StubConfig(self._servers)
+            self.backup_manager = BackupManager(self._servers)
+
+        async def populate(self):
+            # MinecraftServer starts its update loop in __init__, so the servers are created on startup
+            for i in range(args.servers):
+                sid = str(i)
+                path = Path(home) / "servers" / f"server{i}"
+                create_server_files(path, args.worlds, args.players, "1.19.2")
+                self._servers[sid] = MinecraftServer(ServerConfig(str(path), f"server{i}", "1.19.2"))
+                for j in range(args.backups):
+                    bid = f"{sid}-{j}"
+                    created = datetime.fromtimestamp(time.time() - j * 3600)
+                    self.backup_manager.backups[bid] = Backup(sid, created, "world0", "1.19.2",
+                                                              str(Path(home) / f"{bid}.zip"), 1024 * 1024)
+
+    mc_server_interaction.manager.ServerManager = StubServerManager
+    import main as api
+
+    async def emit(sid: str, lines: int = 1000, rate: float = 1000):
+        """
+        Push console lines through the output callback of a server. Each line contains its send time.
+        """
+        server = api.manager.get_server(sid)
+        interval = 1 / rate
+        started = time.perf_counter()
+        for seq in range(lines):
+            await server.callbacks.output(f"benchmark {seq} {time.time()!r}")
+            delay = started + (seq + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return {"lines": lines, "duration": time.perf_counter() - started}
+
+    api.app.router.on_startup.insert(0, api.manager.populate)
+    api.app.add_api_route("/bench/emit", emit, methods=["POST"])
+
+    import uvicorn
+    uvicorn.run(api.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
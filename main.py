@@ -1,27 +1,69 @@
 import asyncio
-import dataclasses
-import io
+import json
 import os
+import shutil
+import time
 import zipfile
 from datetime import datetime
 from functools import partial
 from pathlib import Path
-from typing import Union
-
-from starlette.staticfiles import StaticFiles
+from typing import List, Optional, Union
 
 import mc_server_interaction.paths
-from fastapi import FastAPI, WebSocket, UploadFile, File, APIRouter
-from fastapi.responses import JSONResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, WebSocket, UploadFile, File, APIRouter, Request, Query
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response
 from mc_server_interaction.exceptions import ServerRunningException, WorldExistsException
 from mc_server_interaction.manager import ServerManager
+from mc_server_interaction.manager.data_store import ManagerDataStore
 from starlette.middleware.cors import CORSMiddleware
 
+from mc_server_manager_api.backups import IncrementalBackupStore, apply_retention_job, create_backup_job, \
+    delete_backup_job, is_incremental, restore_backup_job
+from mc_server_manager_api.broadcast import OverflowPolicy, ServerListBroadcaster, Subscriber
+from mc_server_manager_api.cluster import Cluster, get_node_load, parse_nodes
+from mc_server_manager_api.commands import CommandPipeline
+from mc_server_manager_api.console import ConsoleLogManager
+from mc_server_manager_api.copy import CopyEngine, copy_world_job
+from mc_server_manager_api.downloads import archive_response, backup_etag, file_response, get_archive_formats, \
+    iter_backup_entries
+from mc_server_manager_api.health import Readiness, StartupProfiler
+from mc_server_manager_api.instrumentation import Instrumentation
+from mc_server_manager_api.jobs import Job, JobQueue
+from mc_server_manager_api.journal import StateJournal
+from mc_server_manager_api.lifecycle import LifecycleEngine, ServerBusyException
 from mc_server_manager_api.models import *
+from mc_server_manager_api.players import MojangLookupCache, PlayerIndex, PlayerPoller, player_roles
+from mc_server_manager_api.regions import RegionIndex, hotspot_metrics, prune_world_job, scan_world_job
+from mc_server_manager_api.scheduler import InsufficientMemoryException, ServerPolicy, ServerScheduler
+from mc_server_manager_api.snapshots import FastJSONResponse, ServerSnapshots
+from mc_server_manager_api.stream import StreamConnection, StreamEncoding, StreamHub, get_stream_encodings
+from mc_server_manager_api.subscriptions import ServerSubscriptionManager
+from mc_server_manager_api.templates import ArtifactCache, ServerTemplate, TemplateStore, install_server_job, \
+    install_servers_job
+from mc_server_manager_api.timeseries import MetricsStore
+from mc_server_manager_api.uploads import WorldUploadManager, UploadException, UploadOffsetException, extract_world
+from mc_server_manager_api.utils import get_world_dir_name, is_map_directory
+from mc_server_manager_api.versions import VersionCatalog
+from mc_server_manager_api.worlds import WorldIndex
 
 world_upload_path = mc_server_interaction.paths.cache_dir / "uploaded_worlds"
-
-app = FastAPI()
+console_log_path = mc_server_interaction.paths.cache_dir / "console"
+incremental_backup_path = mc_server_interaction.paths.backup_dir / "incremental"
+metrics_path = mc_server_interaction.paths.data_dir / "metrics.bin"
+artifact_path = mc_server_interaction.paths.cache_dir / "artifacts"
+template_path = mc_server_interaction.paths.data_dir / "templates"
+region_index_path = mc_server_interaction.paths.data_dir / "regions.sqlite"
+journal_path = mc_server_interaction.paths.data_dir / "journal.log"
+player_lookup_path = mc_server_interaction.paths.cache_dir / "player_lookups.json"
+policy_path = mc_server_interaction.paths.data_dir / "policies.json"
+
+# MC_SERVER_MANAGER_PROFILE_STARTUP=1 logs the duration of the imports and of every startup step
+startup_profiler = StartupProfiler(os.environ.get("MC_SERVER_MANAGER_PROFILE_STARTUP") == "1")
+readiness = Readiness(startup_profiler)
+# requests are served while caches are warmed up in the background, unless MC_SERVER_MANAGER_EAGER_STARTUP=1
+eager_startup = os.environ.get("MC_SERVER_MANAGER_EAGER_STARTUP") == "1"
+
+app = FastAPI(default_response_class=FastJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -30,48 +72,171 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+# the journal has to be replayed before the server manager loads its config. Both stay at import time,
+# most services below are created with the manager.
+journal = StateJournal(journal_path, Path(ManagerDataStore.data_file))
+journal.recover()
+startup_profiler.mark("journal")
 manager = ServerManager()
+journal.attach(manager)
+startup_profiler.mark("server_manager")
+server_list_broadcaster = ServerListBroadcaster(manager)
+console_logs = ConsoleLogManager(manager, spill_dir=console_log_path)
+# the history is loaded by the warm-up
+metrics_store = MetricsStore(manager, path=metrics_path, load=False)
+job_queue = JobQueue(workers=2)
+incremental_store = IncrementalBackupStore(incremental_backup_path)
+world_index = WorldIndex(manager)
+region_index = RegionIndex(region_index_path)
+# reads the players of all servers off the event loop for the services below
+player_poller = PlayerPoller(manager)
+server_subscriptions = ServerSubscriptionManager()
+player_poller.listeners.append(server_subscriptions.on_players)
+snapshots = ServerSnapshots(manager, world_index, player_poller)
+player_lookups = MojangLookupCache(player_lookup_path)
+player_index = PlayerIndex(manager, player_lookups, player_poller)
+startup_profiler.mark("indexes")
+stream_hub = StreamHub(manager, job_queue, console_logs, player_poller)
+command_pipeline = CommandPipeline(manager)
+copy_engine = CopyEngine()
+artifacts = ArtifactCache(artifact_path)
+templates = TemplateStore(template_path, copy_engine)
+version_catalog = VersionCatalog(manager.available_versions)
+lifecycle = LifecycleEngine(manager)
+# memory in MiB that is not used for servers
+reserved_memory = int(os.environ.get("MC_SERVER_MANAGER_RESERVED_MEMORY", 1024))
+scheduler = ServerScheduler(manager, lifecycle, job_queue, policy_path, incremental_store, player_poller,
+                            reserved_memory)
+# systemd kills the service after 90 seconds by default
+shutdown_deadline = 80
+world_uploads = WorldUploadManager(world_upload_path)
+instrumentation = Instrumentation(manager, job_queue, server_subscriptions, metrics_store)
+app.add_middleware(instrumentation.middleware)
+# aggregator mode: MC_SERVER_MANAGER_NODES=a=http://host1:8000,b=http://host2:8000
+cluster_nodes = os.environ.get("MC_SERVER_MANAGER_NODES")
+node_timeout = float(os.environ.get("MC_SERVER_MANAGER_NODE_TIMEOUT", 5))
+cluster = Cluster(parse_nodes(cluster_nodes, node_timeout)) if cluster_nodes else None
+readiness.add("journal")
+readiness.set_ready("journal")
+readiness.add("server_manager")
+readiness.set_ready("server_manager")
+# set at the end of the startup hook
+readiness.add("startup")
+# only needed to create servers, the refresh may fail without internet access
+readiness.add("versions", required=False, check=lambda: version_catalog.available)
+startup_profiler.mark("services")
 
 router = APIRouter(
     prefix="/api",
     responses={404: {"description": "Not found"}},
 )
+# routes of the aggregator mode, they take precedence over the routes of the local server manager
+cluster_router = APIRouter(
+    prefix="/api",
+    responses={404: {"description": "Not found"}},
+)
 
 if os.path.isdir("./web/static"):
+    from starlette.staticfiles import StaticFiles
+
     app.mount("/static", StaticFiles(directory="web/static"), name="static")
     app.mount("/", StaticFiles(directory="web/"), name="")
 
 
-def _get_servers():
-    servers = manager.get_servers()
-    resp = {
-        "servers": [
-            SimpleMinecraftServer(sid, server.server_config.name, server.server_config.version,
-                                  status=server.status.name).__dict__ for sid, server
-            in servers.items()
-        ]
-    }
-    return resp
+async def _send_messages(websocket: WebSocket, subscriber: Subscriber):
+    """
+    Send the queued messages of the subscriber until the client disconnects
+    """
+    async def write():
+        while True:
+            await websocket.send_text(await subscriber.get())
+
+    async def wait_for_disconnect():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    tasks = [asyncio.create_task(write()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _warm_up_caches():
+    """
+    Build the world index and the server snapshots with their backups, so the first requests don't have to.
+    The worlds are scanned in an executor.
+    """
+    await world_index.get_all_worlds()
+    for sid in list(manager.get_servers()):
+        snapshots.get_server(sid)
+        await asyncio.sleep(0)
 
 
-def _get_worlds(server):
-    worlds = server.worlds
-    ret = []
-    for world in worlds:
-        ret.append(world.to_dict())
-    return ret
+async def _load_templates():
+    """
+    Read the artifact index and the templates off the event loop, otherwise they are read on first use
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(loop.run_in_executor(None, artifacts.load), loop.run_in_executor(None, templates.load))
 
 
 # do some load on startup
 @app.on_event("startup")
 async def startup():
-    await manager.available_versions.load()
+    startup_profiler.mark("until startup")
+    # register the console logs first, subscriptions read their sequence numbers
+    console_logs.watch_servers()
+    server_list_broadcaster.watch_servers()
+    player_poller.watch_servers()
+    player_poller.start()
+    snapshots.watch_servers()
+    player_lookups.start()
+    player_index.watch_servers()
+    stream_hub.watch_servers()
+    stream_hub.start()
+    command_pipeline.watch_servers()
+    metrics_store.watch_servers()
+    metrics_store.start()
+    scheduler.watch_servers()
+    # after all services installed their callbacks, so they are measured
+    instrumentation.watch_servers()
+    instrumentation.start()
+    job_queue.start()
+    scheduler.start()
+    # serves the cached version list until the refresh is done
+    version_catalog.start()
+    readiness.run("metrics", metrics_store.load_in_background)
+    readiness.run("caches", _warm_up_caches)
+    readiness.run("templates", _load_templates)
+    readiness.set_ready("startup")
+    startup_profiler.mark("startup")
+    if eager_startup:
+        await readiness.wait()
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await manager.stop_all_servers()
+    readiness.cancel()
+    version_catalog.stop()
+    if cluster is not None:
+        await cluster.stop()
+    instrumentation.stop()
+    stream_hub.stop()
+    player_poller.stop()
+    await player_lookups.stop()
+    metrics_store.stop()
+    await scheduler.stop()
+    await job_queue.stop()
+    region_index.close()
+    sids = [sid for sid, server in manager.get_servers().items() if server.is_running]
+    await lifecycle.run("stop", sids, deadline=time.monotonic() + shutdown_deadline, parallelism=max(len(sids), 1))
     manager.config.save()
+    await journal.close()
 
 
 @app.get("/")
@@ -85,33 +250,79 @@ def index():
         return RedirectResponse("/docs")
 
 
+@router.get("/health/live")
+async def get_liveness():
+    """
+    The API is running and responds
+    """
+    return JSONResponse({"status": "ok"}, 200)
+
+
+@router.get("/health/ready")
+async def get_readiness():
+    """
+    The readiness of every component. The status is 503 until all required components are ready.
+    With MC_SERVER_MANAGER_PROFILE_STARTUP=1, the startup timings are included.
+    """
+    data = readiness.to_dict()
+    return JSONResponse(data, 200 if data["ready"] else 503)
+
+
+@app.get("/metrics")
+def get_prometheus_metrics():
+    """
+    Metrics in the Prometheus text format
+    """
+    return Response(instrumentation.registry.render(), 200, media_type=instrumentation.registry.content_type)
+
+
 @router.get("/servers", response_model=GetServersResponse)
 async def get_servers():
-    resp = _get_servers()
+    resp = server_list_broadcaster.get_servers()
     return JSONResponse(resp, 200)
 
 
 @router.websocket("/servers")
 async def get_servers_websocket(websocket: WebSocket):
     await websocket.accept()
-    old_resp = {}
+    subscriber = server_list_broadcaster.subscribe()
     try:
-        while True:
-            resp = _get_servers()
-            if resp != old_resp:
-                await websocket.send_json(resp)
-                old_resp = resp
-            await asyncio.sleep(5)
+        await _send_messages(websocket, subscriber)
     except Exception:
         return
+    finally:
+        server_list_broadcaster.unsubscribe(subscriber)
 
 
 @router.get("/available_versions", response_model=AvailableVersionsResponse)
-async def get_available_versions():
-    return JSONResponse(
-        {
-            "available_versions": ["latest"] + list(manager.available_versions.available_versions.keys())
-        }, 200)
+async def get_available_versions(request: Request, version_type: Optional[str] = Query(None, alias="type"),
+                                 limit: Optional[int] = None, offset: int = 0):
+    """
+    Filter the versions by type (release, pre_release or snapshot) and page through them with limit and offset.
+    "latest" is always the first entry of the first page and counts against its limit.
+    """
+    if version_type not in (None, "release", "pre_release", "snapshot"):
+        return JSONResponse({"error": "type must be one of release, pre_release, snapshot"}, 400)
+    if (limit is not None and limit < 1) or offset < 0:
+        return JSONResponse({"error": "limit must be positive and offset must not be negative"}, 400)
+    body, etag = version_catalog.get_response(version_type, limit, offset)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, 200, headers, media_type="application/json")
+
+
+def _watch_new_servers():
+    console_logs.watch_servers()
+    player_poller.watch_servers()
+    metrics_store.watch_servers()
+    snapshots.watch_servers()
+    player_index.watch_servers()
+    stream_hub.watch_servers()
+    command_pipeline.watch_servers()
+    scheduler.watch_servers()
+    server_list_broadcaster.refresh()
+    instrumentation.watch_servers()
 
 
 @router.post("/servers", response_model=ServerCreatedModel)
@@ -124,52 +335,65 @@ async def create_server(server: ServerCreationData):
         return JSONResponse({
             "error": str(e)
         }, 500)
-    asyncio.create_task(manager.install_server(sid))
+    _watch_new_servers()
+    job_queue.submit("install_server", sid,
+                     partial(install_server_job, manager=manager, job_queue=job_queue, artifacts=artifacts,
+                             copy_engine=copy_engine, sid=sid),
+                     f"Install server {sid}")
     return ServerCreatedModel(message="Lol", sid=sid)
 
 
 @router.get("/worlds", response_model=AllWorldsResponse)
-async def get_worlds():
-    worlds_dict = {}
-    for sid in manager.get_servers():
-        server = manager.get_server(sid)
-        worlds_dict[sid] = _get_worlds(server)
-    return JSONResponse({"worlds": worlds_dict}, 200)
+async def get_worlds(request: Request):
+    body, etag = await world_index.get_all_worlds()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, 200, headers, media_type="application/json")
 
 
 @router.get("/servers/{sid}", response_model=MinecraftServerModel)
-async def get_server(sid: str):
-    server = manager.get_server(sid)
-    if not server:
+async def get_server(sid: str, request: Request):
+    await world_index.refresh()
+    snapshot = snapshots.get_server(sid)
+    if snapshot is None:
         return JSONResponse({"error": "Server not found"}, 404)
-    return MinecraftServerModel(
-        name=server.server_config.name,
-        sid=sid,
-        version=server.server_config.version,
-        status=server.status.name,
-        worlds=_get_worlds(server),
-        properties=server.properties.to_dict(),
-        backups=manager.backup_manager.get_backups_for_server(sid)
-    )
+    body, etag = snapshot
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, 200, headers, media_type="application/json")
 
 
 @router.get("/servers/{sid}/players", response_model=PlayersResponse)
-async def get_players(sid: str):
-    server = manager.get_server(sid)
-    if not server:
+async def get_players(sid: str, request: Request):
+    section = snapshots.get_section(sid, "players")
+    if section is None:
         return JSONResponse({"error": "Server not found"}, 404)
+    headers = {"ETag": section.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == section.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(section.body, 200, headers, media_type="application/json")
 
-    players = server.players
-    resp = {
-        "online_players": [dataclasses.asdict(player) for player in players["online_players"]],
-        "op_players": [dataclasses.asdict(player) for player in players["op_players"]],
-        "banned_players": [dataclasses.asdict(player) for player in players["banned_players"]]
-    }
-    return JSONResponse(resp, 200)
+
+@router.get("/players", response_model=PlayerSearchResponse)
+async def search_players(q: str = "", role: Optional[str] = None, online: Optional[bool] = None,
+                         limit: int = Query(50, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """
+    Search the players of all servers by a prefix of their name or UUID
+    """
+    if role is not None and role not in player_roles:
+        return JSONResponse({"error": f"role must be one of {', '.join(player_roles)}"}, 400)
+    total, players = player_index.search(q, role, online, limit, offset)
+    return FastJSONResponse({"total": total, "players": players}, 200)
 
 
 @router.post("/servers/{sid}/start")
-async def start_server(sid: str):
+async def start_server(sid: str, queue: bool = False):
+    """
+    Start a server if the host has enough free memory for it. With queue, a start that doesn't fit is
+    queued until enough memory is free.
+    """
     server = manager.get_server(sid)
     if not server:
         return JSONResponse({"error": "Server not found"}, 404)
@@ -179,9 +403,15 @@ async def start_server(sid: str):
         return JSONResponse({"error": "Server is running"})
 
     try:
-        await server.start()
+        result = await scheduler.request_start(sid, queue)
+    except InsufficientMemoryException as e:
+        return JSONResponse({"error": str(e), "required": e.required, "headroom": e.headroom}, 409)
+    except ServerBusyException as e:
+        return JSONResponse({"error": str(e)}, 409)
     except Exception as e:
-        return JSONResponse({"error": e}, 500)
+        return JSONResponse({"error": str(e)}, 500)
+    if result == "queued":
+        return JSONResponse({"message": "Server will be started when enough memory is free"}, 202)
 
     return JSONResponse({"message": "Server is starting"}, 200)
 
@@ -198,6 +428,62 @@ async def stop_server(sid: str):
     return JSONResponse({"message": "Server is stopping"})
 
 
+async def _run_bulk_lifecycle(action: str, body: BulkLifecycleModel):
+    servers = manager.get_servers()
+    if body.all:
+        sids = list(servers)
+    else:
+        sids = list(body.sids or [])
+        if body.status is not None:
+            sids += [sid for sid, server in servers.items() if server.status.name == body.status.upper()]
+    if not sids:
+        return JSONResponse({"error": "No servers selected"}, 400)
+    results = await lifecycle.run(action, sids, stop_timeout=body.timeout, parallelism=body.parallelism)
+    return JSONResponse({"results": results}, 200)
+
+
+async def _create_server_batch(body: ServerBatchModel):
+    template = templates.get(body.template)
+    if template is None:
+        return JSONResponse({"error": "Template not found"}, 404)
+    sids = []
+    for name in body.names:
+        try:
+            sid, _ = await manager.create_new_server(name=name, version=template.version)
+        except Exception as e:
+            return JSONResponse({"error": str(e), "servers": sids}, 500)
+        sids.append(sid)
+    _watch_new_servers()
+    job = job_queue.submit(
+        "install_servers", tuple(sids),
+        partial(install_servers_job, manager=manager, job_queue=job_queue, artifacts=artifacts,
+                copy_engine=copy_engine, sids=sids, template=template, templates=templates),
+        f"Install {len(sids)} servers from template {template.name}"
+    )
+    return JSONResponse({"servers": sids, "jid": job.jid}, 202)
+
+
+# Starlette drops a literal ":action" at the end of a path, so the action has to be a path parameter
+@router.post("/servers:{action}", response_model=Union[ServerBatchResponse, BulkLifecycleResponse])
+async def bulk_lifecycle(action: str, body: Union[ServerBatchModel, BulkLifecycleModel]):
+    """
+    Start, stop or restart many servers (/servers:start, /servers:stop, /servers:restart).
+    Servers are stopped gracefully and killed if they don't stop within the timeout.
+
+    /servers:batch creates many servers from a template. The servers are created immediately and installed by
+    a job, with the server jar and the base files of the template hardlinked from the cache.
+    """
+    if action == "batch":
+        if not isinstance(body, ServerBatchModel):
+            return JSONResponse({"error": "template and names are required"}, 422)
+        return await _create_server_batch(body)
+    if action not in lifecycle.actions:
+        return JSONResponse({"error": "Not found"}, 404)
+    if not isinstance(body, BulkLifecycleModel):
+        return JSONResponse({"error": "No servers selected"}, 400)
+    return await _run_bulk_lifecycle(action, body)
+
+
 @router.post("/servers/{sid}/command")
 async def send_command(sid: str, command: ServerCommand):
     server = manager.get_server(sid)
@@ -211,12 +497,104 @@ async def send_command(sid: str, command: ServerCommand):
     return 200
 
 
+@router.post("/servers/{sid}/commands", response_model=CommandBatchResponse)
+async def send_commands(sid: str, batch: CommandBatchModel):
+    """
+    Queue several commands. The commands of a server are sent with a rate limit, identical commands that are
+    still queued are only sent once. A command with expect waits for a matching console line.
+    Without wait, the commands are queued and 202 is returned immediately.
+    """
+    queue = command_pipeline.get_queue(sid)
+    if queue is None:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if not queue.server.is_running:
+        return JSONResponse({"error": "Server is not running"}, 400)
+    futures = [
+        queue.submit(command.command, command.expect, command.timeout if command.timeout is not None else batch.timeout)
+        for command in batch.commands
+    ]
+    if not batch.wait:
+        return JSONResponse({"message": f"Queued {len(futures)} commands", "queued": len(queue)}, 202)
+    # shielded, the futures may be shared with coalesced commands of other requests
+    return JSONResponse({"results": list(await asyncio.gather(*map(asyncio.shield, futures)))}, 200)
+
+
+@router.get("/servers/{sid}/commands")
+async def get_command_queue(sid: str):
+    queue = command_pipeline.get_queue(sid)
+    if queue is None:
+        return JSONResponse({"error": "Server not found"}, 404)
+    return JSONResponse(queue.to_dict(), 200)
+
+
+@router.put("/servers/{sid}/commands/rate_limit")
+async def set_command_rate_limit(sid: str, limits: CommandRateLimitModel):
+    queue = command_pipeline.get_queue(sid)
+    if queue is None:
+        return JSONResponse({"error": "Server not found"}, 404)
+    queue.set_limits(limits.rate, limits.burst)
+    return JSONResponse(queue.to_dict(), 200)
+
+
+@router.websocket("/servers/{sid}/commands/websocket")
+async def commands_websocket(websocket: WebSocket, sid: str, timeout: float = 5):
+    """
+    Send commands as {"command": ..., "expect": ..., "timeout": ..., "id": ...}. The result of every command is
+    sent as soon as it is done, with the id of the command.
+    """
+    queue = command_pipeline.get_queue(sid)
+    if queue is None:
+        return
+    await websocket.accept()
+    subscriber = Subscriber(max_queue_size=10000)
+
+    async def wait_for_result(future: asyncio.Future, command_id):
+        # shielded, cancelling this task on disconnect must not cancel a future shared with other clients
+        result = await asyncio.shield(future)
+        subscriber.put(json.dumps({**result, "id": command_id}))
+
+    async def read():
+        pending = set()
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                try:
+                    data = json.loads(message.get("text") or message.get("bytes") or b"")
+                    command = CommandModel.parse_obj(data)
+                except ValueError as e:
+                    subscriber.put(json.dumps({"result": "error", "error": f"Invalid command: {e}"}))
+                    continue
+                future = queue.submit(command.command, command.expect,
+                                      command.timeout if command.timeout is not None else timeout)
+                task = asyncio.create_task(wait_for_result(future, data.get("id")))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def write():
+        while True:
+            await websocket.send_text(await subscriber.get())
+
+    tasks = [asyncio.create_task(write()), asyncio.create_task(read())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 @router.get("/servers/{sid}/worlds", response_model=ServerWorldsResponse)
 async def get_worlds(sid: str):
     server = manager.get_server(sid)
     if not server:
         return JSONResponse({"error": "Server not found"}, 404)
-    return JSONResponse({"worlds": _get_worlds(server)}, 200)
+    await world_index.refresh()
+    return JSONResponse({"worlds": world_index.get_worlds(sid)}, 200)
 
 
 @router.post("/servers/{sid}/copy_world")
@@ -234,11 +612,105 @@ async def copy_world(sid: str, dest: str = None, world_name: str = None, overrid
     world = server.get_world(world_name)
     if not world:
         return JSONResponse({"error": "World not found"}, 404)
-    try:
-        await world.copy_to_server(dest_server, override=override)
-    except [IsADirectoryError, NotADirectoryError, OSError]:
-        return JSONResponse({"message": "Failed to copy world, directory already exists"})
-    return JSONResponse({"message": "Copied world to server"}, 200)
+    if sid == dest:
+        return JSONResponse({"error": "Source and destination are the same server"}, 400)
+    destination = Path(dest_server.server_config.path) / "worlds" / world.name
+    if destination.exists() and not override:
+        return JSONResponse({"error": "The destination server already has a world with this name"}, 409)
+
+    job = job_queue.submit(
+        "copy_world", (sid, world.name, dest),
+        partial(copy_world_job, manager=manager, job_queue=job_queue, copy_engine=copy_engine, sid=sid,
+                world_name=world.name, dest=dest, override=override),
+        f"Copy world {world.name} from server {sid} to server {dest}"
+    )
+    return JSONResponse({"message": "Copying world to server", "jid": job.jid}, 202)
+
+
+def _submit_world_scan(sid: str, world_name: str) -> Job:
+    return job_queue.submit(
+        "scan_world", (sid, world_name),
+        partial(scan_world_job, manager=manager, job_queue=job_queue, region_index=region_index, sid=sid,
+                world_name=world_name),
+        f"Scan regions of world {world_name} of server {sid}"
+    )
+
+
+@router.post("/servers/{sid}/worlds/{world_name}/scan", status_code=202)
+async def scan_world(sid: str, world_name: str):
+    """
+    Update the region statistics of a world. Only region files that changed since the last scan are read.
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if not is_map_directory(Path(server.server_config.path) / "worlds" / world_name):
+        return JSONResponse({"error": "World not found"}, 404)
+    job = _submit_world_scan(sid, world_name)
+    return JSONResponse({"message": "World will be scanned", "jid": job.jid}, 202)
+
+
+@router.get("/servers/{sid}/worlds/{world_name}/stats", response_model=WorldStatsResponse)
+async def get_world_stats(sid: str, world_name: str, radius: Optional[int] = Query(None, ge=0, le=100000)):
+    """
+    Chunk counts, region file sizes, entity and tile entity counts per dimension, from the last scan.
+    With radius, coverage is the share of generated chunks within radius chunks around 0, 0.
+    If the world was never scanned, a scan is started and 202 is returned.
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if not is_map_directory(Path(server.server_config.path) / "worlds" / world_name):
+        return JSONResponse({"error": "World not found"}, 404)
+    stats = await region_index.query(region_index.get_stats, sid, world_name, radius)
+    if stats is None:
+        job = _submit_world_scan(sid, world_name)
+        return JSONResponse({"message": "World will be scanned", "jid": job.jid}, 202)
+    return JSONResponse(stats, 200)
+
+
+@router.get("/servers/{sid}/worlds/{world_name}/hotspots", response_model=WorldHotspotsResponse)
+async def get_world_hotspots(sid: str, world_name: str, metric: str = "entities", dimension: Optional[str] = None,
+                             limit: int = Query(20, ge=1, le=1000)):
+    """
+    The chunks with the most entities, tile entities, the largest size or the longest inhabited time,
+    from the last scan
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if metric not in hotspot_metrics:
+        return JSONResponse({"error": f"metric must be one of {', '.join(hotspot_metrics)}"}, 400)
+    if await region_index.query(region_index.get_scan, sid, world_name) is None:
+        return JSONResponse({"error": "World was not scanned yet"}, 404)
+    hotspots = await region_index.query(region_index.get_hotspots, sid, world_name, metric, dimension, limit)
+    return JSONResponse({"metric": metric, "hotspots": hotspots}, 200)
+
+
+@router.post("/servers/{sid}/worlds/{world_name}/prune", status_code=202)
+async def prune_world(sid: str, world_name: str, body: PruneWorldModel):
+    """
+    Remove chunks outside of a radius that players spent little time in, and rewrite the region files without
+    gaps. Without a radius, the region files are only compacted. Run with dry_run first, the result of the job
+    contains the bytes that would be saved. The server has to be stopped to prune its active world.
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    world = server.get_world(world_name)
+    if not world:
+        return JSONResponse({"error": "World not found"}, 404)
+    if not body.dry_run and server.is_running and server.active_world is not None \
+            and server.active_world.name == world.name:
+        return JSONResponse({"error": "The server has to be stopped to prune its active world"}, 409)
+    job = job_queue.submit(
+        "prune_world", (sid, world.name, body.dry_run),
+        partial(prune_world_job, manager=manager, job_queue=job_queue, region_index=region_index,
+                lifecycle=lifecycle, sid=sid, world_name=world.name, radius=body.radius, center=(body.center_x, body.center_z),
+                max_inhabited_time=body.max_inhabited_time, dry_run=body.dry_run),
+        f"{'Estimate pruning' if body.dry_run else 'Prune'} world {world.name} of server {sid}"
+    )
+    return JSONResponse({"message": "World will be pruned", "jid": job.jid}, 202)
 
 
 @router.post("/servers/{sid}/create_world")
@@ -250,7 +722,13 @@ async def create_world(sid: str, world_generation_settings: WorldGenerationData)
         await server.create_new_world(world_generation_settings.name, world_generation_settings.data)
     except WorldExistsException:
         return JSONResponse({"error": "A world with this name does already exist"})
-    asyncio.create_task(server.set_active_world(world_generation_settings.name, new=True))
+    journal.record_properties(sid)
+
+    async def set_active_world():
+        await server.set_active_world(world_generation_settings.name, new=True)
+        journal.record_properties(sid)
+
+    asyncio.create_task(set_active_world())
     return JSONResponse({"message": "The new world will be created after restart"}, 202)
 
 
@@ -259,42 +737,125 @@ async def change_world(sid: str, world_name: str):
     server = manager.get_server(sid)
     if not server:
         return JSONResponse({"error": "Server not found"}, 404)
-    asyncio.create_task(server.set_active_world(world_name))
+
+    async def set_active_world():
+        await server.set_active_world(world_name)
+        journal.record_properties(sid)
+
+    asyncio.create_task(set_active_world())
     return JSONResponse({"message": f"Set active world to {world_name}"}, 202)
 
 
 @router.websocket("/servers/{sid}/websocket")
-async def websocket_stream(websocket: WebSocket, sid: str):
+async def websocket_stream(websocket: WebSocket, sid: str, overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE,
+                           after_seq: Optional[int] = None):
+    """
+    Without after_seq, the last lines of the console are sent first. To resume after a reconnect, pass
+    the seq of the last received output message and only the missing lines are sent. If lines were already
+    discarded, the first output message has "gap" with the number of missing lines.
+    """
     server = manager.get_server(sid)
     if not server:
         return
     await websocket.accept()
 
-    async def wrap_json(output: Union[str, dict], callback_name: str):
-        if callback_name == "status":
-            output = output.name
-        await websocket.send_json({"type": callback_name, "value": output})
-
-    server.callbacks.system_metrics.add_callback(partial(wrap_json, callback_name="system_metrics"))
-    server.callbacks.properties.add_callback(partial(wrap_json, callback_name="properties"))
-    server.callbacks.output.add_callback(partial(wrap_json, callback_name="output"))
-    server.callbacks.players.add_callback(partial(wrap_json, callback_name="players"))
-    server.callbacks.status.add_callback(partial(wrap_json, callback_name="status"))
-
+    console_log = console_logs.get_console_log(sid)
+    messages = []
+    if console_log is not None:
+        if after_seq is None:
+            messages = [console_log.to_message()]
+        else:
+            # no await between reading the lines and subscribing, so no line is missed
+            messages = await console_log.get_resume_messages(after_seq)
+    subscription = server_subscriptions.subscribe(sid, server, overflow_policy=overflow_policy,
+                                                  console_log=console_log)
     try:
-        await wrap_json(server.logs, "output")
-        players = server.players
-        players = {
-            "online_players": [dataclasses.asdict(player) for player in players["online_players"]],
-            "op_players": [dataclasses.asdict(player) for player in players["op_players"]],
-            "banned_players": [dataclasses.asdict(player) for player in players["banned_players"]]
-        }
-        await wrap_json(players, "players")
-        await wrap_json(server.system_load, "system_metrics")
-        while True:
-            await asyncio.sleep(1)
+        if console_log is not None:
+            # sent directly, the pages may be more than the queue of the subscriber holds
+            for message in messages:
+                await websocket.send_text(message)
+        else:
+            subscription.put(server.logs, "output")
+        subscription.subscriber.put(snapshots.get_players_message(sid), key="players")
+        subscription.put(server.system_load, "system_metrics")
+        await _send_messages(websocket, subscription.subscriber)
     except Exception:
         return
+    finally:
+        server_subscriptions.unsubscribe(subscription)
+
+
+@router.websocket("/stream")
+async def stream(websocket: WebSocket, encoding: str = StreamEncoding.JSON.value, flush_interval: float = 0.05):
+    """
+    One websocket for many servers. Send {"action": "subscribe", "topics": [...]} or
+    {"action": "unsubscribe", "topics": [...]} to choose the topics: server:{sid}:output, server:{sid}:metrics,
+    server:{sid}:status, server:{sid}:players, server:{sid}:properties and jobs, where sid may be *.
+    Events are sent in batches as a list of {"topic", "data", "seq"} every flush_interval seconds.
+    With encoding=msgpack, batches are sent as binary msgpack frames, json frames can be compressed with
+    permessage-deflate by the client.
+    """
+    await websocket.accept()
+    if encoding not in get_stream_encodings():
+        await websocket.send_text(json.dumps({"error": f"Unsupported encoding, use one of {get_stream_encodings()}"}))
+        await websocket.close(1003)
+        return
+    connection = StreamConnection(StreamEncoding(encoding), flush_interval=min(max(flush_interval, 0), 1))
+    await stream_hub.serve(websocket, connection)
+
+
+@router.get("/servers/{sid}/logs", response_model=ConsoleLogResponse)
+async def get_logs(sid: str, after_seq: Optional[int] = None, limit: int = 500):
+    """
+    Console lines after the sequence number after_seq. Without after_seq, the last lines are returned.
+    Continue with the next_seq of the response to get the following page.
+    """
+    console_log = console_logs.get_console_log(sid)
+    if not console_log:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if limit < 1 or limit > 5000:
+        return JSONResponse({"error": "limit must be between 1 and 5000"}, 400)
+    lines = await console_log.get_lines(after_seq, limit)
+    return JSONResponse({
+        "lines": [{"seq": seq, "line": line} for seq, line in lines],
+        "first_seq": console_log.first_seq,
+        "next_seq": lines[-1][0] if lines else (after_seq if after_seq is not None else console_log.last_seq),
+        "last_seq": console_log.last_seq
+    }, 200)
+
+
+@router.get("/servers/{sid}/metrics", response_model=MetricsHistoryResponse)
+async def get_metrics(sid: str, start: Optional[float] = Query(None, alias="from"),
+                      end: Optional[float] = Query(None, alias="to"), step: Optional[float] = None):
+    """
+    History of the system metrics of the server. from and to are unix timestamps, the default is the last hour.
+    The resolution is chosen by the age of from: raw samples for the last hour, minute rollups for the last day
+    and hour rollups for the last 30 days. With step, the samples are aggregated into buckets of step seconds.
+    Raw samples are 5 seconds apart, smaller steps are raised to that.
+    """
+    history = metrics_store.get_history(sid)
+    if history is None:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if step is not None and step < 1:
+        return JSONResponse({"error": "step must be at least 1 second"}, 400)
+    end = time.time() if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        return JSONResponse({"error": "from must not be after to"}, 400)
+    return JSONResponse(history.query(start, end, step), 200)
+
+
+@router.get("/servers/{sid}/subscriptions")
+async def get_subscriptions(sid: str):
+    """
+    Queue statistics of all websocket connections of the server
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    return JSONResponse({
+        "subscriptions": [subscription.to_dict() for subscription in server_subscriptions.get_subscriptions(sid)]
+    }, 200)
 
 
 @router.delete("/servers/{sid}")
@@ -303,6 +864,8 @@ async def delete_server(sid: str):
         manager.delete_server(sid)
     except ServerRunningException:
         return JSONResponse({"message": "Server is running"}, 400)
+    _watch_new_servers()
+    await region_index.query(region_index.forget, sid)
 
     return JSONResponse({"message": "Server deleted"}, 200)
 
@@ -324,8 +887,7 @@ async def upload_world(sid: str, in_file: UploadFile = File(...)):
     if not server:
         return 404
 
-    dir_name = in_file.filename.replace(".zip", "")
-    dir_name = "".join(c for c in dir_name if c.isalnum() or c in "_- !()[]{}")
+    dir_name = get_world_dir_name(in_file.filename)
 
     if not dir_name:
         return JSONResponse({"error": "Invalid world name"}, 400)
@@ -340,15 +902,138 @@ async def upload_world(sid: str, in_file: UploadFile = File(...)):
         # Maybe override
         return WorldUploadResponse(message="World exists")
 
-    # find a better async option
-    with zipfile.ZipFile(io.BytesIO(await in_file.read()), 'r') as zip_file:
-        zip_file.extractall(str(out_file_path))
+    # The upload is already spooled to disk, extract it without blocking the event loop
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, extract_world, in_file.file, out_file_path, world_uploads.limits
+        )
+    except Exception as e:
+        # also when writing failed, the partially extracted world must not be loaded
+        await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, out_file_path, True)
+        if isinstance(e, (UploadException, zipfile.BadZipFile)):
+            return JSONResponse({"error": str(e)}, 400)
+        raise
 
     server.load_worlds()
+    world_index.invalidate(sid)
 
     return WorldUploadResponse(message="success"), 201
 
 
+async def _extract_upload(upload, server, destination: Path):
+    try:
+        await world_uploads.extract(upload, destination)
+    except Exception:
+        # the error is stored in the upload
+        return
+    server.load_worlds()
+    world_index.invalidate(upload.sid)
+
+
+@router.post("/servers/{sid}/uploads", response_model=WorldUploadStatusModel, status_code=201)
+async def create_world_upload(sid: str, data: WorldUploadCreationData):
+    """
+    Start a resumable world upload. Send the zip file in one or more chunks to /uploads/{uid}
+    and finish the upload with /uploads/{uid}/complete.
+    """
+    server = manager.get_server(sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if not data.filename.endswith(".zip"):
+        return JSONResponse({"error": "File must be a zip file"}, 400)
+
+    dir_name = get_world_dir_name(data.filename)
+    if not dir_name:
+        return JSONResponse({"error": "Invalid world name"}, 400)
+    out_file_path = Path(server.server_config.path) / "worlds" / dir_name
+    if out_file_path.is_dir() and any(out_file_path.iterdir()):
+        return JSONResponse({"error": "World exists"}, 409)
+
+    try:
+        upload = await world_uploads.create_upload(sid, dir_name, data.size)
+    except UploadException as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return JSONResponse(upload.to_dict(), 201)
+
+
+@router.get("/uploads/{uid}", response_model=WorldUploadStatusModel)
+async def get_world_upload(uid: str):
+    upload = world_uploads.get_upload(uid)
+    if not upload:
+        return JSONResponse({"error": "Upload not found"}, 404)
+    return JSONResponse(upload.to_dict(), 200)
+
+
+@router.put("/uploads/{uid}", response_model=WorldUploadStatusModel)
+async def upload_world_chunk(uid: str, request: Request, offset: int = 0):
+    """
+    Append the raw request body to the upload at the given offset.
+    If the connection breaks, get the upload and continue at the received offset.
+    """
+    upload = world_uploads.get_upload(uid)
+    if not upload:
+        return JSONResponse({"error": "Upload not found"}, 404)
+    try:
+        await world_uploads.write_chunk(upload, offset, request.stream())
+    except UploadOffsetException as e:
+        return JSONResponse({"error": str(e), "received": upload.received}, 409)
+    except UploadException as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return JSONResponse(upload.to_dict(), 200)
+
+
+@router.post("/uploads/{uid}/complete", response_model=WorldUploadStatusModel, status_code=202)
+async def complete_world_upload(uid: str):
+    """
+    Extract the uploaded world in the background. Progress is available at /uploads/{uid}/websocket
+    """
+    upload = world_uploads.get_upload(uid)
+    if not upload:
+        return JSONResponse({"error": "Upload not found"}, 404)
+    server = manager.get_server(upload.sid)
+    if not server:
+        return JSONResponse({"error": "Server not found"}, 404)
+    if upload.state != "uploading":
+        return JSONResponse({"error": f"Upload is {upload.state}"}, 400)
+    if upload.received != upload.size:
+        return JSONResponse({"error": f"Upload is incomplete, received {upload.received} of {upload.size} bytes"},
+                            400)
+
+    out_file_path = Path(server.server_config.path) / "worlds" / upload.world_name
+    if out_file_path.is_dir() and any(out_file_path.iterdir()):
+        return JSONResponse({"error": "World exists"}, 409)
+    out_file_path.mkdir(parents=True, exist_ok=True)
+
+    asyncio.create_task(_extract_upload(upload, server, out_file_path))
+    return JSONResponse(upload.to_dict(), 202)
+
+
+@router.delete("/uploads/{uid}")
+async def delete_world_upload(uid: str):
+    upload = world_uploads.get_upload(uid)
+    if not upload:
+        return JSONResponse({"error": "Upload not found"}, 404)
+    if upload.state == "extracting":
+        return JSONResponse({"error": "Upload is extracting"}, 400)
+    await world_uploads.remove_upload(uid)
+    return JSONResponse({"message": "Upload deleted"}, 200)
+
+
+@router.websocket("/uploads/{uid}/websocket")
+async def world_upload_websocket(websocket: WebSocket, uid: str):
+    upload = world_uploads.get_upload(uid)
+    if not upload:
+        return
+    await websocket.accept()
+    subscriber = upload.subscribe()
+    try:
+        await _send_messages(websocket, subscriber)
+    except Exception:
+        return
+    finally:
+        upload.unsubscribe(subscriber)
+
+
 @router.post("/servers/{sid}/backup")
 async def create_backup(sid: str, body: CreateBackupModel):
     server = manager.get_server(sid)
@@ -359,18 +1044,57 @@ async def create_backup(sid: str, body: CreateBackupModel):
     if not world:
         return 404
 
-    asyncio.create_task(manager.backup_manager.create_backup(sid, body.world_name))
+    job = job_queue.submit(
+        "backup", (sid, body.world_name, body.incremental),
+        partial(create_backup_job, manager=manager, job_queue=job_queue, sid=sid, world_name=body.world_name,
+                incremental_store=incremental_store if body.incremental else None),
+        f"Backup world {body.world_name} of server {sid}"
+    )
+
+    return JSONResponse({"message": "Backup will be created", "jid": job.jid}, 202)
 
-    return 200
+
+@router.get("/servers/backups/bulk")
+def download_backups(bids: List[str] = Query(...), archive_format: str = Query("zip", alias="format")):
+    """
+    Download several backups as one archive, which is created on the fly.
+    Every backup is stored in a directory named by its id.
+    """
+    if archive_format not in get_archive_formats():
+        return JSONResponse({"message": f"Supported formats: {', '.join(get_archive_formats())}"}, 400)
+    backups = []
+    for bid in bids:
+        backup = manager.backup_manager.get_backup(bid)
+        if not backup:
+            return JSONResponse({"message": f"Backup {bid} not found"}, 404)
+        backups.append((bid, backup))
+
+    def entries():
+        for bid, backup in backups:
+            yield from iter_backup_entries(backup, incremental_store, prefix=f"{bid}/")
+
+    return archive_response(entries(), archive_format, "backups")
 
 
 @router.get("/servers/backups/{bid}")
-def download_backup(bid: str):
+def download_backup(bid: str, request: Request, archive_format: Optional[str] = Query(None, alias="format")):
+    """
+    Download a backup. Zip backups support range requests to resume a download. Pass a format to convert the
+    backup on the fly, incremental backups are always converted to a zip file by default.
+    """
     backup = manager.backup_manager.get_backup(bid)
     if not backup:
         return JSONResponse({"message": "Backup not found"}, 404)
+    if archive_format is not None and archive_format not in get_archive_formats():
+        return JSONResponse({"message": f"Supported formats: {', '.join(get_archive_formats())}"}, 400)
 
-    return FileResponse(backup.path, 200)
+    if archive_format is None and not is_incremental(backup):
+        return file_response(request, backup.path, backup_etag(bid, backup), f"{bid}.zip")
+
+    etag = backup_etag(bid, backup, archive_format or "zip")
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return archive_response(iter_backup_entries(backup, incremental_store), archive_format or "zip", bid, etag)
 
 
 @router.post("/servers/backups/{bid}/restore")
@@ -379,9 +1103,14 @@ async def restore_backup(bid: str):
     if not backup:
         return JSONResponse({"message": "Backup not found"}, 404)
 
-    asyncio.create_task(manager.backup_manager.restore_backup(bid))
+    job = job_queue.submit(
+        "restore", bid,
+        partial(restore_backup_job, manager=manager, job_queue=job_queue, lifecycle=lifecycle, bid=bid,
+                incremental_store=incremental_store),
+        f"Restore backup {bid}"
+    )
 
-    return 202
+    return JSONResponse({"message": "Backup will be restored", "jid": job.jid}, 202)
 
 
 @router.post("/servers/backups/{bid}/delete")
@@ -390,9 +1119,330 @@ async def delete_backup(bid: str):
     if not backup:
         return JSONResponse({"message": "Backup not found"}, 404)
 
-    manager.backup_manager.delete_backup(bid)
+    job = job_queue.submit(
+        "delete_backup", bid,
+        partial(delete_backup_job, manager=manager, job_queue=job_queue, incremental_store=incremental_store, bid=bid),
+        f"Delete backup {bid}"
+    )
+    return JSONResponse({"message": "Backup will be deleted", "jid": job.jid}, 202)
 
-    return 200
+
+@router.post("/servers/backups/retention")
+async def apply_backup_retention(policy: BackupRetentionModel):
+    """
+    Delete all backups that exceed the retention policy and free the storage of incremental backups,
+    that is not used anymore
+    """
+    job = job_queue.submit(
+        "retention", (policy.sid, policy.keep_last, policy.max_age),
+        partial(apply_retention_job, manager=manager, job_queue=job_queue, incremental_store=incremental_store,
+                keep_last=policy.keep_last, max_age=policy.max_age, sid=policy.sid),
+        "Apply backup retention policy"
+    )
+    return JSONResponse({"message": "Retention policy will be applied", "jid": job.jid}, 202)
+
+
+@router.get("/templates", response_model=TemplatesResponse)
+async def get_templates():
+    return JSONResponse({"templates": [template.to_dict() for template in templates.templates.values()]}, 200)
+
+
+@router.get("/templates/{name}")
+async def get_template(name: str):
+    template = templates.get(name)
+    if template is None:
+        return JSONResponse({"error": "Template not found"}, 404)
+    return JSONResponse(template.to_dict(), 200)
+
+
+@router.post("/templates", status_code=202)
+async def create_template(body: TemplateCreationModel):
+    """
+    Create a template. With a sid, the libraries and versions the server jar extracted on the first start are
+    copied from that server, and the world as seed world, so servers created from the template start faster.
+    """
+    server = None
+    if body.sid is not None:
+        server = manager.get_server(body.sid)
+        if server is None:
+            return JSONResponse({"error": "Server not found"}, 404)
+        if body.world is not None and not server.world_exits(body.world):
+            return JSONResponse({"error": "World not found"}, 404)
+    elif body.world is not None:
+        return JSONResponse({"error": "A world requires a source server"}, 400)
+    version = body.version or (server.server_config.version if server is not None else None)
+    if version is None:
+        return JSONResponse({"error": "A version or a source server is required"}, 400)
+    template = ServerTemplate(name=body.name, version=version, properties=body.properties)
+
+    async def create(job: Job):
+        await job_queue.run_blocking(templates.create, template, server, body.world, job.report)
+        return template.to_dict()
+
+    job = job_queue.submit("create_template", body.name, create, f"Create template {body.name}")
+    return JSONResponse({"message": "Template will be created", "jid": job.jid}, 202)
+
+
+@router.delete("/templates/{name}")
+async def delete_template(name: str):
+    if templates.get(name) is None:
+        return JSONResponse({"error": "Template not found"}, 404)
+    await job_queue.run_blocking(templates.delete, name)
+    return JSONResponse({"message": f"Deleted template {name}"}, 200)
+
+
+@router.get("/artifacts")
+async def get_artifacts():
+    return JSONResponse(artifacts.to_dict(), 200)
+
+
+@router.get("/servers/{sid}/policy", response_model=ServerPolicyStateResponse)
+async def get_server_policy(sid: str):
+    if not manager.get_server(sid):
+        return JSONResponse({"error": "Server not found"}, 404)
+    return JSONResponse(scheduler.get_state(sid), 200)
+
+
+@router.put("/servers/{sid}/policy", response_model=ServerPolicyStateResponse)
+async def set_server_policy(sid: str, policy: ServerPolicyModel):
+    """
+    Set the hibernation, wake-on-connect and memory policy of a server. Hibernation enables the query
+    protocol of the server, which is needed to know the online players.
+    """
+    if not manager.get_server(sid):
+        return JSONResponse({"error": "Server not found"}, 404)
+    await scheduler.set_policy(sid, ServerPolicy(**policy.dict()))
+    journal.record_properties(sid)
+    return JSONResponse(scheduler.get_state(sid), 200)
+
+
+@router.get("/scheduler", response_model=SchedulerResponse)
+async def get_scheduler():
+    """
+    Free memory for servers, queued starts and hibernated servers
+    """
+    return JSONResponse(scheduler.to_dict(), 200)
+
+
+@router.get("/node")
+async def get_node():
+    """
+    The load of this instance, an aggregator places new servers on the least loaded node
+    """
+    return JSONResponse(get_node_load(manager), 200)
+
+
+@router.get("/jobs", response_model=JobsResponse)
+async def get_jobs():
+    return JSONResponse({"jobs": [job.to_dict() for job in job_queue.jobs.values()]}, 200)
+
+
+@router.get("/jobs/{jid}", response_model=JobModel)
+async def get_job(jid: str):
+    job = job_queue.get_job(jid)
+    if not job:
+        return JSONResponse({"error": "Job not found"}, 404)
+    return JSONResponse(job.to_dict(), 200)
+
+
+@router.websocket("/jobs/websocket")
+async def jobs_websocket(websocket: WebSocket):
+    """
+    Sends the state and progress of all jobs whenever they change
+    """
+    await websocket.accept()
+    subscriber = job_queue.subscribe()
+    try:
+        for job in job_queue.jobs.values():
+            subscriber.put(json.dumps(job.to_dict()), key=job.jid)
+        await _send_messages(websocket, subscriber)
+    except Exception:
+        return
+    finally:
+        job_queue.unsubscribe(subscriber)
+
+
+@cluster_router.get("/cluster/nodes")
+async def get_cluster_nodes():
+    loads = await cluster.get_loads()
+    return JSONResponse({"nodes": [{**node.to_dict(), "load": loads.get(name)}
+                                   for name, node in cluster.nodes.items()]}, 200)
+
+
+@cluster_router.get("/cluster/placement")
+async def get_cluster_placement():
+    """
+    The node a new server would be created on
+    """
+    node = await cluster.place()
+    if node is None:
+        return JSONResponse({"error": "No node is reachable"}, 503)
+    return JSONResponse({"node": node.name}, 200)
+
+
+@cluster_router.get("/servers", response_model=GetServersResponse)
+async def get_cluster_servers():
+    return JSONResponse(await cluster.get_servers(), 200)
+
+
+@cluster_router.get("/worlds", response_model=AllWorldsResponse)
+async def get_cluster_worlds():
+    return JSONResponse(await cluster.get_worlds(), 200)
+
+
+@cluster_router.get("/players", response_model=PlayerSearchResponse)
+async def search_cluster_players(q: str = "", role: Optional[str] = None, online: Optional[bool] = None,
+                                 limit: int = Query(50, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    if role is not None and role not in player_roles:
+        return JSONResponse({"error": f"role must be one of {', '.join(player_roles)}"}, 400)
+    return JSONResponse(await cluster.search_players(q, role, online, limit, offset), 200)
+
+
+@cluster_router.get("/jobs", response_model=JobsResponse)
+async def get_cluster_jobs():
+    return JSONResponse(await cluster.get_jobs(), 200)
+
+
+@cluster_router.get("/jobs/{jid}", response_model=JobModel)
+async def get_cluster_job(jid: str, request: Request):
+    split = cluster.split_id(jid)
+    if split is None:
+        return JSONResponse({"error": "Job not found"}, 404)
+    node, local_jid = split
+    return await cluster.forward(node, request, f"/api/jobs/{local_jid}")
+
+
+@cluster_router.post("/servers", response_model=ServerCreatedModel)
+async def create_cluster_server(request: Request, node: Optional[str] = None):
+    """
+    Create the server on the given node, or on the least loaded node
+    """
+    target = cluster.nodes.get(node) if node is not None else await cluster.place()
+    if target is None:
+        return JSONResponse({"error": "Node not found" if node is not None else "No node is reachable"},
+                            404 if node is not None else 503)
+    return await cluster.forward(target, request, "/api/servers", params=[])
+
+
+@cluster_router.post("/servers:{action}")
+async def cluster_bulk_lifecycle(action: str, request: Request, node: Optional[str] = None):
+    """
+    Lifecycle actions are sent to the nodes of the sids. Batches are created on the given or least loaded node.
+    """
+    if action == "batch":
+        target = cluster.nodes.get(node) if node is not None else await cluster.place()
+        if target is None:
+            return JSONResponse({"error": "No node is reachable"}, 503)
+        return await cluster.forward(target, request, "/api/servers:batch", params=[])
+    if action not in lifecycle.actions:
+        return JSONResponse({"error": "Not found"}, 404)
+    try:
+        body = BulkLifecycleModel.parse_raw(await request.body())
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 422)
+    if not body.sids and not body.all and body.status is None:
+        return JSONResponse({"error": "No servers selected"}, 400)
+    return JSONResponse(await cluster.bulk_lifecycle(action, body.dict()), 200)
+
+
+@cluster_router.websocket("/servers")
+async def get_cluster_servers_websocket(websocket: WebSocket):
+    await cluster.serve_server_lists(websocket)
+
+
+@cluster_router.websocket("/jobs/websocket")
+async def cluster_jobs_websocket(websocket: WebSocket):
+    await cluster.serve_jobs(websocket)
+
+
+@cluster_router.websocket("/stream")
+async def cluster_stream(websocket: WebSocket, encoding: str = StreamEncoding.JSON.value,
+                         flush_interval: float = 0.05):
+    """
+    /stream of all nodes, with the sids of the aggregator in the topics
+    """
+    await websocket.accept()
+    if encoding not in get_stream_encodings():
+        await websocket.send_text(json.dumps({"error": f"Unsupported encoding, use one of {get_stream_encodings()}"}))
+        await websocket.close(1003)
+        return
+    connection = StreamConnection(StreamEncoding(encoding), flush_interval=min(max(flush_interval, 0), 1))
+    await cluster.serve_stream(websocket, connection)
+
+
+@cluster_router.get("/servers/backups/bulk")
+async def cluster_download_backups(request: Request):
+    """
+    Backups of one node can be downloaded together
+    """
+    params = []
+    nodes = set()
+    for key, value in request.query_params.multi_items():
+        if key == "bids":
+            split = cluster.split_id(value)
+            if split is None:
+                return JSONResponse({"message": f"Backup {value} not found"}, 404)
+            nodes.add(split[0].name)
+            value = split[1]
+        params.append((key, value))
+    if len(nodes) != 1:
+        return JSONResponse({"message": "The backups must be on the same node"}, 400)
+    return await cluster.forward(cluster.nodes[nodes.pop()], request, "/api/servers/backups/bulk", params)
+
+
+@cluster_router.post("/servers/backups/retention")
+async def cluster_apply_backup_retention(policy: BackupRetentionModel):
+    status, body = await cluster.apply_retention(policy.dict())
+    return JSONResponse(body, status)
+
+
+@cluster_router.get("/servers/backups/{bid}")
+@cluster_router.post("/servers/backups/{bid}/{action}")
+async def forward_backup_to_node(bid: str, request: Request, action: str = ""):
+    """
+    Forward a request for a backup to the node of its server
+    """
+    split = cluster.split_id(bid)
+    if split is None or action not in ("", "restore", "delete"):
+        return JSONResponse({"message": "Backup not found"}, 404)
+    node, local_bid = split
+    return await cluster.forward(node, request, f"/api/servers/backups/{local_bid}" + (f"/{action}" if action else ""))
+
+
+@cluster_router.api_route("/servers/{sid}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+@cluster_router.api_route("/servers/{sid}/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def forward_to_node(sid: str, request: Request, path: str = ""):
+    """
+    Forward a request for a server to its node
+    """
+    split = cluster.split_id(sid)
+    if split is None:
+        return JSONResponse({"error": "Server not found"}, 404)
+    node, local_sid = split
+    params = []
+    for key, value in request.query_params.multi_items():
+        if key == "dest":
+            # the destination of copy_world is a server of the same node
+            dest = cluster.split_id(value)
+            if dest is None or dest[0] is not node:
+                return JSONResponse({"error": "The destination server must be on the same node"}, 400)
+            value = dest[1]
+        params.append((key, value))
+    return await cluster.forward(node, request, f"/api/servers/{local_sid}" + (f"/{path}" if path else ""), params)
+
+
+@cluster_router.websocket("/servers/{sid}/{path:path}")
+async def relay_to_node(websocket: WebSocket, sid: str):
+    split = cluster.split_id(sid)
+    if split is None:
+        await websocket.close(code=1008)
+        return
+    node, local_sid = split
+    # FastAPI 0.81 doesn't pass path converters of websocket routes as parameters
+    path = websocket.path_params["path"]
+    await cluster.relay_websocket(node, websocket, f"/api/servers/{local_sid}/{path}")
 
 
+if cluster is not None:
+    app.include_router(cluster_router)
 app.include_router(router)
@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from mc_server_interaction.manager import ServerManager
+from mc_server_interaction.manager.backup_manager import Backup
+from mc_server_interaction.paths import backup_dir
+
+from mc_server_manager_api.jobs import Job, JobQueue
+from mc_server_manager_api.lifecycle import LifecycleEngine
+from mc_server_manager_api.uploads import UploadLimits, extract_world
+
+# Backups are created by the api, so they don't need the limits of uploaded worlds
+backup_limits = UploadLimits(max_size=2 ** 62, max_entries=2 ** 62, max_uncompressed_size=2 ** 62, max_ratio=2 ** 62)
+
+
+def get_directory_size(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def archive_directory(source: Path, target: Path, progress: Optional[Callable[[int, int], None]] = None):
+    """
+    Create a zip archive of a directory like shutil.make_archive, but report the progress.
+    The archive is written to a temporary file first, so an interrupted backup leaves no broken zip file.
+    """
+    total = get_directory_size(source)
+    processed = 0
+    temp_target = target.with_suffix(".part")
+    with zipfile.ZipFile(temp_target, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for root, dirs, files in os.walk(source):
+            root = Path(root)
+            for name in sorted(dirs):
+                zip_file.write(root / name, str((root / name).relative_to(source)) + "/")
+            for name in sorted(files):
+                path = root / name
+                zip_file.write(path, str(path.relative_to(source)))
+                processed += path.stat().st_size
+                if progress is not None:
+                    progress(processed, total)
+    os.replace(temp_target, target)
+
+
+class BlobStore:
+    """
+    Content addressed storage. Every blob is stored once, named by its sha256 digest.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def blob_path(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        """
+        :return: The digest and whether the blob was new
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if path.exists():
+            return digest, False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".part")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return digest, True
+
+    def get(self, digest: str) -> bytes:
+        with open(self.blob_path(digest), "rb") as f:
+            return f.read()
+
+    def digests(self) -> Iterable[Tuple[str, Path]]:
+        if not self.path.is_dir():
+            return
+        for directory in self.path.iterdir():
+            if directory.is_dir():
+                for path in directory.iterdir():
+                    yield path.name, path
+
+
+class IncrementalBackupStore:
+    """
+    Incremental backups of worlds. Files are split into fixed size chunks, which are stored in a blob store,
+    so chunks that did not change since the last backup are stored only once. Region files are only updated
+    in place, so most of their chunks stay the same. Every backup is described by a manifest with the chunk
+    digests of each file.
+    """
+
+    def __init__(self, path: Path, chunk_size: int = 1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.blobs = BlobStore(path / "blobs")
+        self.manifest_dir = path / "manifests"
+        # garbage collection must not remove blobs of a backup whose manifest is not written yet
+        self._lock = threading.Lock()
+
+    def manifest_path(self, bid: str) -> Path:
+        return self.manifest_dir / f"{bid}.manifest.json"
+
+    @staticmethod
+    def load_manifest(path: Path) -> dict:
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def create(self, source: Path, bid: str, previous_manifests: Iterable[Path] = (),
+               progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """
+        Back up a directory. Files with the same size and modification time as in the previous manifest
+        are not read again. The previous manifest is loaded under the lock, so garbage collection can't remove
+        the blobs it references before the new manifest is written.
+        :param previous_manifests: Candidates for the previous manifest, newest first. The first one that still
+        exists is used
+        """
+        with self._lock:
+            previous = None
+            for path in previous_manifests:
+                try:
+                    previous = self.load_manifest(path)
+                    break
+                except FileNotFoundError:
+                    continue
+            return self._create(source, bid, previous, progress)
+
+    def _create(self, source: Path, bid: str, previous: Optional[dict],
+                progress: Optional[Callable[[int, int], None]]) -> dict:
+        previous_files = previous["files"] if previous else {}
+        total = get_directory_size(source)
+        processed = 0
+        stored = 0
+        files = {}
+        for root, _, names in os.walk(source):
+            root = Path(root)
+            for name in sorted(names):
+                path = root / name
+                rel_path = path.relative_to(source).as_posix()
+                stat = path.stat()
+                entry = previous_files.get(rel_path)
+                if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                    chunks = []
+                    with open(path, "rb") as f:
+                        while True:
+                            data = f.read(self.chunk_size)
+                            if not data:
+                                break
+                            digest, new = self.blobs.put(data)
+                            if new:
+                                stored += len(data)
+                            chunks.append(digest)
+                    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "chunks": chunks}
+                files[rel_path] = entry
+                processed += stat.st_size
+                if progress is not None:
+                    progress(processed, total)
+
+        manifest = {"bid": bid, "size": total, "stored_bytes": stored, "files": files}
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        path = self.manifest_path(bid)
+        temp_path = path.with_suffix(".part")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, path)
+        return manifest
+
+    def restore(self, manifest_path: Path, destination: Path, progress: Optional[Callable[[int, int], None]] = None):
+        manifest = self.load_manifest(manifest_path)
+        total = manifest["size"]
+        processed = 0
+        destination.mkdir(parents=True, exist_ok=True)
+        for rel_path, entry in manifest["files"].items():
+            path = destination / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                for digest in entry["chunks"]:
+                    data = self.blobs.get(digest)
+                    f.write(data)
+                    processed += len(data)
+                    if progress is not None:
+                        progress(processed, total)
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def collect_garbage(self) -> Dict[str, int]:
+        """
+        Remove all blobs that are not referenced by one of the manifests
+        """
+        with self._lock:
+            return self._collect_garbage()
+
+    def _collect_garbage(self) -> Dict[str, int]:
+        referenced = set()
+        for path in self.manifest_dir.glob("*.manifest.json"):
+            for entry in self.load_manifest(path)["files"].values():
+                referenced.update(entry["chunks"])
+        removed = 0
+        freed = 0
+        for digest, path in list(self.blobs.digests()):
+            if digest not in referenced:
+                freed += path.stat().st_size
+                path.unlink()
+                removed += 1
+        return {"removed_blobs": removed, "freed_bytes": freed}
+
+
+def is_incremental(backup: Backup) -> bool:
+    return backup.path.endswith(".manifest.json")
+
+
+async def create_backup_job(job: Job, manager: ServerManager, job_queue: JobQueue, sid: str, world_name: str,
+                            incremental_store: Optional[IncrementalBackupStore] = None):
+    """
+    Same as BackupManager.create_backup, but the archive is created in a worker thread of the job queue.
+    If an incremental store is passed, only changed chunks are stored.
+    """
+    backup_manager = manager.backup_manager
+    server = manager.get_server(sid)
+    if server.is_running and server.active_world.name == world_name:
+        await server.shutdown()
+    world = server.get_world(world_name)
+
+    bid = str(uuid.uuid4().hex)
+    if incremental_store is not None:
+        previous_manifests = [
+            Path(backup.path) for backup in sorted(
+                backup_manager.get_backups_for_server(sid).values(), key=lambda backup: backup.time, reverse=True
+            ) if backup.world == world_name and is_incremental(backup)
+        ]
+        manifest = await job_queue.run_blocking(incremental_store.create, world.path, bid, previous_manifests,
+                                                job.report)
+        file_name = incremental_store.manifest_path(bid)
+        size = manifest["size"]
+        result = {"bid": bid, "stored_bytes": manifest["stored_bytes"]}
+    else:
+        file_name = backup_dir / f"{bid}.zip"
+        backup_dir.mkdir(parents=True, exist_ok=True)
+        await job_queue.run_blocking(archive_directory, world.path, file_name, job.report)
+        size = file_name.stat().st_size
+        result = {"bid": bid}
+
+    backup_manager.backups[bid] = Backup(
+        sid, datetime.now(), world_name, server.server_config.version, str(file_name), size
+    )
+    await job_queue.run_blocking(backup_manager.save_backup_file)
+    return result
+
+
+async def restore_backup_job(job: Job, manager: ServerManager, job_queue: JobQueue, lifecycle: LifecycleEngine,
+                             bid: str, incremental_store: Optional[IncrementalBackupStore] = None):
+    """
+    Same as BackupManager.restore_backup, but the archive is extracted in a worker thread of the job queue.
+    The server can't be started while the world is replaced. It is only started again if it was running before.
+    """
+    backup = manager.backup_manager.get_backup(bid)
+    server = manager.get_server(backup.sid)
+    world = server.get_world(backup.world)
+
+    def restore():
+        # The backup is extracted into the server directory first, so the world is only replaced if this
+        # succeeds. It is outside the worlds directory, so it is never loaded as a world.
+        temp_path = world.path.parent.parent / f".restore-{bid}"
+        old_path = world.path.parent.parent / f".replaced-{bid}"
+        for path in (temp_path, old_path):
+            if path.exists():
+                shutil.rmtree(path)
+        try:
+            if is_incremental(backup):
+                incremental_store.restore(Path(backup.path), temp_path, job.report)
+            else:
+                with open(backup.path, "rb") as f:
+                    extract_world(f, temp_path, backup_limits, job.report)
+        except BaseException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        if world.path.is_dir():
+            os.replace(world.path, old_path)
+        os.replace(temp_path, world.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    restart = False
+    try:
+        with lifecycle.guard_start(backup.sid, "A backup is being restored"):
+            restart = server.is_running and server.active_world.name == world.name
+            if restart:
+                await server.shutdown()
+            await job_queue.run_blocking(restore)
+    finally:
+        # also if the restore failed, the old world is still in place then
+        if restart:
+            # through the lifecycle engine, so the wake listener of the scheduler releases the port
+            await lifecycle.start(server)
+    return {"bid": bid}
+
+
+def _delete_backup(backup_manager, bid: str):
+    try:
+        backup_manager.delete_backup(bid)
+    except KeyError:
+        # already deleted
+        pass
+    except FileNotFoundError:
+        # the entry was removed before the missing file was noticed, so it is only left to save the list
+        backup_manager.save_backup_file()
+
+
+async def delete_backup_job(job: Job, manager: ServerManager, job_queue: JobQueue,
+                            incremental_store: IncrementalBackupStore, bid: str):
+    """
+    Delete a backup in a worker thread of the job queue. The blobs of an incremental backup that no other backup
+    references are removed too.
+    """
+    backup = manager.backup_manager.get_backup(bid)
+    if backup is None:
+        raise Exception("Backup not found")
+    await job_queue.run_blocking(_delete_backup, manager.backup_manager, bid)
+    result = {"bid": bid}
+    if is_incremental(backup):
+        result.update(await job_queue.run_blocking(incremental_store.collect_garbage))
+    return result
+
+
+async def apply_retention_job(job: Job, manager: ServerManager, job_queue: JobQueue,
+                              incremental_store: IncrementalBackupStore, keep_last: Optional[int] = None,
+                              max_age: Optional[float] = None, sid: Optional[str] = None):
+    """
+    Delete backups that exceed the retention policy and remove the blobs that are no longer referenced.
+    :param keep_last: Number of backups to keep per server and world
+    :param max_age: Delete backups older than this many seconds
+    :param sid: Only apply the policy to the backups of this server
+    """
+    backup_manager = manager.backup_manager
+    groups: Dict[Tuple[str, str], list] = {}
+    for bid, backup in backup_manager.backups.items():
+        if sid is None or backup.sid == sid:
+            groups.setdefault((backup.sid, backup.world), []).append((bid, backup))
+
+    now = time.time()
+    deleted = []
+    for backups in groups.values():
+        backups.sort(key=lambda item: item[1].time, reverse=True)
+        for i, (bid, backup) in enumerate(backups):
+            if (keep_last is not None and i >= keep_last) or (
+                    max_age is not None and now - backup.time.timestamp() > max_age):
+                deleted.append(bid)
+
+    for bid in deleted:
+        await job_queue.run_blocking(_delete_backup, backup_manager, bid)
+
+    result = await job_queue.run_blocking(incremental_store.collect_garbage)
+    result["deleted_backups"] = deleted
+    return result
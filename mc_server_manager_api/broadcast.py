@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from enum import Enum
+from functools import partial
+from typing import Deque, Dict, Optional, Set
+
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.models import SimpleMinecraftServer
+
+
+class OverflowPolicy(Enum):
+    # drop the oldest queued message if the queue is full
+    DROP_OLDEST = "drop_oldest"
+    # additionally replace queued messages with the same key by the newest one, e.g. metrics
+    COALESCE = "coalesce"
+
+
+class Subscriber:
+    """
+    A single client of a broadcaster. Messages are queued per subscriber, so a slow client only delays itself.
+    If the queue is full, the oldest message is dropped.
+    """
+
+    def __init__(self, max_queue_size: int = 8, overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        self.max_queue_size = max_queue_size
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.coalesced = 0
+        self._queue: Deque[list] = deque()
+        self._event = asyncio.Event()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, message: str, key: Optional[str] = None):
+        """
+        :param message: Serialized message
+        :param key: With the coalesce policy, a queued message with the same key is replaced
+        """
+        if key is not None and self.overflow_policy == OverflowPolicy.COALESCE:
+            for entry in self._queue:
+                if entry[0] == key:
+                    entry[1] = message
+                    self.coalesced += 1
+                    return
+        if len(self._queue) >= self.max_queue_size:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append([key, message])
+        self._event.set()
+
+    async def get(self) -> str:
+        while not self._queue:
+            self._event.clear()
+            await self._event.wait()
+        return self._queue.popleft()[1]
+
+    def drain(self) -> list:
+        """
+        Remove and return all queued messages
+        """
+        messages = [entry[1] for entry in self._queue]
+        self._queue.clear()
+        return messages
+
+    def to_dict(self):
+        return {
+            "queued": len(self._queue),
+            "max_queue_size": self.max_queue_size,
+            "overflow_policy": self.overflow_policy.value,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced
+        }
+
+
+class ServerListBroadcaster:
+    """
+    Keeps the serialized server list and pushes it to all subscribers as soon as the status of a server changes.
+    It registers exactly one status callback per server, independent of the number of connected clients.
+    """
+
+    def __init__(self, manager: ServerManager, max_queue_size: int = 8):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.max_queue_size = max_queue_size
+        self.subscribers: Set[Subscriber] = set()
+        self._watched_sids: Set[str] = set()
+        self._message: Optional[str] = None
+
+    def get_servers(self) -> Dict[str, list]:
+        return {
+            "servers": [
+                SimpleMinecraftServer(sid, server.server_config.name, server.server_config.version,
+                                      status=server.status.name).__dict__ for sid, server
+                in self.manager.get_servers().items()
+            ]
+        }
+
+    @property
+    def message(self) -> str:
+        if self._message is None:
+            self._message = json.dumps(self.get_servers())
+        return self._message
+
+    def watch_servers(self):
+        """
+        Register the status callback on every server that is not watched yet
+        """
+        for sid, server in self.manager.get_servers().items():
+            if sid in self._watched_sids:
+                continue
+            server.callbacks.status.add_callback(partial(self._on_status, sid))
+            self._watched_sids.add(sid)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.max_queue_size)
+        subscriber.put(self.message)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def refresh(self):
+        """
+        Rebuild the server list and send it to all subscribers, if it has changed.
+        Call this after servers were added or removed.
+        """
+        self._watched_sids.intersection_update(self.manager.get_servers().keys())
+        self.watch_servers()
+        message = json.dumps(self.get_servers())
+        if message == self._message:
+            return
+        self._message = message
+        for subscriber in self.subscribers:
+            subscriber.put(message)
+
+    async def _on_status(self, sid: str, _status):
+        # Deleted servers keep their callback; ignore them instead of raising, which would unregister silently
+        if sid not in self._watched_sids:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            self.logger.error(f"Failed to broadcast server list: {e}")
@@ -0,0 +1,649 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import aiohttp
+import psutil
+from fastapi import Request, WebSocket
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from mc_server_interaction.manager import ServerManager
+from starlette.background import BackgroundTask
+
+from mc_server_manager_api.broadcast import OverflowPolicy, Subscriber
+from mc_server_manager_api.stream import StreamConnection, StreamEvent, topic_pattern
+
+node_name_pattern = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+# sids of the aggregator are {node}-{sid}
+sid_separator = "-"
+# headers that belong to one connection and are not forwarded
+hop_by_hop_headers = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length", "content-encoding"
+}
+# JSON responses up to this size get their sid and jid rewritten, larger ones are streamed unchanged
+max_rewritten_size = 1024 * 1024
+
+
+def get_node_load(manager: ServerManager) -> dict:
+    """
+    The load of this instance, used by an aggregator to place new servers
+    """
+    servers = manager.get_servers()
+    memory = psutil.virtual_memory()
+    cpu_count = psutil.cpu_count() or 1
+    try:
+        # the load average needs no sampling interval, unlike cpu_percent
+        cpu_percent = min(os.getloadavg()[0] / cpu_count * 100, 100.0)
+    except (AttributeError, OSError):
+        cpu_percent = psutil.cpu_percent(interval=None)
+    return {
+        "servers": len(servers),
+        "running_servers": sum(1 for server in servers.values() if server.is_running),
+        "cpu_percent": cpu_percent,
+        "cpu_count": cpu_count,
+        "memory_total": memory.total,
+        "memory_available": memory.available,
+        "memory_percent": memory.percent
+    }
+
+
+class Node:
+    def __init__(self, name: str, url: str, timeout: float):
+        if not node_name_pattern.match(name):
+            raise ValueError(f"Invalid node name {name}, only letters, digits and _ are allowed")
+        self.name = name
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.last_error: Optional[str] = None
+
+    def to_dict(self):
+        return {"name": self.name, "url": self.url, "timeout": self.timeout, "last_error": self.last_error}
+
+
+def parse_nodes(spec: str, timeout: float = 5.0) -> List[Node]:
+    """
+    Parse a node list like a=http://host1:8000,b=http://host2:8000
+    """
+    nodes = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, _, url = entry.strip().partition("=")
+        if not url:
+            raise ValueError(f"Invalid node {entry}, expected name=url")
+        nodes.append(Node(name, url, timeout))
+    if len({node.name for node in nodes}) != len(nodes):
+        raise ValueError("Node names must be unique")
+    return nodes
+
+
+class NodeError(Exception):
+    pass
+
+
+class Cluster:
+    """
+    Aggregates several instances of this API (agents). Sids, jids and bids are prefixed with the name of their node.
+    Requests are forwarded to the node of the sid or bid, list endpoints and the server list, jobs and stream
+    websockets are merged from all nodes concurrently. All requests share one pool of keep-alive connections,
+    every node has its own timeout.
+    """
+    # bulk lifecycle requests wait until the servers are stopped, which takes much longer than other requests
+    lifecycle_timeout = 15 * 60
+    # seconds between the attempts to reconnect the websocket of a node
+    reconnect_interval = 2.0
+
+    def __init__(self, nodes: List[Node], connections_per_node: int = 32):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.nodes: Dict[str, Node] = {node.name: node for node in nodes}
+        self.connections_per_node = connections_per_node
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.connections_per_node,
+                                             keepalive_timeout=60, ttl_dns_cache=300)
+            # the body is forwarded unchanged, so it must not be decompressed
+            self._session = aiohttp.ClientSession(connector=connector, auto_decompress=False)
+        return self._session
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def join_id(node: Node, local_id: str) -> str:
+        return f"{node.name}{sid_separator}{local_id}"
+
+    def split_id(self, global_id: str) -> Optional[Tuple[Node, str]]:
+        name, separator, local_id = global_id.partition(sid_separator)
+        node = self.nodes.get(name)
+        if node is None or not separator or not local_id:
+            return None
+        return node, local_id
+
+    async def request_json(self, node: Node, method: str, path: str, body=None,
+                           timeout: Optional[float] = None) -> Tuple[int, dict]:
+        timeout = aiohttp.ClientTimeout(total=timeout if timeout is not None else node.timeout)
+        try:
+            async with self.session.request(method, node.url + path, json=body, timeout=timeout) as resp:
+                data = await resp.read()
+                node.last_error = None
+                return resp.status, json.loads(data) if data else {}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            node.last_error = str(e) or e.__class__.__name__
+            raise NodeError(f"Node {node.name}: {node.last_error}") from e
+
+    async def gather_json(self, method: str, path: str, nodes: Optional[List[Node]] = None) \
+            -> Dict[str, Tuple[int, dict]]:
+        """
+        Send a request to several nodes at once
+        :return: Status and body per node name, nodes that failed are missing
+        """
+        nodes = list(self.nodes.values()) if nodes is None else nodes
+        results = await asyncio.gather(*(self.request_json(node, method, path) for node in nodes),
+                                       return_exceptions=True)
+        merged = {}
+        for node, result in zip(nodes, results):
+            if isinstance(result, NodeError):
+                self.logger.warning(str(result))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                merged[node.name] = result
+        return merged
+
+    def _errors(self, results: Dict[str, Tuple[int, dict]]) -> Dict[str, str]:
+        return {name: node.last_error or "Request failed" for name, node in self.nodes.items()
+                if name not in results or results[name][0] >= 400}
+
+    async def get_servers(self) -> dict:
+        results = await self.gather_json("GET", "/api/servers")
+        servers = []
+        for name, (status, body) in results.items():
+            if status != 200:
+                continue
+            for server in body.get("servers", []):
+                servers.append({**server, "sid": self.join_id(self.nodes[name], server["sid"]), "node": name})
+        return {"servers": servers, "errors": self._errors(results)}
+
+    async def get_worlds(self) -> dict:
+        results = await self.gather_json("GET", "/api/worlds")
+        worlds = {}
+        for name, (status, body) in results.items():
+            if status != 200:
+                continue
+            for sid, server_worlds in body.get("worlds", {}).items():
+                worlds[self.join_id(self.nodes[name], sid)] = server_worlds
+        return {"worlds": worlds, "errors": self._errors(results)}
+
+    async def get_jobs(self) -> dict:
+        results = await self.gather_json("GET", "/api/jobs")
+        jobs = []
+        for name, (status, body) in results.items():
+            if status != 200:
+                continue
+            for job in body.get("jobs", []):
+                jobs.append({**self._prefix_ids(self.nodes[name], job), "node": name})
+        return {"jobs": jobs, "errors": self._errors(results)}
+
+    async def search_players(self, query: str, role: Optional[str], online: Optional[bool], limit: int,
+                             offset: int) -> dict:
+        """
+        Search the players of all nodes. Every node returns its first offset + limit matches, the entries of
+        the same player on several nodes are merged.
+        """
+        params = {"q": query, "limit": offset + limit, "offset": 0}
+        if role is not None:
+            params["role"] = role
+        if online is not None:
+            params["online"] = str(online).lower()
+        results = await self.gather_json("GET", f"/api/players?{urlencode(params)}")
+        players: Dict[str, dict] = {}
+        total = 0
+        for name, (status, body) in results.items():
+            if status != 200:
+                continue
+            total += body.get("total", 0)
+            node = self.nodes[name]
+            for player in body.get("players", []):
+                servers = [{**server, "sid": self.join_id(node, server["sid"])} for server in player["servers"]]
+                merged = players.get(player["name"].lower())
+                if merged is None:
+                    players[player["name"].lower()] = {**player, "servers": servers}
+                    continue
+                # a player on several nodes is counted once per node by the nodes
+                total -= 1
+                merged["servers"] += servers
+                merged["online"] = merged["online"] or player["online"]
+                merged["uuid"] = merged["uuid"] or player["uuid"]
+                if player["last_seen"] is not None and (merged["last_seen"] or 0) < player["last_seen"]:
+                    merged["last_seen"] = player["last_seen"]
+        page = [players[key] for key in sorted(players)][offset:offset + limit]
+        return {"total": total, "players": page, "errors": self._errors(results)}
+
+    async def get_loads(self) -> Dict[str, dict]:
+        results = await self.gather_json("GET", "/api/node")
+        return {name: body for name, (status, body) in results.items() if status == 200}
+
+    async def place(self) -> Optional[Node]:
+        """
+        The node for a new server: the node with the lowest CPU or memory usage, whichever is higher,
+        and the fewest running servers on a tie
+        """
+        loads = await self.get_loads()
+        if not loads:
+            return None
+        name = min(loads, key=lambda n: (max(loads[n]["cpu_percent"], loads[n]["memory_percent"]),
+                                         loads[n]["running_servers"]))
+        return self.nodes[name]
+
+    async def bulk_lifecycle(self, action: str, body: dict) -> dict:
+        """
+        Start, stop or restart servers on several nodes. Sids are grouped by node, the selectors all and status
+        are sent to every node.
+        """
+        requests: Dict[str, dict] = {}
+        results = {}
+        for sid in body.get("sids") or []:
+            split = self.split_id(sid) if isinstance(sid, str) else None
+            if split is None:
+                results[sid] = {"result": "error", "error": "Server not found", "duration": 0.0}
+                continue
+            node, local_sid = split
+            requests.setdefault(node.name, {**body, "sids": []})["sids"].append(local_sid)
+        if body.get("all") or body.get("status") is not None:
+            for name in self.nodes:
+                requests.setdefault(name, {**body, "sids": []})
+
+        responses = await asyncio.gather(*(
+            self.request_json(self.nodes[name], "POST", f"/api/servers:{action}", node_body, self.lifecycle_timeout)
+            for name, node_body in requests.items()
+        ), return_exceptions=True)
+        for (name, node_body), response in zip(requests.items(), responses):
+            node = self.nodes[name]
+            if isinstance(response, NodeError) or (not isinstance(response, BaseException) and response[0] >= 400):
+                error = str(response) if isinstance(response, NodeError) else response[1].get("error", "Failed")
+                for sid in node_body["sids"]:
+                    results[self.join_id(node, sid)] = {"result": "error", "error": error, "duration": 0.0}
+                continue
+            if isinstance(response, BaseException):
+                raise response
+            for sid, result in response[1].get("results", {}).items():
+                results[self.join_id(node, sid)] = result
+        return {"results": results}
+
+    def _prefix_ids(self, node: Node, data: dict) -> dict:
+        """
+        Prefix the sid, jid and bid of a response, the keys and sids of its backups and the ids in its job result
+        """
+        for key in ("sid", "jid", "bid"):
+            if isinstance(data.get(key), str):
+                data[key] = self.join_id(node, data[key])
+        if isinstance(data.get("servers"), list):
+            data["servers"] = [self.join_id(node, sid) if isinstance(sid, str) else sid for sid in data["servers"]]
+        if isinstance(data.get("backups"), dict):
+            data["backups"] = {
+                self.join_id(node, bid): self._prefix_ids(node, backup) if isinstance(backup, dict) else backup
+                for bid, backup in data["backups"].items()
+            }
+        if isinstance(data.get("result"), dict):
+            self._prefix_ids(node, data["result"])
+        return data
+
+    def _rewrite_ids(self, node: Node, body: bytes) -> bytes:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(data, dict):
+            return body
+        return json.dumps(self._prefix_ids(node, data)).encode("utf-8")
+
+    async def apply_retention(self, body: dict) -> Tuple[int, dict]:
+        """
+        Apply a backup retention policy on the node of its sid, or on every node without a sid
+        """
+        if body.get("sid") is not None:
+            split = self.split_id(body["sid"])
+            if split is None:
+                return 404, {"error": "Server not found"}
+            node, local_sid = split
+            try:
+                status, data = await self.request_json(node, "POST", "/api/servers/backups/retention",
+                                                       {**body, "sid": local_sid})
+            except NodeError as e:
+                return 502, {"error": str(e)}
+            return status, self._prefix_ids(node, data)
+        results = await asyncio.gather(*(
+            self.request_json(node, "POST", "/api/servers/backups/retention", body) for node in self.nodes.values()
+        ), return_exceptions=True)
+        merged = {}
+        for node, result in zip(self.nodes.values(), results):
+            if isinstance(result, NodeError):
+                self.logger.warning(str(result))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                merged[node.name] = result
+        jids = [self.join_id(self.nodes[name], body["jid"]) for name, (status, body) in merged.items()
+                if status < 400 and isinstance(body.get("jid"), str)]
+        return 202, {"message": "Retention policy will be applied", "jids": jids, "errors": self._errors(merged)}
+
+    async def forward(self, node: Node, request: Request, path: str, params: Optional[List[Tuple[str, str]]] = None,
+                      body: Optional[bytes] = None) -> Response:
+        """
+        Forward a request to a node. Small JSON responses get their sid and jid prefixed with the node name,
+        everything else is streamed.
+        """
+        headers = {key: value for key, value in request.headers.items() if key.lower() not in hop_by_hop_headers}
+        body = await request.body() if body is None else body
+        if params is None:
+            params = request.query_params.multi_items()
+        try:
+            resp = await self.session.request(
+                request.method, node.url + path, params=params, data=body or None, headers=headers,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=node.timeout, sock_read=node.timeout)
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            node.last_error = str(e) or e.__class__.__name__
+            return JSONResponse({"error": f"Node {node.name} is not reachable: {node.last_error}"}, 502)
+        node.last_error = None
+        response_headers = {key: value for key, value in resp.headers.items()
+                            if key.lower() not in hop_by_hop_headers}
+        if resp.content_type == "application/json" and "content-encoding" not in resp.headers \
+                and (resp.content_length or 0) <= max_rewritten_size:
+            try:
+                data = await resp.read()
+            finally:
+                resp.release()
+            return Response(self._rewrite_ids(node, data), resp.status, response_headers)
+        if "content-encoding" in resp.headers:
+            response_headers["content-encoding"] = resp.headers["content-encoding"]
+        return StreamingResponse(resp.content.iter_chunked(64 * 1024), resp.status, response_headers,
+                                 background=BackgroundTask(resp.release))
+
+    async def relay_websocket(self, node: Node, websocket: WebSocket, path: str):
+        """
+        Relay a websocket to a node until one side disconnects
+        """
+        url = node.url.replace("http", "ws", 1) + path
+        try:
+            remote = await self.session.ws_connect(url, params=websocket.query_params.multi_items(),
+                                                   timeout=node.timeout, autoping=True, heartbeat=30)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            node.last_error = str(e) or e.__class__.__name__
+            await websocket.close(code=1011)
+            return
+        await websocket.accept()
+
+        async def to_client():
+            async for message in remote:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await websocket.send_text(message.data)
+                elif message.type == aiohttp.WSMsgType.BINARY:
+                    await websocket.send_bytes(message.data)
+                else:
+                    return
+
+        async def to_node():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text") is not None:
+                    await remote.send_str(message["text"])
+                elif message.get("bytes") is not None:
+                    await remote.send_bytes(message["bytes"])
+
+        tasks = [asyncio.create_task(to_client()), asyncio.create_task(to_node())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await remote.close()
+            try:
+                await websocket.close()
+            except RuntimeError:
+                # the client is already disconnected
+                pass
+
+    async def _follow_websocket(self, node: Node, path: str, params: Dict[str, str],
+                                on_message: Callable[[Node, str], Awaitable],
+                                on_connect: Optional[Callable[[Node, aiohttp.ClientWebSocketResponse],
+                                                              Awaitable]] = None,
+                                on_disconnect: Optional[Callable[[Node], None]] = None):
+        """
+        Receive the text messages of a websocket of a node, reconnect until the task is cancelled
+        """
+        url = node.url.replace("http", "ws", 1) + path
+        while True:
+            try:
+                async with self.session.ws_connect(url, params=params, timeout=node.timeout, heartbeat=30) as remote:
+                    node.last_error = None
+                    if on_connect is not None:
+                        await on_connect(node, remote)
+                    async for message in remote:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            await on_message(node, message.data)
+                node.last_error = "The websocket was closed"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                node.last_error = str(e) or e.__class__.__name__
+            if on_disconnect is not None:
+                on_disconnect(node)
+            await asyncio.sleep(self.reconnect_interval)
+
+    @staticmethod
+    async def _serve(websocket: WebSocket, coroutines: List[Awaitable],
+                     on_text: Optional[Callable[[str], Awaitable]] = None):
+        """
+        Run the coroutines until the client disconnects or one of them returns
+        """
+        async def read():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                text = message.get("text")
+                if text is None and message.get("bytes") is not None:
+                    text = message["bytes"].decode("utf-8", errors="replace")
+                if text is not None and on_text is not None:
+                    await on_text(text)
+
+        tasks = [asyncio.create_task(coroutine) for coroutine in coroutines] + [asyncio.create_task(read())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def serve_server_lists(self, websocket: WebSocket):
+        """
+        Send the merged server list of all nodes whenever it changes on one of them. The first list is sent
+        once every node sent its list or failed to connect, unreachable nodes are listed in errors.
+        """
+        lists: Dict[str, List[dict]] = {}
+        reported: Set[str] = set()
+        subscriber = Subscriber(1, OverflowPolicy.COALESCE)
+
+        def publish():
+            if len(reported) < len(self.nodes):
+                return
+            servers = [server for name in self.nodes for server in lists.get(name, [])]
+            errors = {name: node.last_error or "Not connected" for name, node in self.nodes.items()
+                      if name not in lists}
+            subscriber.put(json.dumps({"servers": servers, "errors": errors}), key="servers")
+
+        async def on_message(node: Node, text: str):
+            try:
+                servers = json.loads(text)["servers"]
+            except (ValueError, KeyError, TypeError):
+                return
+            lists[node.name] = [{**server, "sid": self.join_id(node, server["sid"]), "node": node.name}
+                                for server in servers]
+            reported.add(node.name)
+            publish()
+
+        def on_disconnect(node: Node):
+            first_failure = node.name not in reported
+            reported.add(node.name)
+            if lists.pop(node.name, None) is not None or first_failure:
+                publish()
+
+        async def write():
+            while True:
+                await websocket.send_text(await subscriber.get())
+
+        await websocket.accept()
+        await self._serve(websocket, [write()] + [
+            self._follow_websocket(node, "/api/servers", {}, on_message, on_disconnect=on_disconnect)
+            for node in self.nodes.values()
+        ])
+
+    async def serve_jobs(self, websocket: WebSocket):
+        """
+        Relay the job updates of all nodes with prefixed jids
+        """
+        subscriber = Subscriber(256, OverflowPolicy.COALESCE)
+
+        async def on_message(node: Node, text: str):
+            try:
+                job = json.loads(text)
+            except ValueError:
+                return
+            if isinstance(job, dict):
+                job = {**self._prefix_ids(node, job), "node": node.name}
+                subscriber.put(json.dumps(job), key=job.get("jid"))
+
+        async def write():
+            while True:
+                await websocket.send_text(await subscriber.get())
+
+        await websocket.accept()
+        await self._serve(websocket, [write()] + [
+            self._follow_websocket(node, "/api/jobs/websocket", {}, on_message) for node in self.nodes.values()
+        ])
+
+    def _split_topic(self, topic: str) -> Optional[Tuple[List[Node], str]]:
+        """
+        :return: The nodes of a topic of the aggregator and the topic on these nodes
+        """
+        if not isinstance(topic, str) or not topic_pattern.match(topic):
+            return None
+        if topic == "jobs":
+            return list(self.nodes.values()), topic
+        _, sid, kind = topic.split(":")
+        if sid == "*":
+            return list(self.nodes.values()), topic
+        split = self.split_id(sid)
+        if split is None:
+            return None
+        return [split[0]], f"server:{split[1]}:{kind}"
+
+    def _translate_event(self, node: Node, message: dict) -> Optional[StreamEvent]:
+        topic = message.get("topic")
+        if topic == "jobs" and isinstance(message.get("data"), dict):
+            return StreamEvent(topic, {**self._prefix_ids(node, message["data"]), "node": node.name})
+        if not isinstance(topic, str) or not topic.startswith("server:"):
+            # the controls of a node refer to its local topics, the aggregator sends its own
+            return None
+        _, sid, kind = topic.split(":", 2)
+        return StreamEvent(f"server:{self.join_id(node, sid)}:{kind}", message.get("data"), seq=message.get("seq"))
+
+    async def serve_stream(self, websocket: WebSocket, connection: StreamConnection):
+        """
+        Serve /stream for all nodes. The aggregator keeps one stream per node, subscribes the topics of the client
+        on the nodes they belong to and sends the events with prefixed sids and jids in its own batches.
+        """
+        node_topics: Dict[str, Set[str]] = {name: set() for name in self.nodes}
+        remotes: Dict[str, aiohttp.ClientWebSocketResponse] = {}
+
+        async def send_to_node(node: Node, action: str, topics: List[str]):
+            remote = remotes.get(node.name)
+            if remote is None or not topics:
+                # the topics are subscribed when the node is connected
+                return
+            try:
+                await remote.send_str(json.dumps({"action": action, "topics": topics}))
+            except (aiohttp.ClientError, ConnectionError):
+                pass
+
+        async def on_connect(node: Node, remote: aiohttp.ClientWebSocketResponse):
+            remotes[node.name] = remote
+            await send_to_node(node, "subscribe", sorted(node_topics[node.name]))
+
+        def on_disconnect(node: Node):
+            if remotes.pop(node.name, None) is not None:
+                connection.put_control({"type": "error", "error": f"Node {node.name} disconnected: {node.last_error}"})
+
+        async def on_message(node: Node, text: str):
+            try:
+                messages = json.loads(text)
+            except ValueError:
+                return
+            for message in messages if isinstance(messages, list) else []:
+                event = self._translate_event(node, message) if isinstance(message, dict) else None
+                if event is not None:
+                    connection.put(event)
+
+        async def on_text(text: str):
+            try:
+                message = json.loads(text)
+                action = message["action"]
+                topics = message.get("topics", [])
+                if not isinstance(topics, list):
+                    raise ValueError("topics must be a list")
+            except (ValueError, KeyError, TypeError) as e:
+                connection.put_control({"type": "error", "error": f"Invalid message: {e}"})
+                return
+            if action not in ("subscribe", "unsubscribe"):
+                connection.put_control({"type": "error", "error": f"Unknown action {action}"})
+                return
+            changes: Dict[str, List[str]] = {}
+            invalid = []
+            for topic in topics:
+                split = self._split_topic(topic)
+                if split is None:
+                    invalid.append(topic)
+                    continue
+                nodes, local_topic = split
+                for node in nodes:
+                    changes.setdefault(node.name, []).append(local_topic)
+                if action == "subscribe":
+                    connection.topics.add(topic)
+                else:
+                    connection.topics.discard(topic)
+            if invalid and action == "subscribe":
+                connection.put_control({"type": "error", "error": "Invalid topics", "topics": invalid})
+            for name, local_topics in changes.items():
+                if action == "subscribe":
+                    node_topics[name].update(local_topics)
+                else:
+                    node_topics[name].difference_update(local_topics)
+                await send_to_node(self.nodes[name], action, local_topics)
+            connection.put_control({"type": f"{action}d", "topics": [topic for topic in topics
+                                                                      if topic not in invalid]})
+
+        async def write():
+            while True:
+                frame = connection.encode(await connection.next_batch())
+                if isinstance(frame, bytes):
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+
+        params = {"encoding": "json", "flush_interval": "0"}
+        await self._serve(websocket, [write()] + [
+            self._follow_websocket(node, "/api/stream", params, on_message, on_connect, on_disconnect)
+            for node in self.nodes.values()
+        ], on_text)
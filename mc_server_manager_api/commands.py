@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from functools import partial
+from typing import Deque, Dict, List, Optional, Pattern, Set, Tuple
+
+from mc_server_interaction.interaction import MinecraftServer
+from mc_server_interaction.manager import ServerManager
+
+
+def _set_result(future: asyncio.Future, result):
+    # the future may be cancelled by the caller, e.g. when its websocket disconnected
+    if not future.done():
+        future.set_result(result)
+
+
+class PendingCommand:
+    """
+    A queued command. Identical commands that are queued while this one is still waiting share it.
+    """
+
+    def __init__(self, command: str, expect: Optional[Pattern], timeout: float):
+        self.command = command
+        self.expect = expect
+        self.timeout = timeout
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.coalesced = 0
+
+    @property
+    def key(self) -> Tuple[str, Optional[str]]:
+        return self.command, self.expect.pattern if self.expect is not None else None
+
+
+class CommandQueue:
+    """
+    Sends the commands of one server with a token bucket rate limit: up to burst commands at once, then rate
+    commands per second.
+    """
+
+    def __init__(self, sid: str, server: MinecraftServer, rate: float, burst: int, max_queue_size: int):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.sid = sid
+        self.server = server
+        self.rate = rate
+        self.burst = burst
+        self.max_queue_size = max_queue_size
+        self.sent = 0
+        self.coalesced = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._queue: Deque[PendingCommand] = deque()
+        self._pending: Dict[Tuple[str, Optional[str]], PendingCommand] = {}
+        self._matchers: List[Tuple[Pattern, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, command: str, expect: Optional[str] = None, timeout: float = 5) -> asyncio.Future:
+        """
+        Queue a command. The returned future resolves to the result dict of the command. It may be shared with
+        other callers, so await it with asyncio.shield().
+        :param expect: Regular expression. Wait for a console line that matches it after the command is sent
+        :param timeout: Seconds to wait for the expected output
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            pattern = re.compile(expect) if expect else None
+        except re.error as e:
+            future.set_result({"command": command, "result": "error", "error": f"Invalid expect: {e}"})
+            return future
+        if not command.strip():
+            future.set_result({"command": command, "result": "error", "error": "Empty command"})
+            return future
+
+        pending = PendingCommand(command, pattern, timeout)
+        existing = self._pending.get(pending.key)
+        if existing is not None:
+            existing.coalesced += 1
+            self.coalesced += 1
+            return self._coalesced_result(existing)
+        if len(self._queue) >= self.max_queue_size:
+            future.set_result({"command": command, "result": "error", "error": "Command queue is full"})
+            return future
+
+        self._pending[pending.key] = pending
+        self._queue.append(pending)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return pending.future
+
+    @staticmethod
+    def _coalesced_result(pending: PendingCommand) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+
+        def done(f: asyncio.Future):
+            if future.done():
+                return
+            if f.cancelled():
+                future.cancel()
+            else:
+                future.set_result({**f.result(), "coalesced": True})
+        pending.future.add_done_callback(done)
+        return future
+
+    def set_limits(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = min(self._tokens, burst)
+
+    def to_dict(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queued": len(self._queue),
+            "max_queue_size": self.max_queue_size,
+            "sent": self.sent,
+            "coalesced": self.coalesced
+        }
+
+    async def _acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._last_refill) * self.rate, self.burst)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _run(self):
+        while self._queue:
+            pending = self._queue.popleft()
+            # one failing command must not end the queue
+            try:
+                await self._send(pending)
+            except Exception as e:
+                self.logger.exception(f"Failed to handle command of server {self.sid}: {e}")
+                self._pending.pop(pending.key, None)
+                _set_result(pending.future, {"command": pending.command, "result": "error",
+                                             "error": str(e) or e.__class__.__name__})
+
+    async def _send(self, pending: PendingCommand):
+        await self._acquire()
+        # from now on, identical commands are queued again instead of sharing this one
+        self._pending.pop(pending.key, None)
+        if not self.server.is_online:
+            _set_result(pending.future, {"command": pending.command, "result": "error",
+                                         "error": "Server is not running"})
+            return
+        matcher = None
+        if pending.expect is not None:
+            matcher = (pending.expect, asyncio.get_running_loop().create_future())
+            self._matchers.append(matcher)
+        try:
+            await self.server.send_command(pending.command)
+        except Exception as e:
+            self.logger.error(f"Failed to send command to server {self.sid}: {e}")
+            if matcher is not None:
+                self._matchers.remove(matcher)
+            _set_result(pending.future, {"command": pending.command, "result": "error",
+                                         "error": str(e) or e.__class__.__name__})
+            return
+        self.sent += 1
+        if matcher is None:
+            _set_result(pending.future, {"command": pending.command, "result": "sent"})
+        else:
+            # wait in the background, the next commands are sent meanwhile
+            asyncio.create_task(self._wait_for_output(pending, matcher))
+
+    async def _wait_for_output(self, pending: PendingCommand, matcher: Tuple[Pattern, asyncio.Future]):
+        try:
+            line = await asyncio.wait_for(matcher[1], pending.timeout)
+            result = {"command": pending.command, "result": "matched", "output": line}
+        except asyncio.TimeoutError:
+            result = {"command": pending.command, "result": "timeout"}
+        finally:
+            if matcher in self._matchers:
+                self._matchers.remove(matcher)
+        _set_result(pending.future, result)
+
+    def on_output(self, line: str):
+        for pattern, future in list(self._matchers):
+            if not future.done() and pattern.search(line):
+                future.set_result(line)
+                self._matchers.remove((pattern, future))
+
+
+class CommandPipeline:
+    """
+    A rate-limited command queue per server. Identical commands that are queued but not sent yet are
+    coalesced. One output callback per server resolves the commands that wait for an expected console line.
+    """
+
+    def __init__(self, manager: ServerManager, rate: float = 20, burst: int = 40, max_queue_size: int = 10000):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.rate = rate
+        self.burst = burst
+        self.max_queue_size = max_queue_size
+        self.queues: Dict[str, CommandQueue] = {}
+        self._watched_sids: Set[str] = set()
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        self._watched_sids.intersection_update(servers.keys())
+        for sid in list(self.queues):
+            if sid not in servers:
+                self.queues.pop(sid)
+        for sid, server in servers.items():
+            if sid in self._watched_sids:
+                continue
+            server.callbacks.output.add_callback(partial(self._on_output, sid))
+            self._watched_sids.add(sid)
+
+    def get_queue(self, sid: str) -> Optional[CommandQueue]:
+        server = self.manager.get_server(sid)
+        if server is None:
+            return None
+        queue = self.queues.get(sid)
+        if queue is None or queue.server is not server:
+            queue = self.queues[sid] = CommandQueue(sid, server, self.rate, self.burst, self.max_queue_size)
+        return queue
+
+    async def _on_output(self, sid: str, line: str):
+        queue = self.queues.get(sid)
+        if queue is not None:
+            queue.on_output(line)
@@ -0,0 +1,216 @@
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+from collections import deque
+from functools import partial
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+
+class ConsoleLog:
+    """
+    Ring buffer of the console output of a server. Every line gets a monotonically increasing sequence number,
+    so clients can continue where they stopped. Lines that fall out of the buffer are optionally written
+    to gzip compressed segment files. A segment is only used once it is completely written, until then its
+    lines are kept in memory.
+    """
+
+    def __init__(self, max_lines: int = 10000, spill_dir: Optional[Path] = None, segment_size: int = 1000,
+                 max_segments: int = 100, tail_size: int = 500):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.lines: Deque[Tuple[int, str]] = deque(maxlen=max_lines)
+        self.last_seq = 0
+        self.spill_dir = spill_dir
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.tail_size = tail_size
+        self._evicted: List[Tuple[int, str]] = []
+        # (first seq, last seq, path), sorted by seq
+        self._segments: List[Tuple[int, int, Path]] = []
+        # lines of segments that are being written
+        self._writing: List[List[Tuple[int, str]]] = []
+        self._tail_message: Optional[str] = None
+        if self.spill_dir is not None:
+            self._clear_segments()
+
+    @property
+    def first_seq(self) -> int:
+        """
+        Sequence number of the oldest available line
+        """
+        firsts = [first for first, _, _ in self._segments[:1]] + [lines[0][0] for lines in self._writing]
+        if self._evicted:
+            firsts.append(self._evicted[0][0])
+        if self.lines:
+            firsts.append(self.lines[0][0])
+        return min(firsts) if firsts else self.last_seq + 1
+
+    def append(self, line: str):
+        if self.spill_dir is not None and len(self.lines) == self.lines.maxlen:
+            self._evicted.append(self.lines[0])
+            if len(self._evicted) >= self.segment_size:
+                self._spill()
+        self.last_seq += 1
+        self.lines.append((self.last_seq, line))
+        self._tail_message = None
+
+    async def get_lines(self, after_seq: Optional[int] = None, limit: Optional[int] = 500) \
+            -> List[Tuple[int, str]]:
+        """
+        :param after_seq: Return lines after this sequence number. If None, return the last lines
+        :param limit: Maximum number of lines to return, None for all
+        """
+        if after_seq is None:
+            return list(self.lines)[-limit:] if limit else []
+        if after_seq > self.last_seq:
+            # the client knows lines of a previous run of the api
+            after_seq = 0
+        ret = []
+        read_until = after_seq
+        # segments may be completed while others are read, so repeat until no newer segment is left
+        while limit is None or len(ret) < limit:
+            segments = [segment for segment in self._segments if segment[1] > read_until]
+            if not segments:
+                break
+            remaining = limit - len(ret) if limit is not None else None
+            lines = await asyncio.get_running_loop().run_in_executor(
+                None, self._read_segments, segments, read_until, remaining
+            )
+            ret += lines
+            if remaining is not None and len(lines) >= remaining:
+                return ret
+            read_until = max(read_until, segments[-1][1])
+        # the lines in memory are read without awaiting, so no line can be missed
+        for source in self._writing + [self._evicted, self.lines]:
+            for seq, line in source:
+                if limit is not None and len(ret) >= limit:
+                    return ret
+                if seq > read_until:
+                    ret.append((seq, line))
+                    read_until = seq
+        return ret
+
+    def to_message(self) -> str:
+        """
+        Serialized output message with the last lines for a new websocket connection. The message is cached
+        until the next line arrives.
+        """
+        if self._tail_message is None:
+            lines = list(self.lines)[-self.tail_size:] if self.tail_size else []
+            self._tail_message = self._serialize(lines)
+        return self._tail_message
+
+    async def get_resume_messages(self, after_seq: int) -> List[str]:
+        """
+        Output messages with all available lines after after_seq, in pages of at most the buffer size.
+        If lines after after_seq are not available anymore, the first message has "gap" with their number.
+        Nothing is awaited after the last line was read, so the caller can subscribe to new lines
+        without missing one.
+        """
+        if after_seq > self.last_seq:
+            after_seq = 0
+        lines = await self.get_lines(after_seq, None)
+        first_seq = lines[0][0] if lines else self.last_seq + 1
+        gap = max(first_seq - after_seq - 1, 0)
+        page_size = self.lines.maxlen
+        messages = []
+        for i in range(0, max(len(lines), 1), page_size):
+            messages.append(self._serialize(lines[i:i + page_size], gap if i == 0 else 0))
+        return messages
+
+    def _serialize(self, lines: List[Tuple[int, str]], gap: int = 0) -> str:
+        value = "\n".join(line for _, line in lines) + ("\n" if lines else "")
+        seq = lines[-1][0] if lines else self.last_seq
+        message = {"type": "output", "value": value, "seq": seq}
+        if gap:
+            message["gap"] = gap
+        return json.dumps(message)
+
+    @staticmethod
+    def _read_segments(segments: List[Tuple[int, int, Path]], after_seq: int,
+                       limit: Optional[int]) -> List[Tuple[int, str]]:
+        ret = []
+        for first, last, path in segments:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for entry in f:
+                        seq, line = json.loads(entry)
+                        if seq > after_seq:
+                            ret.append((seq, line))
+                            if limit is not None and len(ret) >= limit:
+                                return ret
+            except FileNotFoundError:
+                # removed as the oldest segment meanwhile
+                continue
+        return ret
+
+    def _spill(self):
+        lines, self._evicted = self._evicted, []
+        path = self.spill_dir / f"{lines[0][0]}-{lines[-1][0]}.jsonl.gz"
+        self._writing.append(lines)
+        future = asyncio.get_running_loop().run_in_executor(None, self._write_segment, path, lines)
+        future.add_done_callback(partial(self._segment_written, path, lines))
+
+    def _segment_written(self, path: Path, lines: List[Tuple[int, str]], future: asyncio.Future):
+        self._writing = [writing for writing in self._writing if writing is not lines]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.logger.error(f"Failed to write console segment {path}: {future.exception()}")
+            return
+        bisect.insort(self._segments, (lines[0][0], lines[-1][0], path))
+        while len(self._segments) > self.max_segments:
+            _, _, old_path = self._segments.pop(0)
+            old_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _write_segment(path: Path, lines: List[Tuple[int, str]]):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for entry in lines:
+                f.write(json.dumps(entry) + "\n")
+
+    def _clear_segments(self):
+        # Sequence numbers start again at 1, so segments of a previous run can't be used
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.spill_dir.glob("*.jsonl.gz"):
+            path.unlink()
+
+
+class ConsoleLogManager:
+    """
+    Keeps one console log per server. The output callback is registered once per server.
+    """
+
+    def __init__(self, manager: ServerManager, spill_dir: Optional[Path] = None, **kwargs):
+        self.manager = manager
+        self.spill_dir = spill_dir
+        self.kwargs = kwargs
+        self.console_logs: Dict[str, ConsoleLog] = {}
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        for sid in list(self.console_logs):
+            if sid not in servers:
+                self.console_logs.pop(sid)
+        for sid, server in servers.items():
+            if sid in self.console_logs:
+                continue
+            console_log = ConsoleLog(
+                spill_dir=self.spill_dir / sid if self.spill_dir is not None else None, **self.kwargs
+            )
+            # lines received before the api started watching
+            for line in server.log:
+                console_log.append(line)
+            server.callbacks.output.add_callback(partial(self._on_output, console_log))
+            self.console_logs[sid] = console_log
+
+    def get_console_log(self, sid: str) -> Optional[ConsoleLog]:
+        return self.console_logs.get(sid)
+
+    @staticmethod
+    async def _on_output(console_log: ConsoleLog, output: str):
+        console_log.append(output)
@@ -0,0 +1,228 @@
+import errno
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Set, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.jobs import Job, JobQueue, _lower_thread_priority
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to share the extents of a file on btrfs, xfs and other copy-on-write file systems
+FICLONE = 0x40049409
+# errors that mean the file system or the kernel doesn't support the operation
+_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.EBADF}
+
+
+class CopyStats:
+    """
+    Thread-safe progress of a copy and the number of files per method
+    """
+
+    def __init__(self, total: int, progress: Optional[Callable[[int, int], None]] = None):
+        self.total = total
+        self.processed = 0
+        self.files = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def add(self, size: int, method: Optional[str] = None):
+        with self._lock:
+            self.processed += size
+            if method is not None:
+                self.files[method] += 1
+            processed = self.processed
+        if self.progress is not None:
+            self.progress(processed, self.total)
+
+    def to_dict(self):
+        return {"bytes": self.processed, "files": dict(self.files)}
+
+
+class CopyEngine:
+    """
+    Copies directory trees as fast as the file system allows. Every file is first cloned with a reflink, which
+    shares the data on copy-on-write file systems. If that is not supported, a read-only copy is hardlinked,
+    otherwise the file is copied by the kernel with copy_file_range, large files in chunks in parallel.
+    Hardlinks are never used for writable copies, Minecraft changes region files in place.
+    """
+
+    def __init__(self, workers: int = 4, chunk_size: int = 64 * 1024 * 1024, niceness: int = 10):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.niceness = niceness
+        # devices that don't support reflinks, they are not tried again
+        self._no_reflink: Set[Tuple[int, int]] = set()
+
+    def copy_tree(self, source: Path, destination: Path, progress: Optional[Callable[[int, int], None]] = None,
+                  override: bool = False, read_only: bool = False) -> dict:
+        """
+        Copy a directory. The copy is created next to the destination and renamed when it is complete, so the
+        destination is never left half copied.
+        :param progress: Called with the copied and the total number of bytes, from worker threads
+        :param override: Replace an existing destination
+        :param read_only: The copy is never modified, so files may be hardlinked
+        :return: The number of copied bytes and files per method
+        """
+        if not source.is_dir():
+            raise NotADirectoryError(f"{source} is not a directory")
+        if destination.exists() and not override and (not destination.is_dir() or any(destination.iterdir())):
+            raise FileExistsError(f"{destination} already exists")
+
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        temp_destination = destination.with_name(f".{destination.name}.copy-{uuid.uuid4().hex}")
+        files: List[Tuple[Path, Path, int]] = []
+        for root, dirs, names in os.walk(source):
+            target_root = temp_destination / Path(root).relative_to(source)
+            target_root.mkdir(parents=True, exist_ok=True)
+            for name in names:
+                path = Path(root) / name
+                if path.is_symlink():
+                    os.symlink(os.readlink(path), target_root / name)
+                    continue
+                files.append((path, target_root / name, path.stat().st_size))
+
+        stats = CopyStats(sum(size for _, _, size in files), progress)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="CopyWorker",
+                                    initializer=_lower_thread_priority, initargs=(self.niceness,)) as executor:
+                small_files = []
+                for src, dst, size in files:
+                    if size <= self.chunk_size:
+                        small_files.append((src, dst))
+                    elif not self._try_fast_copy(src, dst, stats, read_only):
+                        self._copy_chunked(executor, src, dst, size, stats)
+                for future in [executor.submit(self._copy_file, src, dst, stats, read_only)
+                               for src, dst in small_files]:
+                    future.result()
+            for root, dirs, _ in os.walk(source):
+                target_root = temp_destination / Path(root).relative_to(source)
+                shutil.copystat(root, target_root)
+
+            if destination.exists():
+                trash = destination.with_name(f".{destination.name}.old-{uuid.uuid4().hex}")
+                os.rename(destination, trash)
+                os.rename(temp_destination, destination)
+                shutil.rmtree(trash, ignore_errors=True)
+            else:
+                os.rename(temp_destination, destination)
+        except BaseException:
+            shutil.rmtree(temp_destination, ignore_errors=True)
+            raise
+        return stats.to_dict()
+
+    def copy_file(self, source: Path, destination: Path, mode: Optional[int] = None) -> dict:
+        """
+        Copy a single file with a reflink if possible, but never hardlink it, so the copy has its own inode.
+        The destination is replaced when the copy is complete.
+        :param mode: Permissions of the copy, by default those of the source
+        """
+        temp_destination = destination.with_name(f".{destination.name}.copy-{uuid.uuid4().hex}")
+        stats = CopyStats(source.stat().st_size)
+        try:
+            self._copy_file(source, temp_destination, stats, read_only=False)
+            if mode is not None:
+                os.chmod(temp_destination, mode)
+            os.replace(temp_destination, destination)
+        except BaseException:
+            temp_destination.unlink(missing_ok=True)
+            raise
+        return stats.to_dict()
+
+    def _copy_file(self, src: Path, dst: Path, stats: CopyStats, read_only: bool):
+        if self._try_fast_copy(src, dst, stats, read_only):
+            return
+        size = src.stat().st_size
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            self._copy_range(fsrc.fileno(), fdst.fileno(), 0, size, stats)
+        shutil.copystat(src, dst)
+        stats.add(0, "copy")
+
+    def _try_fast_copy(self, src: Path, dst: Path, stats: CopyStats, read_only: bool) -> bool:
+        """
+        Try a reflink and, for read-only copies, a hardlink
+        """
+        devices = (src.stat().st_dev, dst.parent.stat().st_dev)
+        if fcntl is not None and devices not in self._no_reflink:
+            try:
+                with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                stats.add(src.stat().st_size, "reflink")
+                return True
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._no_reflink.add(devices)
+                dst.unlink(missing_ok=True)
+        if read_only and devices[0] == devices[1]:
+            try:
+                os.link(src, dst)
+                stats.add(src.stat().st_size, "hardlink")
+                return True
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED and e.errno != errno.EMLINK:
+                    raise
+        return False
+
+    def _copy_chunked(self, executor: ThreadPoolExecutor, src: Path, dst: Path, size: int, stats: CopyStats):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fdst.truncate(size)
+            futures = [
+                executor.submit(self._copy_range, fsrc.fileno(), fdst.fileno(), offset,
+                                min(self.chunk_size, size - offset), stats)
+                for offset in range(0, size, self.chunk_size)
+            ]
+            for future in futures:
+                future.result()
+        shutil.copystat(src, dst)
+        stats.add(0, "copy")
+
+    @staticmethod
+    def _copy_range(src_fd: int, dst_fd: int, offset: int, length: int, stats: CopyStats):
+        """
+        Copy a part of a file, in the kernel if possible
+        """
+        end = offset + length
+        use_copy_file_range = hasattr(os, "copy_file_range")
+        while offset < end:
+            count = min(end - offset, 8 * 1024 * 1024)
+            copied = 0
+            if use_copy_file_range:
+                try:
+                    copied = os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    use_copy_file_range = False
+            if not use_copy_file_range:
+                data = os.pread(src_fd, count, offset)
+                copied = os.pwrite(dst_fd, data, offset) if data else 0
+            if copied == 0:
+                # the file got shorter while copying
+                break
+            offset += copied
+            stats.add(copied)
+
+
+async def copy_world_job(job: Job, manager: ServerManager, job_queue: JobQueue, copy_engine: CopyEngine, sid: str,
+                         world_name: str, dest: str, override: bool = False) -> dict:
+    server = manager.get_server(sid)
+    dest_server = manager.get_server(dest)
+    if server is None or dest_server is None:
+        raise Exception("Server not found")
+    source = Path(server.server_config.path) / "worlds" / world_name
+    destination = Path(dest_server.server_config.path) / "worlds" / world_name
+    if source == destination:
+        raise Exception("Source and destination are the same world")
+    result = await job_queue.run_blocking(copy_engine.copy_tree, source, destination, job.report, override)
+    dest_server.load_worlds()
+    return result
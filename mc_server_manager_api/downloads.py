@@ -0,0 +1,230 @@
+import hashlib
+import os
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from mc_server_interaction.manager.backup_manager import Backup
+
+from mc_server_manager_api.backups import IncrementalBackupStore, is_incremental
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# name, size, modification time, iterator over the content
+ArchiveEntry = Tuple[str, int, float, Iterator[bytes]]
+
+
+def get_archive_formats() -> List[str]:
+    formats = ["zip"]
+    if zstandard is not None:
+        formats.append("tar.zst")
+    return formats
+
+
+def backup_etag(bid: str, backup: Backup, archive_format: str = "") -> str:
+    """
+    Strong ETag of a backup. Backups are never modified, so the metadata identifies the content.
+    :param archive_format: Format the backup is converted to
+    """
+    stat = os.stat(backup.path)
+    data = f"{bid}:{backup.time.timestamp()}:{stat.st_size}:{stat.st_mtime_ns}:{archive_format}"
+    return '"' + hashlib.sha1(data.encode()).hexdigest() + '"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if header is None:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range. Returns None for unsupported (multiple) ranges
+    and raises ValueError if the range is not satisfiable.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+    start, _, end = ranges.strip().partition("-")
+    if start == "":
+        length = int(end)
+        if length <= 0:
+            raise ValueError()
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError()
+    return start, min(end, size - 1)
+
+
+def _read_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def file_response(request: Request, path: str, etag: str, filename: str,
+                  media_type: str = "application/zip") -> Response:
+    """
+    Response for a file with support for conditional and range requests
+    """
+    size = os.stat(path).st_size
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_read_file(path, start, end - start + 1), 206, headers, media_type)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_read_file(path, 0, size), 200, headers, media_type)
+
+
+def iter_backup_entries(backup: Backup, incremental_store: IncrementalBackupStore,
+                        prefix: str = "") -> Iterator[ArchiveEntry]:
+    """
+    Iterate over the files of a backup, without extracting it to disk
+    """
+    if is_incremental(backup):
+        manifest = incremental_store.load_manifest(Path(backup.path))
+        for rel_path, entry in manifest["files"].items():
+            chunks = (incremental_store.blobs.get(digest) for digest in entry["chunks"])
+            yield prefix + rel_path, entry["size"], entry["mtime_ns"] / 1e9, chunks
+        return
+
+    with zipfile.ZipFile(backup.path, "r") as zip_file:
+        for member in zip_file.infolist():
+            if member.is_dir():
+                continue
+
+            def read(member=member):
+                with zip_file.open(member) as f:
+                    while True:
+                        data = f.read(CHUNK_SIZE)
+                        if not data:
+                            return
+                        yield data
+
+            mtime = time.mktime(member.date_time + (0, 0, -1))
+            yield prefix + member.filename, member.file_size, mtime, read()
+
+
+class _StreamBuffer:
+    """
+    Write-only file object that collects the written data until it is taken
+    """
+
+    def __init__(self):
+        self.data: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.data.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self.data = b"".join(self.data), []
+        return data
+
+
+class _ChunkReader:
+    """
+    Read-only file object over an iterator of chunks
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.chunk = b""
+        self.offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = []
+        while size != 0:
+            if self.offset >= len(self.chunk):
+                self.chunk = next(self.chunks, None)
+                self.offset = 0
+                if self.chunk is None:
+                    self.chunk = b""
+                    break
+            end = len(self.chunk) if size < 0 else min(self.offset + size, len(self.chunk))
+            data.append(self.chunk[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b"".join(data)
+
+
+def stream_zip(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    """
+    Create a zip archive on the fly. Only the current chunk is kept in memory.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, size, mtime, chunks in entries:
+            info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zip_file.open(info, "w", force_zip64=True) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield buffer.take()
+            yield buffer.take()
+    yield buffer.take()
+
+
+def stream_tar_zst(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    """
+    Create a zstd compressed tar archive on the fly
+    """
+    buffer = _StreamBuffer()
+    compressor = zstandard.ZstdCompressor(level=3).stream_writer(buffer, closefd=False)
+    with tarfile.open(fileobj=compressor, mode="w|") as tar_file:
+        for name, size, mtime, chunks in entries:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(mtime)
+            tar_file.addfile(info, _ChunkReader(chunks))
+            yield buffer.take()
+    compressor.close()
+    yield buffer.take()
+
+
+def archive_response(entries: Iterable[ArchiveEntry], archive_format: str, filename: str,
+                     etag: Optional[str] = None) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{archive_format}"'}
+    if etag is not None:
+        headers["ETag"] = etag
+    if archive_format == "tar.zst":
+        return StreamingResponse(stream_tar_zst(entries), 200, headers, "application/zstd")
+    return StreamingResponse(stream_zip(entries), 200, headers, "application/zip")
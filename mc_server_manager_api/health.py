@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import psutil
+
+
+class StartupProfiler:
+    """
+    Timings of the startup. mark() records the time since the previous mark, so the initialization steps
+    can be timed without wrapping them. The first entry is the time from the start of the process until the
+    profiler was created, which is mostly the imports. Nothing is recorded if the profiler is disabled.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.enabled = enabled
+        self.timings: List[dict] = []
+        self._last_mark = time.perf_counter()
+        if enabled:
+            try:
+                since_process_start = time.time() - psutil.Process().create_time()
+            except psutil.Error:
+                since_process_start = None
+            self.timings.append({"step": "imports", "duration": since_process_start})
+
+    def mark(self, step: str):
+        now = time.perf_counter()
+        if self.enabled:
+            self.timings.append({"step": step, "duration": now - self._last_mark})
+        self._last_mark = now
+
+    def record(self, step: str, duration: float):
+        if self.enabled:
+            self.timings.append({"step": step, "duration": duration})
+
+    def log(self):
+        if not self.enabled:
+            return
+        lines = [f"{timing['step']:<24} {timing['duration'] * 1000:10.1f} ms" for timing in self.timings
+                 if timing["duration"] is not None]
+        self.logger.info("Startup timings:\n" + "\n".join(lines))
+
+
+class _Component:
+    def __init__(self, required: bool, check: Optional[Callable[[], bool]]):
+        self.required = required
+        self.check = check
+        self.ready = False
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+
+    def is_ready(self) -> bool:
+        if self.check is not None and not self.ready:
+            self.ready = self.check()
+        return self.ready
+
+    def to_dict(self):
+        return {"ready": self.is_ready(), "required": self.required, "error": self.error, "duration": self.duration}
+
+
+class Readiness:
+    """
+    Readiness of the components of the API. A component is either ready when its warm-up task is done,
+    or when its check returns True. The API is ready when all required components are ready.
+    """
+
+    def __init__(self, profiler: StartupProfiler):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.profiler = profiler
+        self.started_at = time.time()
+        self.components: Dict[str, _Component] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._logged = False
+
+    def add(self, name: str, required: bool = True, check: Optional[Callable[[], bool]] = None):
+        self.components[name] = _Component(required, check)
+
+    def set_ready(self, name: str):
+        self.components[name].ready = True
+
+    def run(self, name: str, func: Callable[[], Awaitable], required: bool = True) -> asyncio.Task:
+        """
+        Run the warm-up of a component in the background
+        """
+        self.add(name, required)
+        task = asyncio.create_task(self._run(name, func))
+        self._tasks.append(task)
+        return task
+
+    async def _run(self, name: str, func: Callable[[], Awaitable]):
+        component = self.components[name]
+        started = time.perf_counter()
+        try:
+            await func()
+        except Exception as e:
+            self.logger.exception(f"Warm-up of {name} failed: {e}")
+            component.error = str(e) or e.__class__.__name__
+            return
+        finally:
+            component.duration = time.perf_counter() - started
+            self.profiler.record(f"warm-up {name}", component.duration)
+        component.ready = True
+        if self.ready and not self._logged:
+            self._logged = True
+            self.profiler.record("until ready", time.time() - self.started_at)
+            self.profiler.log()
+
+    async def wait(self):
+        """
+        Wait for all warm-up tasks
+        """
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    @property
+    def ready(self) -> bool:
+        return all(component.is_ready() for component in self.components.values() if component.required)
+
+    def to_dict(self):
+        data = {
+            "ready": self.ready,
+            "uptime": time.time() - self.started_at,
+            "components": {name: component.to_dict() for name, component in self.components.items()}
+        }
+        if self.profiler.enabled:
+            data["startup"] = self.profiler.timings
+        return data
@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.jobs import Job, JobQueue
+from mc_server_manager_api.subscriptions import ServerSubscriptionManager
+from mc_server_manager_api.timeseries import MetricsStore
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of all metrics. Values are stored per tuple of label values.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in list(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def clear(self):
+        self.values = {}
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts per bucket (not cumulative, the last one is +Inf), sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Renders all registered metrics in the Prometheus text format. Collectors are called before rendering
+    and update gauges of values that are cheaper to read on scrape than to track continuously.
+    """
+    content_type = "text/plain; version=0.0.4"
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+        self.scrape_duration = self.gauge("mcsm_scrape_duration_seconds", "Duration of the last scrape")
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def render(self) -> bytes:
+        started = time.perf_counter()
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        self.scrape_duration.set(time.perf_counter() - started)
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _TimedFunction:
+    """
+    Wraps a function installed in a Callback of a server and records how long it takes. The wrapped function
+    is available as __wrapped__, so it can still be found to remove it.
+    """
+
+    def __init__(self, func: Callable, histogram: Histogram, callback_name: str):
+        self.__wrapped__ = func
+        self.histogram = histogram
+        self.callback_name = callback_name
+
+    async def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            await self.__wrapped__(*args, **kwargs)
+        finally:
+            self.histogram.observe(time.perf_counter() - started, self.callback_name)
+
+
+class Instrumentation:
+    """
+    The metrics of the API. The HTTP middleware measures latency per route template and the number of requests
+    in flight, a background task measures the event loop lag. Time spent in the middleware bookkeeping is counted
+    in mcsm_instrumentation_overhead_seconds_total, so the cost of the instrumentation itself is visible.
+    """
+
+    def __init__(self, manager: ServerManager, job_queue: JobQueue, subscriptions: ServerSubscriptionManager,
+                 metrics_store: MetricsStore, lag_interval: float = 0.5):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.job_queue = job_queue
+        self.subscriptions = subscriptions
+        self.metrics_store = metrics_store
+        self.lag_interval = lag_interval
+        self.registry = MetricsRegistry()
+        self._routes: Dict[Callable, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        r = self.registry
+        self.request_duration = r.histogram("mcsm_http_request_duration_seconds", "HTTP request latency per route",
+                                            ("method", "route", "status"))
+        self.requests_in_flight = r.gauge("mcsm_http_requests_in_flight", "HTTP requests currently being handled")
+        self.requests_in_flight.set(0)
+        self.overhead = r.counter("mcsm_instrumentation_overhead_seconds_total",
+                                  "Time spent recording request metrics")
+        self.overhead.inc(amount=0)
+        self.loop_lag = r.gauge("mcsm_event_loop_lag_seconds", "Last measured event loop lag")
+        self.loop_lag_histogram = r.histogram("mcsm_event_loop_lag_histogram_seconds", "Event loop lag")
+        self.callback_duration = r.histogram("mcsm_callback_dispatch_seconds",
+                                             "Duration of a function handling a server event", ("callback",))
+        self.job_duration = r.histogram("mcsm_job_duration_seconds", "Duration of finished background jobs",
+                                        ("kind", "state"), buckets=JOB_BUCKETS)
+        self.jobs = r.gauge("mcsm_jobs", "Background jobs per kind and state", ("kind", "state"))
+        self.websocket_subscribers = r.gauge("mcsm_websocket_subscribers", "Open websocket subscriptions per server",
+                                             ("sid",))
+        self.websocket_queued = r.gauge("mcsm_websocket_queued_messages",
+                                        "Messages waiting to be sent to websocket subscribers", ("sid",))
+        self.websocket_dropped = r.gauge("mcsm_websocket_dropped_messages",
+                                         "Messages dropped for slow websocket subscribers", ("sid",))
+        self.server_cpu = r.gauge("mcsm_server_cpu_percent", "CPU usage of the server process", ("sid",))
+        self.server_memory = r.gauge("mcsm_server_memory_bytes", "Memory usage of the server process", ("sid",))
+        self.server_running = r.gauge("mcsm_server_running", "Whether the server process is running", ("sid",))
+        r.add_collector(self._collect)
+        job_queue.on_finished = self.observe_job
+
+    def watch_servers(self):
+        """
+        Measure the functions installed in the callbacks of all servers. Functions that are added later,
+        e.g. by websocket subscriptions, are wrapped by add_callback(). Call this again when servers are added.
+        """
+        for server in self.manager.get_servers().values():
+            for name in ("output", "status", "properties", "system_metrics", "players"):
+                callback = getattr(server.callbacks, name)
+                if "add_callback" not in vars(callback):
+                    callback.add_callback = partial(self._add_timed_function, callback, name)
+                if all(isinstance(func, _TimedFunction) for func in callback.installed_callbacks):
+                    continue
+                # Rebind instead of replacing in place, the list may be iterated by a running dispatch
+                callback.installed_callbacks = [
+                    func if isinstance(func, _TimedFunction) else _TimedFunction(func, self.callback_duration, name)
+                    for func in callback.installed_callbacks
+                ]
+
+    def _add_timed_function(self, callback, callback_name: str, func: Callable):
+        callback.installed_callbacks.append(_TimedFunction(func, self.callback_duration, callback_name))
+
+    def observe_job(self, job: Job):
+        if job.started_at is not None and job.finished_at is not None:
+            self.job_duration.observe(job.finished_at - job.started_at, job.kind, job.state.value)
+
+    def _collect(self):
+        self.jobs.clear()
+        for job in list(self.job_queue.jobs.values()):
+            self.jobs.inc(job.kind, job.state.value)
+
+        for gauge in (self.websocket_subscribers, self.websocket_queued, self.websocket_dropped,
+                      self.server_cpu, self.server_memory, self.server_running):
+            gauge.clear()
+        for sid, server in self.manager.get_servers().items():
+            subscriptions = list(self.subscriptions.get_subscriptions(sid))
+            self.websocket_subscribers.set(len(subscriptions), sid)
+            self.websocket_queued.set(sum(len(subscription.subscriber) for subscription in subscriptions), sid)
+            self.websocket_dropped.set(sum(subscription.subscriber.dropped for subscription in subscriptions), sid)
+            self.server_running.set(int(server.is_running), sid)
+            history = self.metrics_store.get_history(sid)
+            latest = history.latest() if history is not None else None
+            if latest is not None:
+                self.server_cpu.set(latest["cpu"], sid)
+                self.server_memory.set(latest["memory_server"], sid)
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = "unmatched"
+            for app_route in scope["app"].routes:
+                if getattr(app_route, "endpoint", None) is endpoint:
+                    route = app_route.path
+                    break
+            self._routes[endpoint] = route
+        return route
+
+    def middleware(self, app):
+        """
+        Wrap an ASGI app. Only HTTP requests are measured, websocket connections are counted per subscription.
+        """
+        async def instrumented(scope, receive, send):
+            if scope["type"] != "http":
+                await app(scope, receive, send)
+                return
+
+            status = [500]
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    status[0] = message["status"]
+                await send(message)
+
+            self.requests_in_flight.inc()
+            started = time.perf_counter()
+            try:
+                await app(scope, receive, send_wrapper)
+            finally:
+                ended = time.perf_counter()
+                self.requests_in_flight.dec()
+                self.request_duration.observe(ended - started, scope["method"], self._route_template(scope),
+                                              str(status[0]))
+                self.overhead.inc(amount=time.perf_counter() - ended)
+        return instrumented
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._measure_lag())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(time.perf_counter() - started - self.lag_interval, 0)
+            self.loop_lag.set(lag)
+            self.loop_lag_histogram.observe(lag)
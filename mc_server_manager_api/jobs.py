@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Set
+
+import psutil
+
+from mc_server_manager_api.broadcast import OverflowPolicy, Subscriber
+
+
+class JobState(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job:
+    """
+    A background job like a backup. Blocking parts of a job report their progress with report(),
+    which may be called from a worker thread.
+    """
+
+    def __init__(self, kind: str, key: Hashable, func: Callable[["Job"], Awaitable], description: str = ""):
+        self.jid = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.description = description
+        self.state = JobState.PENDING
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.bytes_processed = 0
+        self.bytes_total = 0
+        self.result = None
+        self.error: Optional[str] = None
+        self.on_update: Optional[Callable[["Job"], None]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_report = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Processed bytes per second
+        """
+        if self.started_at is None:
+            return 0
+        duration = (self.finished_at or time.time()) - self.started_at
+        return self.bytes_processed / duration if duration > 0 else 0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Estimated remaining seconds
+        """
+        if self.state != JobState.RUNNING or not self.bytes_total or not self.throughput:
+            return None
+        return max(self.bytes_total - self.bytes_processed, 0) / self.throughput
+
+    def to_dict(self):
+        return {
+            "jid": self.jid,
+            "kind": self.kind,
+            "description": self.description,
+            "state": self.state.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "bytes_processed": self.bytes_processed,
+            "bytes_total": self.bytes_total,
+            "throughput": self.throughput,
+            "eta": self.eta,
+            "result": self.result,
+            "error": self.error
+        }
+
+    def report(self, bytes_processed: int, bytes_total: Optional[int] = None, interval: float = 0.5):
+        """
+        Update the progress. Subscribers are notified at most once per interval.
+        """
+        self.bytes_processed = bytes_processed
+        if bytes_total is not None:
+            self.bytes_total = bytes_total
+        now = time.monotonic()
+        if now - self._last_report < interval:
+            return
+        self._last_report = now
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.publish)
+
+    def publish(self):
+        if self.on_update is not None:
+            self.on_update(self)
+
+
+def _lower_thread_priority(niceness: int):
+    """
+    Lower the CPU and IO priority of the calling worker thread. On Linux, both apply per thread.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        psutil.Process(threading.get_native_id()).ionice(psutil.IOPRIO_CLASS_BE, 7)
+    except (AttributeError, OSError, psutil.Error):
+        # not supported on this platform
+        pass
+
+
+class JobQueue:
+    """
+    Runs jobs with a limited number of workers. Blocking work of a job should be run with run_blocking(),
+    which uses a thread pool with lowered CPU and IO priority, so running servers are not slowed down.
+    """
+
+    def __init__(self, workers: int = 2, niceness: int = 10, keep_finished: int = 100):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self.subscribers: Set[Subscriber] = set()
+        self.on_finished: Optional[Callable[[Job], None]] = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="JobWorker",
+            initializer=_lower_thread_priority, initargs=(niceness,)
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        self.executor.shutdown(wait=False)
+
+    def submit(self, kind: str, key: Hashable, func: Callable[[Job], Awaitable], description: str = "") -> Job:
+        """
+        Queue a job. If an identical job (same kind and key) is still pending, that job is returned instead.
+        """
+        for job in self.jobs.values():
+            if job.state == JobState.PENDING and job.kind == kind and job.key == key:
+                return job
+        self.start()
+        job = Job(kind, key, func, description)
+        job.on_update = self.publish
+        self.jobs[job.jid] = job
+        self._queue.put_nowait(job)
+        self.publish(job)
+        return job
+
+    def get_job(self, jid: str) -> Optional[Job]:
+        return self.jobs.get(jid)
+
+    async def run_blocking(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(max_queue_size=64, overflow_policy=OverflowPolicy.COALESCE)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, job: Job):
+        message = json.dumps(job.to_dict())
+        for subscriber in self.subscribers:
+            subscriber.put(message, key=job.jid)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job._loop = asyncio.get_running_loop()
+            job.state = JobState.RUNNING
+            job.started_at = time.time()
+            self.publish(job)
+            try:
+                job.result = await job.func(job)
+            except asyncio.CancelledError:
+                job.state = JobState.FAILED
+                job.error = "Cancelled"
+                raise
+            except Exception as e:
+                self.logger.error(f"Job {job.kind} {job.jid} failed: {e}")
+                job.state = JobState.FAILED
+                job.error = str(e) or e.__class__.__name__
+            else:
+                job.state = JobState.DONE
+            finally:
+                job.finished_at = time.time()
+                self.publish(job)
+                if self.on_finished is not None:
+                    self.on_finished(job)
+                self._remove_finished()
+
+    def _remove_finished(self):
+        finished = [jid for jid, job in self.jobs.items() if job.state in (JobState.DONE, JobState.FAILED)]
+        for jid in finished[:max(len(finished) - self.keep_finished, 0)]:
+            self.jobs.pop(jid)
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+
+def _fsync_dir(path: Path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Replace a file with a fully written and synced copy, so a crash leaves either the old or the new file
+    """
+    temp_path = path.with_name(f".{path.name}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    _fsync_dir(path.parent)
+
+
+def _encode_entry(entry: dict) -> bytes:
+    data = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+    return b"%08x " % zlib.crc32(data) + data + b"\n"
+
+
+def _read_entries(path: Path) -> List[dict]:
+    """
+    Read a journal up to the first incomplete or corrupted entry, which is the one that was written during a crash
+    """
+    entries = []
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n") or len(line) < 10:
+                    break
+                data = line[9:-1]
+                try:
+                    if int(line[:8], 16) != zlib.crc32(data):
+                        break
+                    entries.append(json.loads(data))
+                except ValueError:
+                    break
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _properties_data(properties: Dict[str, object]) -> bytes:
+    # same format as ServerProperties.save
+    lines = []
+    for key, value in properties.items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif value is None:
+            value = ""
+        lines.append(f"{key}={value}\n")
+    return "".join(lines).encode("utf-8")
+
+
+def _file_state(file_name: str) -> Optional[Tuple[int, int]]:
+    """
+    :return: The modification time in ns and the checksum of a file, None if it doesn't exist
+    """
+    try:
+        with open(file_name, "rb") as f:
+            return os.fstat(f.fileno()).st_mtime_ns, zlib.crc32(f.read())
+    except OSError:
+        return None
+
+
+def _saved_after(file_name: str, entry: dict) -> bool:
+    """
+    Whether the properties file was saved after the entry was journaled, or already has the journaled content.
+    Not all changes are journaled, e.g. the library saves the properties on its own, so these must not be
+    rolled back.
+    """
+    if "mtime_ns" not in entry:
+        return False
+    state = _file_state(file_name)
+    if state is None:
+        return False
+    mtime_ns, checksum = state
+    return checksum == entry["checksum"] or mtime_ns > entry["mtime_ns"]
+
+
+class StateJournal:
+    """
+    Write-ahead journal of the manager config and the server properties. Changes are appended as entries with a
+    checksum. Changes that happen within flush_delay are written together with one fsync, and repeated changes of
+    the same server are coalesced into one entry. The files of mc_server_interaction (manager_data.json and the
+    server.properties files) are the snapshot: they are only rewritten atomically on compaction, after which
+    the journal is discarded. On startup, the journal is replayed onto the snapshot before the ServerManager loads it.
+    Properties entries are only replayed if the file wasn't saved after the entry, the library and other services
+    save the properties without the journal.
+    """
+
+    def __init__(self, path: Path, data_file: Path, flush_delay: float = 0.1, compact_entries: int = 1000):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.path = path
+        self.old_path = path.with_name(path.name + ".old")
+        self.data_file = data_file
+        self.flush_delay = flush_delay
+        self.compact_entries = compact_entries
+        self.manager: Optional[ServerManager] = None
+        self.entries_since_compaction = 0
+        self._pending: Dict[Tuple[str, str], dict] = OrderedDict()
+        self._last_config: Optional[dict] = None
+        # servers whose properties were journaled since the last compaction
+        self._dirty_properties: Set[str] = set()
+        self._lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        self._compact_lock = asyncio.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    def recover(self) -> int:
+        """
+        Apply the journal to manager_data.json and the server.properties files. Has to be called before the
+        ServerManager is created.
+        :return: The number of replayed entries
+        """
+        entries = _read_entries(self.old_path) + _read_entries(self.path)
+        if not entries:
+            return 0
+        try:
+            with open(self.data_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        servers = data.setdefault("servers", {})
+        properties: Dict[str, dict] = {}
+        for entry in entries:
+            op = entry["op"]
+            if op == "server":
+                servers[entry["sid"]] = entry["config"]
+            elif op == "delete":
+                servers.pop(entry["sid"], None)
+                properties.pop(entry["sid"], None)
+            elif op == "manager":
+                data.update(entry["data"])
+            elif op == "properties":
+                properties[entry["sid"]] = entry
+
+        write_atomic(self.data_file, json.dumps(data, indent=4).encode("utf-8"))
+        for sid, entry in properties.items():
+            file_name = entry["file"]
+            if sid in servers and os.path.isdir(os.path.dirname(file_name)) and not _saved_after(file_name, entry):
+                write_atomic(Path(file_name), _properties_data(entry["properties"]))
+        self.old_path.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+        _fsync_dir(self.path.parent)
+        self.logger.info(f"Replayed {len(entries)} journal entries")
+        return len(entries)
+
+    def attach(self, manager: ServerManager):
+        """
+        Journal the changes of the manager config. The manager config is not written by save() anymore,
+        only on compaction.
+        """
+        self.manager = manager
+        self._last_config = self._config_state()
+        manager.config.save = self.save_config
+
+    def _config_state(self) -> dict:
+        config = self.manager.config
+        return {
+            "servers": {sid: dict(server_config.__dict__) for sid, server_config in config.get_servers().items()},
+            "manager": {"latest_sid": config.get_latest_sid(), "server_data_dir": config.server_data_dir}
+        }
+
+    def save_config(self):
+        """
+        Replacement for ManagerDataStore.save. Journals the servers whose config changed.
+        """
+        state = self._config_state()
+        last = self._last_config
+        for sid, server_config in state["servers"].items():
+            if last["servers"].get(sid) != server_config:
+                self._record(("server", sid), {"op": "server", "sid": sid, "config": server_config})
+        for sid in last["servers"].keys() - state["servers"].keys():
+            self._pending.pop(("properties", sid), None)
+            self._dirty_properties.discard(sid)
+            self._record(("server", sid), {"op": "delete", "sid": sid})
+        if state["manager"] != last["manager"]:
+            self._record(("manager", ""), {"op": "manager", "data": state["manager"]})
+        self._last_config = state
+
+    def record_properties(self, sid: str):
+        """
+        Journal the current properties of a server, after they were saved. The state of the saved file is
+        journaled too, so a later save that isn't journaled is not rolled back on recovery.
+        """
+        server = self.manager.get_server(sid)
+        if server is None:
+            return
+        self._dirty_properties.add(sid)
+        entry = {"op": "properties", "sid": sid, "file": server.properties.file_name,
+                 "properties": dict(server.properties.to_dict())}
+        state = _file_state(server.properties.file_name)
+        if state is not None:
+            entry["mtime_ns"], entry["checksum"] = state
+        self._record(("properties", sid), entry)
+
+    def _record(self, key: Tuple[str, str], entry: dict):
+        # a newer entry for the same key replaces the pending one and moves to the end
+        self._pending.pop(key, None)
+        self._pending[key] = entry
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # no event loop, e.g. while the app is imported
+                self._write(self._take_pending())
+
+    def _take_pending(self) -> List[dict]:
+        entries = list(self._pending.values())
+        self._pending.clear()
+        return entries
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+            # entries recorded while writing are written by the next round
+            if not self._pending:
+                return
+
+    async def _write_pending(self):
+        entries = self._take_pending()
+        if entries:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, entries)
+
+    async def flush(self):
+        """
+        Write the pending entries, and start a compaction if the journal is long enough
+        """
+        await self._write_pending()
+        if self.entries_since_compaction >= self.compact_entries and \
+                (self._compact_task is None or self._compact_task.done()):
+            self._compact_task = asyncio.create_task(self.compact())
+
+    def _write(self, entries: List[dict]):
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(_encode_entry(entry) for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries_since_compaction += len(entries)
+
+    async def compact(self):
+        """
+        Write the current state atomically to the files of mc_server_interaction and discard the journal.
+        Entries that are journaled meanwhile go to a new journal.
+        """
+        async with self._compact_lock:
+            await self._write_pending()
+            data, properties = self._snapshot()
+            with self._lock:
+                # the old journal is kept until the snapshot is written, so a crash meanwhile loses nothing
+                if self.path.exists():
+                    os.replace(self.path, self.old_path)
+                self.entries_since_compaction = 0
+            await asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, data, properties)
+
+    def _snapshot(self) -> Tuple[dict, Dict[str, dict]]:
+        state = self._config_state()
+        data = {
+            "servers": state["servers"],
+            "latest_sid": state["manager"]["latest_sid"],
+            "server_data_dir": state["manager"]["server_data_dir"]
+        }
+        properties = {}
+        for sid in self._dirty_properties:
+            server = self.manager.get_server(sid)
+            if server is not None:
+                properties[server.properties.file_name] = dict(server.properties.to_dict())
+        self._dirty_properties.clear()
+        return data, properties
+
+    def _write_snapshot(self, data: dict, properties: Dict[str, dict]):
+        write_atomic(self.data_file, json.dumps(data, indent=4).encode("utf-8"))
+        for file_name, values in properties.items():
+            if os.path.isdir(os.path.dirname(file_name)):
+                write_atomic(Path(file_name), _properties_data(values))
+        self.old_path.unlink(missing_ok=True)
+        _fsync_dir(self.path.parent)
+
+    async def close(self):
+        """
+        Write everything and compact, on shutdown
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.compact()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from mc_server_interaction.interaction import MinecraftServer
+from mc_server_interaction.interaction.models import ServerStatus
+from mc_server_interaction.manager import ServerManager
+
+
+class ServerBusyException(Exception):
+    pass
+
+
+class LifecycleEngine:
+    """
+    Starts, stops and restarts many servers with bounded parallelism. Stopping is graceful first,
+    servers that don't stop within the timeout are killed. Starting servers are stopped once they are online.
+    """
+    actions = ("start", "stop", "restart")
+
+    def __init__(self, manager: ServerManager, parallelism: int = 4, stop_timeout: float = 60):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.parallelism = parallelism
+        self.stop_timeout = stop_timeout
+        # called before a server is started, may raise to refuse the start
+        self.before_start: Optional[Callable[[MinecraftServer], Awaitable]] = None
+        # sid -> reason, servers that must not be started, e.g. while their world files are rewritten
+        self.start_guards: Dict[str, str] = {}
+
+    async def run(self, action: str, sids: Iterable[str], stop_timeout: Optional[float] = None,
+                  deadline: Optional[float] = None, parallelism: Optional[int] = None) -> Dict[str, dict]:
+        """
+        :param action: start, stop or restart
+        :param sids: Servers to apply the action to
+        :param stop_timeout: Seconds to wait for a graceful stop before the server is killed
+        :param deadline: time.monotonic() by which all servers must be stopped. Servers that are still
+                         running then are killed
+        :param parallelism: Number of servers to handle at once
+        :return: Result per sid
+        """
+        if action not in self.actions:
+            raise ValueError(f"Unknown action {action}")
+        semaphore = asyncio.Semaphore(parallelism or self.parallelism)
+        stop_timeout = self.stop_timeout if stop_timeout is None else stop_timeout
+
+        async def run_one(sid: str):
+            async with semaphore:
+                started = time.monotonic()
+                server = self.manager.get_server(sid)
+                try:
+                    if server is None:
+                        raise Exception("Server not found")
+                    timeout = stop_timeout
+                    if deadline is not None:
+                        timeout = max(min(timeout, deadline - time.monotonic()), 0)
+                    if action == "start":
+                        result = await self.start(server)
+                    elif action == "stop":
+                        result = await self.stop(server, timeout)
+                    else:
+                        await self.stop(server, timeout)
+                        await self.start(server)
+                        result = "restarted"
+                    ret = {"result": result}
+                except Exception as e:
+                    self.logger.error(f"Failed to {action} server {sid}: {e}")
+                    ret = {"result": "error", "error": str(e) or e.__class__.__name__}
+                ret["duration"] = time.monotonic() - started
+                return sid, ret
+
+        results = await asyncio.gather(*[run_one(sid) for sid in dict.fromkeys(sids)])
+        return dict(results)
+
+    async def start(self, server: MinecraftServer) -> str:
+        if not server.server_config.installed:
+            raise Exception("Server is not installed yet")
+        if server.is_running:
+            return "already_running"
+        for sid, reason in self.start_guards.items():
+            if self.manager.get_server(sid) is server:
+                raise ServerBusyException(reason)
+        if self.before_start is not None:
+            await self.before_start(server)
+        await server.start()
+        return "started"
+
+    @contextmanager
+    def guard_start(self, sid: str, reason: str):
+        """
+        Refuse to start the server while the context is active
+        :raises ServerBusyException: If the server is already guarded
+        """
+        if sid in self.start_guards:
+            raise ServerBusyException(self.start_guards[sid])
+        self.start_guards[sid] = reason
+        try:
+            yield
+        finally:
+            self.start_guards.pop(sid, None)
+
+    async def stop(self, server: MinecraftServer, timeout: float) -> str:
+        if not server.is_running:
+            return "not_running"
+        end = time.monotonic() + timeout
+        # a starting server doesn't accept the stop command yet, so wait until it is online
+        while server.is_running and server.status == ServerStatus.STARTING and time.monotonic() < end:
+            await asyncio.sleep(0.5)
+        if server.is_online:
+            await server.stop()
+        while time.monotonic() < end:
+            if not server.is_running:
+                return "stopped"
+            await asyncio.sleep(0.5)
+        if not server.is_running:
+            return "stopped"
+
+        self.logger.warning(f"Server {server.name} did not stop in time, killing it")
+        server.kill()
+        await asyncio.sleep(0.5)
+        await server.set_status(ServerStatus.STOPPED)
+        server.save_properties()
+        return "killed"
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional
 
 from mc_server_interaction.interaction.models import Player
 from mc_server_interaction.manager.models import WorldGenerationSettings
@@ -105,8 +105,10 @@ class MinecraftServerModel(BaseModel):
                     {
                         "name": "world",
                         "path": "/path/to/servers/MyServer42/worlds/world",
-                        "version": None,
-                        "type": None
+                        "version": "1.19.2",
+                        "type": None,
+                        "size": 104857600,
+                        "last_played": 1665000000.0
                     }
                 ],
                 "properties": {
@@ -160,7 +162,9 @@ class AllWorldsResponse(BaseModel):
                         "name": "My World",
                         "path": "/path/to/the/world",
                         "version": "1.19.2",
-                        "type": "Default"
+                        "type": None,
+                        "size": 104857600,
+                        "last_played": 1665000000.0
                     }
                 ]
             }
@@ -178,7 +182,9 @@ class ServerWorldsResponse(BaseModel):
                         "name": "My World",
                         "path": "/path/to/the/world",
                         "version": "1.19.2",
-                        "type": "Default"
+                        "type": None,
+                        "size": 104857600,
+                        "last_played": 1665000000.0
                     }
                 ]
             }
@@ -243,4 +249,375 @@ class WhitelistResponse(BaseModel):
 
 
 class CreateBackupModel(BaseModel):
-    world_name: str = Field(..., title="Name of the world")
\ No newline at end of file
+    world_name: str = Field(..., title="Name of the world")
+    incremental: bool = Field(False, title="Incremental backup",
+                              description="Store only the parts of the world that changed since the last "
+                                          "incremental backup")
+
+
+class BackupRetentionModel(BaseModel):
+    keep_last: Optional[int] = Field(None, title="Number of backups to keep per server and world")
+    max_age: Optional[float] = Field(None, title="Delete backups older than this many seconds")
+    sid: Optional[str] = Field(None, title="Only apply the policy to the backups of this server")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "keep_last": 24,
+                "max_age": 604800,
+                "sid": None
+            }
+        }
+
+
+class WorldUploadCreationData(BaseModel):
+    filename: str = Field(..., title="Name of the zip file")
+    size: int = Field(..., title="Size of the zip file in bytes")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "filename": "MyWorld.zip",
+                "size": 2147483648
+            }
+        }
+
+
+class WorldUploadStatusModel(BaseModel):
+    uid: str = Field(..., title="Id of the upload")
+    sid: str = Field(..., title="Sid of the server")
+    world_name: str = Field(..., title="Name of the world directory")
+    size: int = Field(..., title="Size of the zip file in bytes")
+    received: int = Field(..., title="Received bytes", description="Continue an interrupted upload from this offset")
+    extracted: int = Field(..., title="Extracted bytes")
+    total: int = Field(..., title="Uncompressed size of the world")
+    state: str = Field(..., title="State of the upload",
+                       description="One of uploading, extracting, done, failed")
+    error: Optional[str] = Field(None, title="Error message")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "uid": "4f0c5e0e5a4c4d0f9b6e7d2a1c3b5a79",
+                "sid": "42",
+                "world_name": "MyWorld",
+                "size": 2147483648,
+                "received": 1073741824,
+                "extracted": 0,
+                "total": 0,
+                "state": "uploading",
+                "error": None
+            }
+        }
+
+
+class ConsoleLogResponse(BaseModel):
+    lines: list = Field(..., title="Console lines with their sequence number")
+    first_seq: int = Field(..., title="Sequence number of the oldest available line")
+    next_seq: int = Field(..., title="Pass this as after_seq to get the next page")
+    last_seq: int = Field(..., title="Sequence number of the newest line")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "lines": [
+                    {"seq": 41, "line": "[12:00:00] [Server thread/INFO]: Starting minecraft server version 1.19.2"},
+                    {"seq": 42, "line": "[12:00:05] [Server thread/INFO]: Done (4.2s)! For help, type \"help\""}
+                ],
+                "first_seq": 1,
+                "next_seq": 42,
+                "last_seq": 42
+            }
+        }
+
+
+class MetricsHistoryResponse(BaseModel):
+    resolution: int = Field(..., title="Resolution of the stored samples in seconds")
+    step: float = Field(..., title="Seconds per returned sample")
+    timestamps: list = Field(..., title="Start of each sample")
+    cpu: list = Field(..., title="Mean CPU usage in percent")
+    cpu_max: list = Field(..., title="Maximum CPU usage in percent")
+    memory_server: list = Field(..., title="Mean memory usage of the server in bytes")
+    memory_server_max: list = Field(..., title="Maximum memory usage of the server in bytes")
+    memory_used: list = Field(..., title="Mean memory usage of the system in bytes")
+    memory_used_max: list = Field(..., title="Maximum memory usage of the system in bytes")
+    memory_total: list = Field(..., title="Total memory of the system in bytes")
+    memory_total_max: list = Field(..., title="Total memory of the system in bytes")
+
+
+class JobModel(BaseModel):
+    jid: str = Field(..., title="Id of the job")
+    kind: str = Field(..., title="Kind of the job", description="One of backup, restore, install_server, copy_world")
+    description: str = Field(..., title="Description of the job")
+    state: str = Field(..., title="State of the job", description="One of pending, running, done, failed")
+    created_at: float = Field(..., title="Time the job was queued")
+    started_at: Optional[float] = Field(None, title="Time the job was started")
+    finished_at: Optional[float] = Field(None, title="Time the job finished")
+    bytes_processed: int = Field(..., title="Processed bytes")
+    bytes_total: int = Field(..., title="Total bytes to process, 0 if unknown")
+    throughput: float = Field(..., title="Processed bytes per second")
+    eta: Optional[float] = Field(None, title="Estimated remaining seconds")
+    result: Optional[dict] = Field(None, title="Result of the job")
+    error: Optional[str] = Field(None, title="Error message")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "jid": "0b5c7f2e8d9a4e7c9f4d3b2a1c0e9f8d",
+                "kind": "backup",
+                "description": "Backup world world of server 42",
+                "state": "running",
+                "created_at": 1665000000.0,
+                "started_at": 1665000001.0,
+                "finished_at": None,
+                "bytes_processed": 524288000,
+                "bytes_total": 1073741824,
+                "throughput": 104857600.0,
+                "eta": 5.2,
+                "result": None,
+                "error": None
+            }
+        }
+
+
+class JobsResponse(BaseModel):
+    jobs: list = Field(..., title="List of queued, running and recently finished jobs")
+
+
+class BulkLifecycleModel(BaseModel):
+    sids: Optional[list] = Field(None, title="Sids of the servers")
+    status: Optional[str] = Field(None, title="Select all servers with this status")
+    all: bool = Field(False, title="Select all servers")
+    timeout: Optional[float] = Field(None, title="Seconds to wait for a graceful stop before a server is killed")
+    parallelism: Optional[int] = Field(None, title="Number of servers to handle at once")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "sids": ["1", "2"],
+                "status": None,
+                "all": False,
+                "timeout": 60,
+                "parallelism": 4
+            }
+        }
+
+
+class BulkLifecycleResponse(BaseModel):
+    results: dict = Field(..., title="Result per sid")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "results": {
+                    "1": {"result": "stopped", "duration": 4.5},
+                    "2": {"result": "killed", "duration": 60.5},
+                    "3": {"result": "error", "error": "Server not found", "duration": 0.0}
+                }
+            }
+        }
+
+
+class CommandModel(BaseModel):
+    command: str = Field(..., title="Server command")
+    expect: Optional[str] = Field(None, title="Regular expression of the console line to wait for")
+    timeout: Optional[float] = Field(None, title="Seconds to wait for the expected console line")
+
+
+class CommandBatchModel(BaseModel):
+    commands: List[CommandModel] = Field(..., title="Commands, sent in this order")
+    wait: bool = Field(True, title="Wait until all commands are sent and the expected lines were printed")
+    timeout: float = Field(5, title="Default seconds to wait for an expected console line")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "commands": [
+                    {"command": "whitelist add ObiWanKenobi", "expect": "Added ObiWanKenobi to the whitelist"},
+                    {"command": "say hello world"}
+                ],
+                "wait": True,
+                "timeout": 5
+            }
+        }
+
+
+class CommandBatchResponse(BaseModel):
+    results: list = Field(..., title="Result per command, in the order of the request")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "results": [
+                    {"command": "whitelist add ObiWanKenobi", "result": "matched",
+                     "output": "[12:00:00] [Server thread/INFO]: Added ObiWanKenobi to the whitelist"},
+                    {"command": "say hello world", "result": "sent"}
+                ]
+            }
+        }
+
+
+class CommandRateLimitModel(BaseModel):
+    rate: float = Field(..., gt=0, title="Commands per second")
+    burst: int = Field(..., ge=1, title="Commands that may be sent at once")
+
+
+class TemplateCreationModel(BaseModel):
+    name: str = Field(..., title="Name of the template", regex=r"^[A-Za-z0-9_\-]{1,64}$")
+    version: Optional[str] = Field(None, title="Server version, defaults to the version of the source server")
+    properties: dict = Field({}, title="Server properties of new servers")
+    sid: Optional[str] = Field(None, title="Copy the base files, and optionally a world, of this server")
+    world: Optional[str] = Field(None, title="Name of the seed world of the source server")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "name": "survival",
+                "version": None,
+                "properties": {"difficulty": "hard", "max-players": 10},
+                "sid": "1",
+                "world": "world"
+            }
+        }
+
+
+class TemplatesResponse(BaseModel):
+    templates: list = Field(..., title="List of templates")
+
+
+class ServerBatchModel(BaseModel):
+    template: str = Field(..., title="Template to create the servers from")
+    names: List[str] = Field(..., min_items=1, title="Display names of the new servers")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "template": "survival",
+                "names": ["Event 1", "Event 2", "Event 3"]
+            }
+        }
+
+
+class ServerBatchResponse(BaseModel):
+    servers: list = Field(..., title="Sids of the created servers")
+    jid: str = Field(..., title="Job that installs the servers")
+
+
+class WorldStatsResponse(BaseModel):
+    scanned_at: float = Field(..., title="Time of the last scan")
+    duration: float = Field(..., title="Duration of the last scan in seconds")
+    radius: Optional[int] = Field(None, title="Radius of the coverage in chunks")
+    dimensions: dict = Field(..., title="Statistics per dimension")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "scanned_at": 1665000000.0,
+                "duration": 1.2,
+                "radius": 100,
+                "dimensions": {
+                    "overworld": {
+                        "region_files": 12, "entity_files": 12, "chunks": 9216, "size": 98566144,
+                        "used_size": 91226112, "entities": 3120, "tile_entities": 880, "inhabited_time": 51840000,
+                        "last_saved": 1665000000,
+                        "bounds": {"min_x": -64, "max_x": 63, "min_z": -32, "max_z": 63},
+                        "coverage": 0.18
+                    }
+                }
+            }
+        }
+
+
+class WorldHotspotsResponse(BaseModel):
+    metric: str = Field(..., title="Metric the chunks are sorted by")
+    hotspots: list = Field(..., title="Chunks, highest value first")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "metric": "entities",
+                "hotspots": [
+                    {"dimension": "overworld", "x": 12, "z": -4, "entities": 412, "tile_entities": 36,
+                     "size": 24576, "inhabited_time": 720000}
+                ]
+            }
+        }
+
+
+class PruneWorldModel(BaseModel):
+    radius: Optional[int] = Field(None, ge=0, title="Chunks within this square radius around the center are kept",
+                                  description="Without a radius, no chunks are removed and the region files are "
+                                              "only compacted")
+    center_x: int = Field(0, title="Chunk x coordinate of the center")
+    center_z: int = Field(0, title="Chunk z coordinate of the center")
+    max_inhabited_time: int = Field(0, ge=0, title="Chunks outside the radius with at most this many ticks of "
+                                                   "player presence are removed")
+    dry_run: bool = Field(True, title="Only report the bytes that would be saved")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "radius": 200,
+                "center_x": 0,
+                "center_z": 0,
+                "max_inhabited_time": 1200,
+                "dry_run": True
+            }
+        }
+
+
+class PlayerSearchResponse(BaseModel):
+    total: int = Field(..., title="Number of matching players")
+    players: list = Field(..., title="Matching players sorted by name, with their roles per server")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "total": 1,
+                "players": [
+                    {"name": "Notch", "uuid": "069a79f4-44e9-4726-a5be-fca90e38aaf5", "online": True,
+                     "last_seen": 1665400000.0,
+                     "servers": [{"sid": "1", "online": True, "op": True, "banned": False, "op_level": 4,
+                                  "last_seen": 1665400000.0}]}
+                ]
+            }
+        }
+
+
+class ServerPolicyModel(BaseModel):
+    hibernate: bool = Field(False, title="Stop the server when no players were online for idle_timeout seconds")
+    idle_timeout: float = Field(15 * 60, gt=0, title="Seconds without online players before the server is stopped")
+    backup: bool = Field(True, title="Back up the active world before the server is stopped")
+    incremental_backup: bool = Field(True, title="Create an incremental backup")
+    wake_on_connect: bool = Field(False, title="Start the stopped server when a client connects to its port")
+    memory_overhead: int = Field(512, ge=0, title="Memory in MiB the server uses on top of its heap")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "hibernate": True,
+                "idle_timeout": 900,
+                "backup": True,
+                "incremental_backup": True,
+                "wake_on_connect": True,
+                "memory_overhead": 512
+            }
+        }
+
+
+class ServerPolicyStateResponse(BaseModel):
+    policy: ServerPolicyModel
+    online_players: Optional[int] = Field(None, title="Online players, if known")
+    idle_since: Optional[float] = Field(None, title="Time since when no players are online")
+    hibernated: bool = Field(..., title="The server was stopped because it was idle")
+    queued_since: Optional[float] = Field(None, title="Time the start of the server was queued")
+    listening: bool = Field(..., title="A stub listens on the server port to wake the server")
+    wake_connections: int = Field(..., title="Connections to the stub")
+
+
+class SchedulerResponse(BaseModel):
+    memory_headroom: int = Field(..., title="Bytes of memory available for another server")
+    reserved_memory: int = Field(..., title="Bytes of memory that are not used for servers")
+    queued_starts: list = Field(..., title="Servers that are started when enough memory is free, oldest first")
+    hibernated: list = Field(..., title="Sids of servers that were stopped because they were idle")
+    listening: list = Field(..., title="Sids of servers that are woken when a client connects")
@@ -0,0 +1,494 @@
+import asyncio
+import bisect
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from mc_server_interaction.interaction import MinecraftServer
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.journal import write_atomic
+from mc_server_manager_api.subscriptions import serialize_players
+
+player_roles = ("op", "banned")
+uuid_prefix_pattern = re.compile(r"^[0-9a-f\-]{4,36}$")
+# the bulk endpoint resolves up to 10 names per request
+mojang_profiles_url = "https://api.mojang.com/profiles/minecraft"
+mojang_batch_size = 10
+
+
+def _normalize_uuid(value: str) -> str:
+    return value.replace("-", "").lower()
+
+
+def _format_uuid(value: str) -> str:
+    value = _normalize_uuid(value)
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+
+class MojangLookupCache:
+    """
+    Persistent cache of player name to UUID lookups. get() never waits for Mojang: unknown or expired names
+    are resolved in the background, in batches, and the listeners are called with the result. Names that
+    don't exist are cached for a shorter time. The usercache.json files of the servers are read first,
+    so most players are known without a request.
+    """
+
+    def __init__(self, path: Path, ttl: float = 30 * 24 * 60 * 60, negative_ttl: float = 60 * 60,
+                 max_entries: int = 50000, save_delay: float = 5):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.path = path
+        # names can be changed every 30 days
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self.listeners: List[Callable[[str, Optional[str]], None]] = []
+        # lower case name -> {"name", "uuid", "resolved_at"}, least recently used first
+        self.entries: Dict[str, dict] = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._seed_files: List[Path] = []
+        self._task: Optional[asyncio.Task] = None
+        self._save_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._dirty = False
+        # the saved lookups are read by the lookup loop
+        self.loaded = False
+
+    def _read(self) -> List[dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)["entries"]
+        except (OSError, KeyError, ValueError):
+            return []
+
+    async def _load(self):
+        entries = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        for entry in entries:
+            key = entry["name"].lower()
+            if key in self.entries:
+                continue
+            self.entries[key] = entry
+            # players that were indexed before get their UUID
+            if entry["uuid"] is not None:
+                for listener in self.listeners:
+                    listener(entry["name"], entry["uuid"])
+        self.loaded = True
+
+    def _save(self, entries: List[dict]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.path, json.dumps({"entries": entries}, separators=(",", ":")).encode("utf-8"))
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._lookup_loop())
+
+    async def stop(self):
+        for task in (self._task, self._save_task):
+            if task is not None:
+                task.cancel()
+        self._task = None
+        self._save_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._dirty and self.loaded:
+            await asyncio.get_running_loop().run_in_executor(None, self._save, list(self.entries.values()))
+            self._dirty = False
+
+    def _is_fresh(self, entry: dict) -> bool:
+        ttl = self.ttl if entry["uuid"] is not None else self.negative_ttl
+        return time.time() - entry["resolved_at"] < ttl
+
+    def get(self, name: str) -> Optional[str]:
+        """
+        The UUID of a player, or None if it is unknown. Unknown and expired names are looked up in the background.
+        """
+        key = name.lower()
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if self._is_fresh(entry):
+                return entry["uuid"]
+        self._enqueue(key)
+        # an expired entry is still better than nothing
+        return entry["uuid"] if entry is not None else None
+
+    def _enqueue(self, key: str):
+        if self._queue is None or key in self._queued:
+            return
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+
+    def seed(self, path: Path):
+        """
+        Read the usercache.json of a server before the next lookups
+        """
+        self._seed_files.append(path)
+        if self._queue is not None:
+            # wake up the lookup loop
+            self._queue.put_nowait(None)
+
+    def _read_seed_files(self, paths: List[Path]) -> List[dict]:
+        entries = []
+        for path in paths:
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for item in data if isinstance(data, list) else []:
+                try:
+                    entries.append({"name": item["name"], "uuid": _format_uuid(item["uuid"])})
+                except (KeyError, TypeError, AttributeError):
+                    continue
+        return entries
+
+    def _set(self, name: str, uuid: Optional[str], resolved_at: Optional[float] = None):
+        key = name.lower()
+        old = self.entries.pop(key, None)
+        self.entries[key] = {"name": name, "uuid": uuid, "resolved_at": resolved_at or time.time()}
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = True
+        if old is None or old["uuid"] != uuid:
+            for listener in self.listeners:
+                listener(name, uuid)
+
+    async def _lookup_loop(self):
+        loop = asyncio.get_running_loop()
+        await self._load()
+        while True:
+            first = await self._queue.get()
+            if self._seed_files:
+                paths, self._seed_files = self._seed_files, []
+                for entry in await loop.run_in_executor(None, self._read_seed_files, paths):
+                    self._set(entry["name"], entry["uuid"])
+                self._schedule_save()
+            batch = [first] if first is not None else []
+            while len(batch) < mojang_batch_size and not self._queue.empty():
+                key = self._queue.get_nowait()
+                if key is not None:
+                    batch.append(key)
+            # seeded meanwhile
+            keys = [key for key in batch if key not in self.entries or not self._is_fresh(self.entries[key])]
+            if not keys:
+                self._queued.difference_update(batch)
+                continue
+            delay = await self._resolve(keys)
+            self._queued.difference_update(batch)
+            self._schedule_save()
+            await asyncio.sleep(delay)
+
+    async def _resolve(self, keys: List[str]) -> float:
+        """
+        :return: The time to wait before the next request
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        try:
+            async with self._session.post(mojang_profiles_url, json=keys) as resp:
+                if resp.status == 429:
+                    self.logger.warning("Rate limited by Mojang, retrying the lookups later")
+                    for key in keys:
+                        self._queue.put_nowait(key)
+                    return 60
+                resp.raise_for_status()
+                profiles = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.logger.warning(f"Failed to look up {len(keys)} players: {e}")
+            return 10
+        resolved = set()
+        for profile in profiles:
+            self._set(profile["name"], _format_uuid(profile["id"]))
+            resolved.add(profile["name"].lower())
+        for key in keys:
+            if key not in resolved:
+                self._set(key, None)
+        return 1
+
+    def _schedule_save(self):
+        if self._dirty and (self._save_task is None or self._save_task.done()):
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        self._dirty = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._save, list(self.entries.values()))
+        except OSError as e:
+            self._dirty = True
+            self.logger.warning(f"Failed to save player lookups: {e}")
+
+
+class _PlayerEntry:
+    __slots__ = ("name", "uuid", "last_seen", "servers")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.uuid: Optional[str] = None
+        self.last_seen: Optional[float] = None
+        # sid -> {"online", "op", "banned", "op_level", "last_seen"}
+        self.servers: Dict[str, dict] = {}
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "uuid": self.uuid,
+            "online": any(server["online"] for server in self.servers.values()),
+            "last_seen": self.last_seen,
+            "servers": [{"sid": sid, **server} for sid, server in self.servers.items()]
+        }
+
+
+class PlayerPoller:
+    """
+    Reads the players of all servers every interval in the default executor and calls the listeners with the
+    players of a server when they changed. The online players of a running server are read with a query
+    request, so they are not read on the event loop. Services listen here instead of installing a players
+    callback, which would make every server poll its players on the event loop.
+    """
+
+    def __init__(self, manager: ServerManager, interval: float = 5):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.interval = interval
+        # called with the sid and the players as the value of the players callback
+        self.listeners: List[Callable[[str, dict], Awaitable]] = []
+        self.players: Dict[str, dict] = {}
+        self._watched: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        self._watched = set(servers)
+        for sid in list(self.players):
+            if sid not in servers:
+                self.players.pop(sid)
+
+    def get(self, sid: str) -> Optional[dict]:
+        """
+        The players of the server as of the last poll
+        """
+        return self.players.get(sid)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                self.logger.exception(f"Failed to poll players: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def poll(self):
+        servers = {sid: self.manager.get_server(sid) for sid in self._watched}
+        results = await asyncio.get_running_loop().run_in_executor(None, self._read_players, servers)
+        for sid, players in results.items():
+            if sid not in self._watched or players == self.players.get(sid):
+                continue
+            self.players[sid] = players
+            for listener in list(self.listeners):
+                try:
+                    await listener(sid, players)
+                except Exception as e:
+                    self.logger.exception(f"Failed to handle the players of server {sid}: {e}")
+
+    def _read_players(self, servers: Dict[str, MinecraftServer]) -> Dict[str, dict]:
+        results = {}
+        for sid, server in servers.items():
+            if server is None:
+                continue
+            try:
+                results[sid] = serialize_players(server.players)
+            except Exception as e:
+                # e.g. the query of a server that is still starting
+                self.logger.debug(f"Failed to read the players of server {sid}: {e}")
+        return results
+
+
+class PlayerIndex:
+    """
+    Players of all servers by name and UUID, kept current by the player poller.
+    Names and UUIDs are kept in sorted lists, so prefix searches don't scan all players.
+    Players that left a server are kept with their last_seen for offline_ttl seconds, at most max_offline_players
+    per server.
+    """
+
+    def __init__(self, manager: ServerManager, lookups: MojangLookupCache, poller: PlayerPoller,
+                 offline_ttl: float = 30 * 24 * 3600, max_offline_players: int = 1000):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.offline_ttl = offline_ttl
+        self.max_offline_players = max_offline_players
+        self.lookups = lookups
+        lookups.listeners.append(self._on_lookup)
+        poller.listeners.append(self._on_players)
+        # lower case name -> entry
+        self.players: Dict[str, _PlayerEntry] = {}
+        self._names: List[str] = []
+        # (normalized uuid, lower case name)
+        self._uuids: List[Tuple[str, str]] = []
+        self._watched: Set[str] = set()
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        for sid in list(self._watched):
+            if sid not in servers:
+                self.forget(sid)
+        for sid, server in servers.items():
+            if sid in self._watched:
+                continue
+            self._watched.add(sid)
+            self.lookups.seed(Path(server.server_config.path) / "usercache.json")
+
+    def forget(self, sid: str):
+        self._watched.discard(sid)
+        for key in [key for key, entry in self.players.items() if sid in entry.servers]:
+            self._remove_server(key, sid)
+
+    def _get_entry(self, name: str) -> _PlayerEntry:
+        key = name.lower()
+        entry = self.players.get(key)
+        if entry is None:
+            entry = self.players[key] = _PlayerEntry(name)
+            bisect.insort(self._names, key)
+        if entry.uuid is None:
+            # cheap, a failed or missing lookup is retried in the background
+            uuid = self.lookups.get(name)
+            if uuid is not None:
+                self._set_uuid(entry, uuid)
+        return entry
+
+    def _set_uuid(self, entry: _PlayerEntry, uuid: Optional[str]):
+        key = entry.name.lower()
+        if entry.uuid is not None:
+            item = (_normalize_uuid(entry.uuid), key)
+            i = bisect.bisect_left(self._uuids, item)
+            if i < len(self._uuids) and self._uuids[i] == item:
+                del self._uuids[i]
+        entry.uuid = uuid
+        if uuid is not None:
+            bisect.insort(self._uuids, (_normalize_uuid(uuid), key))
+
+    def _remove_server(self, key: str, sid: str):
+        entry = self.players[key]
+        entry.servers.pop(sid, None)
+        if entry.servers:
+            return
+        self._set_uuid(entry, None)
+        del self.players[key]
+        i = bisect.bisect_left(self._names, key)
+        if i < len(self._names) and self._names[i] == key:
+            del self._names[i]
+
+    def _on_lookup(self, name: str, uuid: Optional[str]):
+        entry = self.players.get(name.lower())
+        if entry is not None and uuid is not None and entry.uuid != uuid:
+            self._set_uuid(entry, uuid)
+
+    async def _on_players(self, sid: str, players: dict):
+        if sid in self._watched:
+            self.update(sid, players)
+
+    def update(self, sid: str, players: dict):
+        """
+        Replace the players of a server
+        :param players: The value of the players callback, a dict of lists of player dicts
+        """
+        now = time.time()
+        current: Dict[str, dict] = {}
+        for player in players.get("online_players") or []:
+            current.setdefault(player["name"], {})["online"] = True
+        for player in players.get("op_players") or []:
+            current.setdefault(player["name"], {}).update(op=True, op_level=player.get("op_level"))
+        for player in players.get("banned_players") or []:
+            current.setdefault(player["name"], {})["banned"] = True
+
+        offline: List[Tuple[float, str]] = []
+        for key in [key for key, entry in self.players.items() if sid in entry.servers]:
+            entry = self.players[key]
+            if entry.name in current:
+                continue
+            last_seen = entry.servers[sid]["last_seen"]
+            if last_seen is None or now - last_seen > self.offline_ttl:
+                self._remove_server(key, sid)
+                continue
+            # the player left and is neither op nor banned anymore, keep when they were seen
+            entry.servers[sid] = {"online": False, "op": False, "banned": False, "op_level": None,
+                                  "last_seen": last_seen}
+            offline.append((last_seen, key))
+        if len(offline) > self.max_offline_players:
+            offline.sort()
+            for _, key in offline[:len(offline) - self.max_offline_players]:
+                self._remove_server(key, sid)
+        for name, state in current.items():
+            entry = self._get_entry(name)
+            old = entry.servers.get(sid) or {}
+            online = state.get("online", False)
+            last_seen = now if online else old.get("last_seen")
+            if online:
+                entry.last_seen = now
+            entry.servers[sid] = {
+                "online": online,
+                "op": state.get("op", False),
+                "banned": state.get("banned", False),
+                "op_level": state.get("op_level"),
+                "last_seen": last_seen
+            }
+
+    def _prefix_keys(self, query: str) -> List[str]:
+        query = query.lower()
+        if not query:
+            return list(self._names)
+        keys = []
+        start = bisect.bisect_left(self._names, query)
+        for key in self._names[start:]:
+            if not key.startswith(query):
+                break
+            keys.append(key)
+        if uuid_prefix_pattern.match(query):
+            uuid_query = _normalize_uuid(query)
+            found = set(keys)
+            start = bisect.bisect_left(self._uuids, (uuid_query, ""))
+            for uuid, key in self._uuids[start:]:
+                if not uuid.startswith(uuid_query):
+                    break
+                if key not in found:
+                    keys.append(key)
+        return keys
+
+    def search(self, query: str = "", role: Optional[str] = None, online: Optional[bool] = None,
+               limit: int = 50, offset: int = 0) -> Tuple[int, List[dict]]:
+        """
+        Players whose name or UUID starts with the query, sorted by name
+        :param role: Only players that are op or banned on a server
+        :param online: Only players that are online or offline. With a role, on the same server.
+        :return: The number of matching players and the requested page
+        """
+        matches = []
+        for key in self._prefix_keys(query):
+            entry = self.players[key]
+            if role is None and online is None:
+                matches.append(entry)
+                continue
+            for server in entry.servers.values():
+                if (role is None or server[role]) and (online is None or server["online"] == online):
+                    matches.append(entry)
+                    break
+        return len(matches), [entry.to_dict() for entry in matches[offset:offset + limit]]
@@ -0,0 +1,593 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.jobs import Job, JobQueue, _lower_thread_priority
+from mc_server_manager_api.lifecycle import LifecycleEngine
+
+region_file_pattern = re.compile(r"^r\.(-?\d+)\.(-?\d+)\.mca$")
+# dimension -> directory in the world
+dimensions = {
+    "overworld": "",
+    "the_nether": "DIM-1",
+    "the_end": "DIM1"
+}
+# chunk data is in region/, since 1.17 entities are stored separately in entities/
+region_kinds = ("region", "entities")
+hotspot_metrics = ("entities", "tile_entities", "size", "inhabited_time")
+
+_INT = struct.Struct(">i")
+_SHORT = struct.Struct(">H")
+_FIXED_SIZES = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+_ARRAY_ITEM_SIZES = {7: 1, 11: 4, 12: 8}
+
+
+def _skip_payload(data: bytes, pos: int, tag_type: int) -> int:
+    if tag_type in _FIXED_SIZES:
+        return pos + _FIXED_SIZES[tag_type]
+    if tag_type in _ARRAY_ITEM_SIZES:
+        return pos + 4 + _INT.unpack_from(data, pos)[0] * _ARRAY_ITEM_SIZES[tag_type]
+    if tag_type == 8:
+        return pos + 2 + _SHORT.unpack_from(data, pos)[0]
+    if tag_type == 9:
+        item_type = data[pos]
+        length = _INT.unpack_from(data, pos + 1)[0]
+        pos += 5
+        if item_type in _FIXED_SIZES:
+            return pos + length * _FIXED_SIZES[item_type]
+        for _ in range(length):
+            pos = _skip_payload(data, pos, item_type)
+        return pos
+    if tag_type == 10:
+        while True:
+            item_type = data[pos]
+            pos += 1
+            if item_type == 0:
+                return pos
+            pos += 2 + _SHORT.unpack_from(data, pos)[0]
+            pos = _skip_payload(data, pos, item_type)
+    raise ValueError(f"Unknown NBT tag type {tag_type}")
+
+
+def summarize_chunk(data: bytes) -> Tuple[int, int, int]:
+    """
+    Read the summary of an uncompressed chunk without decoding the block data.
+    Supports the chunk format before 1.18 (everything in a Level compound) and after, and entity chunks.
+    :return: Inhabited time in ticks, number of entities, number of tile entities
+    """
+    if data[0] != 10:
+        raise ValueError("Root tag is not a compound")
+    pos = 3 + _SHORT.unpack_from(data, 1)[0]
+    inhabited_time = entities = tile_entities = 0
+    while True:
+        tag_type = data[pos]
+        pos += 1
+        if tag_type == 0:
+            # end of the root, or of the Level compound, the rest of the root is not needed then
+            break
+        name_length = _SHORT.unpack_from(data, pos)[0]
+        name = data[pos + 2:pos + 2 + name_length]
+        pos += 2 + name_length
+        if tag_type == 10 and name == b"Level":
+            # descend into Level, it contains the fields of old chunks
+            continue
+        if name == b"InhabitedTime" and tag_type == 4:
+            inhabited_time = struct.unpack_from(">q", data, pos)[0]
+        elif tag_type == 9 and name == b"Entities":
+            entities = _INT.unpack_from(data, pos + 1)[0]
+        elif tag_type == 9 and name in (b"block_entities", b"TileEntities"):
+            tile_entities = _INT.unpack_from(data, pos + 1)[0]
+        pos = _skip_payload(data, pos, tag_type)
+    return inhabited_time, entities, tile_entities
+
+
+def _decompress_chunk(region_path: Path, x: int, z: int, compression: int, payload: bytes) -> Optional[bytes]:
+    if compression & 128:
+        # the chunk is too large for the region file and stored in its own file
+        try:
+            with open(region_path.parent / f"c.{x}.{z}.mcc", "rb") as f:
+                payload = f.read()
+        except OSError:
+            return None
+        compression &= 127
+    if compression == 1:
+        return gzip.decompress(payload)
+    if compression == 2:
+        return zlib.decompress(payload)
+    if compression == 3:
+        return payload
+    # LZ4 or a custom compression, not supported
+    return None
+
+
+def _read_chunks(region_path: Path, data: bytes):
+    """
+    :return: Per chunk: index in the region, x, z, offset, sectors, timestamp and the summary,
+             which is None if the chunk could not be read
+    """
+    match = region_file_pattern.match(region_path.name)
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    if len(data) < 8192:
+        return
+    for i in range(1024):
+        location = _INT.unpack_from(data, i * 4)[0]
+        offset, sectors = (location >> 8) * 4096, location & 0xFF
+        if offset == 0 or sectors == 0:
+            continue
+        x, z = region_x * 32 + i % 32, region_z * 32 + i // 32
+        timestamp = _INT.unpack_from(data, 4096 + i * 4)[0]
+        summary = None
+        try:
+            length = _INT.unpack_from(data, offset)[0]
+            chunk = _decompress_chunk(region_path, x, z, data[offset + 4], data[offset + 5:offset + 4 + length])
+            if chunk is not None:
+                summary = summarize_chunk(chunk)
+        except (struct.error, IndexError, ValueError, EOFError, OSError, zlib.error):
+            pass
+        yield i, x, z, offset, sectors, timestamp, summary
+
+
+def scan_region_file(path: str) -> List[Tuple[int, int, int, int, int, int, int]]:
+    """
+    Read the chunks of a region file. Runs in a worker process.
+    :return: Per chunk: x, z, sectors, timestamp, inhabited time, entities, tile entities
+    """
+    region_path = Path(path)
+    with open(region_path, "rb") as f:
+        data = f.read()
+    # a corrupted chunk is counted without details
+    return [(x, z, sectors, timestamp, *(summary or (0, 0, 0)))
+            for _, x, z, _, sectors, timestamp, summary in _read_chunks(region_path, data)]
+
+
+def _rewrite_region_file(region_path: Path, remove: Set[int], dry_run: bool) -> Tuple[int, int, int]:
+    """
+    Remove chunks from a region file and store the remaining chunks without gaps. The new file replaces the old
+    one atomically. A region file without chunks is deleted.
+    :param remove: Indices of the chunks to remove
+    :return: Size before, size after and the number of removed chunks
+    """
+    with open(region_path, "rb") as f:
+        data = f.read()
+    if len(data) < 8192:
+        return len(data), len(data), 0
+    match = region_file_pattern.match(region_path.name)
+    region_x, region_z = int(match.group(1)), int(match.group(2))
+    header = bytearray(8192)
+    body = []
+    sector = 2
+    removed = 0
+    for i in range(1024):
+        location = _INT.unpack_from(data, i * 4)[0]
+        offset, sectors = (location >> 8) * 4096, location & 0xFF
+        if offset == 0 or sectors == 0:
+            continue
+        if i in remove:
+            removed += 1
+            if not dry_run:
+                (region_path.parent / f"c.{region_x * 32 + i % 32}.{region_z * 32 + i // 32}.mcc").unlink(
+                    missing_ok=True)
+            continue
+        payload = data[offset:offset + sectors * 4096]
+        if len(payload) >= 4:
+            # drop the unused sectors of the chunk
+            length = _INT.unpack_from(payload, 0)[0]
+            if 0 < length <= len(payload) - 4:
+                payload = payload[:4 + length]
+        payload += b"\0" * (-len(payload) % 4096)
+        struct.pack_into(">i", header, i * 4, (sector << 8) | (len(payload) // 4096))
+        header[4096 + i * 4:4096 + i * 4 + 4] = data[4096 + i * 4:4096 + i * 4 + 4]
+        body.append(payload)
+        sector += len(payload) // 4096
+
+    size = 8192 + sum(len(payload) for payload in body) if body else 0
+    if dry_run or (removed == 0 and size >= len(data)):
+        return len(data), min(size, len(data)), removed
+    if not body:
+        region_path.unlink()
+        return len(data), 0, removed
+    temp_path = region_path.with_name(f".{region_path.name}.prune")
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        for payload in body:
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, region_path)
+    return len(data), size, removed
+
+
+def prune_region(region_dir: str, name: str, radius: Optional[int], center: Tuple[int, int],
+                 max_inhabited_time: int, dry_run: bool) -> dict:
+    """
+    Prune and compact one region of a dimension: the region file and the entities and poi files of the same
+    region. A chunk is removed, if it is outside the square radius around center and players spent at most
+    max_inhabited_time ticks in it. Chunks that can't be read are never removed. Runs in a worker process.
+    :param region_dir: The region directory of the dimension
+    :param radius: Radius in chunks, None only compacts the files
+    """
+    region_path = Path(region_dir) / name
+    remove = set()
+    if radius is not None:
+        with open(region_path, "rb") as f:
+            data = f.read()
+        for i, x, z, _, _, _, summary in _read_chunks(region_path, data):
+            outside = max(abs(x - center[0]), abs(z - center[1])) > radius
+            if outside and summary is not None and summary[0] <= max_inhabited_time:
+                remove.add(i)
+
+    result = {"bytes_before": 0, "bytes_after": 0, "chunks_removed": 0, "files_deleted": 0}
+    for kind in ("region", "entities", "poi"):
+        path = region_path.parent.parent / kind / name
+        if not path.is_file():
+            continue
+        before, after, removed = _rewrite_region_file(path, remove, dry_run)
+        result["bytes_before"] += before
+        result["bytes_after"] += after
+        if kind == "region":
+            result["chunks_removed"] = removed
+        if after == 0 and before > 0:
+            result["files_deleted"] += 1
+    return result
+
+
+def list_region_files(world_path: Path) -> Dict[Tuple[str, str, str], Tuple[int, int]]:
+    """
+    :return: (dimension, kind, file name) -> (modification time in ns, size)
+    """
+    files = {}
+    for dimension, directory in dimensions.items():
+        for kind in region_kinds:
+            path = world_path / directory / kind
+            if not path.is_dir():
+                continue
+            for entry in os.scandir(path):
+                if region_file_pattern.match(entry.name) and entry.is_file():
+                    stat = entry.stat()
+                    files[(dimension, kind, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def region_file_path(world_path: Path, dimension: str, kind: str, name: str) -> Path:
+    return world_path / dimensions[dimension] / kind / name
+
+
+class RegionIndex:
+    """
+    Chunk statistics of worlds in an SQLite database. Region files are parsed in a process pool, a file is only
+    parsed again if its modification time or size changed. Only the region headers and the top-level fields of
+    the chunks are read, the block data is skipped.
+    """
+
+    def __init__(self, path: Path, workers: Optional[int] = None, niceness: int = 10):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.path = path
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.niceness = niceness
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # running tasks of the process pool, they are cancelled on close
+        self._futures: Set[asyncio.Future] = set()
+        self._lock = threading.Lock()
+        # opened on first use, so creating the index doesn't touch the disk
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        with self._connect_lock:
+            if self._connection is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(str(self.path), check_same_thread=False)
+                with connection:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript("""
+                    CREATE TABLE IF NOT EXISTS region_files (
+                        id INTEGER PRIMARY KEY,
+                        sid TEXT NOT NULL,
+                        world TEXT NOT NULL,
+                        dimension TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        chunks INTEGER NOT NULL,
+                        UNIQUE (sid, world, dimension, kind, name)
+                    );
+                    CREATE TABLE IF NOT EXISTS chunks (
+                        file_id INTEGER NOT NULL,
+                        x INTEGER NOT NULL,
+                        z INTEGER NOT NULL,
+                        sectors INTEGER NOT NULL,
+                        timestamp INTEGER NOT NULL,
+                        inhabited_time INTEGER NOT NULL,
+                        entities INTEGER NOT NULL,
+                        tile_entities INTEGER NOT NULL,
+                        PRIMARY KEY (file_id, x, z)
+                    ) WITHOUT ROWID;
+                    CREATE TABLE IF NOT EXISTS scans (
+                        sid TEXT NOT NULL,
+                        world TEXT NOT NULL,
+                        scanned_at REAL NOT NULL,
+                        duration REAL NOT NULL,
+                        PRIMARY KEY (sid, world)
+                    );
+                """)
+                self._connection = connection
+            return self._connection
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_lower_thread_priority,
+                                                 initargs=(self.niceness,))
+        return self._executor
+
+    async def run_in_pool(self, func: Callable, *args):
+        """
+        Run a parsing task in the process pool
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return await future
+
+    @staticmethod
+    async def query(func: Callable, *args):
+        """
+        Run a query or another short operation on the index in the default executor, so it doesn't wait behind
+        the long-running jobs of the job queue
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def close(self):
+        if self._executor is not None:
+            # cancels the tasks that didn't start yet, like shutdown(cancel_futures=True) of Python 3.9
+            for future in list(self._futures):
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        with self._lock, self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def get_indexed_files(self, sid: str, world: str) -> Dict[Tuple[str, str, str], Tuple[int, int, int]]:
+        """
+        :return: (dimension, kind, file name) -> (id, modification time in ns, size)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, dimension, kind, name, mtime_ns, size FROM region_files WHERE sid = ? AND world = ?",
+                (sid, world)
+            ).fetchall()
+        return {(dimension, kind, name): (file_id, mtime_ns, size) for file_id, dimension, kind, name, mtime_ns, size
+                in rows}
+
+    def update(self, sid: str, world: str, scanned: Dict[Tuple[str, str, str], Tuple[int, int, list]],
+               removed: List[int], duration: float):
+        """
+        Replace the chunks of the scanned files and delete removed files in one transaction
+        :param scanned: (dimension, kind, file name) -> (modification time in ns, size, chunks)
+        :param removed: Ids of files that don't exist anymore
+        """
+        with self._lock, self._db:
+            for file_id in removed:
+                self._db.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+                self._db.execute("DELETE FROM region_files WHERE id = ?", (file_id,))
+            for (dimension, kind, name), (mtime_ns, size, chunks) in scanned.items():
+                self._db.execute(
+                    "INSERT INTO region_files (sid, world, dimension, kind, name, mtime_ns, size, chunks) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (sid, world, dimension, kind, name) "
+                    "DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, chunks = excluded.chunks",
+                    (sid, world, dimension, kind, name, mtime_ns, size, len(chunks))
+                )
+                file_id = self._db.execute(
+                    "SELECT id FROM region_files WHERE sid = ? AND world = ? AND dimension = ? AND kind = ? "
+                    "AND name = ?", (sid, world, dimension, kind, name)
+                ).fetchone()[0]
+                self._db.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+                self._db.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(file_id, *chunk) for chunk in chunks]
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO scans (sid, world, scanned_at, duration) VALUES (?, ?, ?, ?)",
+                (sid, world, time.time(), duration)
+            )
+
+    def forget(self, sid: str, world: Optional[str] = None):
+        """
+        Remove the statistics of a server or one of its worlds
+        """
+        condition, args = ("sid = ?", (sid,)) if world is None else ("sid = ? AND world = ?", (sid, world))
+        with self._lock, self._db:
+            self._db.execute(f"DELETE FROM chunks WHERE file_id IN (SELECT id FROM region_files WHERE {condition})",
+                             args)
+            self._db.execute(f"DELETE FROM region_files WHERE {condition}", args)
+            self._db.execute(f"DELETE FROM scans WHERE {condition}", args)
+
+    def get_scan(self, sid: str, world: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT scanned_at, duration FROM scans WHERE sid = ? AND world = ?",
+                                   (sid, world)).fetchone()
+        return {"scanned_at": row[0], "duration": row[1]} if row is not None else None
+
+    def get_stats(self, sid: str, world: str, radius: Optional[int] = None) -> Optional[dict]:
+        """
+        Statistics per dimension
+        :param radius: Also compute the share of generated chunks within this many chunks around 0, 0
+        """
+        scan = self.get_scan(sid, world)
+        if scan is None:
+            return None
+        with self._lock:
+            files = self._db.execute(
+                "SELECT dimension, kind, COUNT(*), SUM(size), SUM(chunks) FROM region_files "
+                "WHERE sid = ? AND world = ? GROUP BY dimension, kind", (sid, world)
+            ).fetchall()
+            chunks = self._db.execute(
+                "SELECT f.dimension, f.kind, SUM(c.sectors), SUM(c.entities), SUM(c.tile_entities), "
+                "SUM(c.inhabited_time), MAX(c.timestamp), MIN(c.x), MAX(c.x), MIN(c.z), MAX(c.z), "
+                "SUM(c.x BETWEEN -:r AND :r AND c.z BETWEEN -:r AND :r) "
+                "FROM chunks c JOIN region_files f ON c.file_id = f.id "
+                "WHERE f.sid = :sid AND f.world = :world GROUP BY f.dimension, f.kind",
+                {"sid": sid, "world": world, "r": radius if radius is not None else -1}
+            ).fetchall()
+
+        result = {}
+
+        def dimension_stats(dimension: str) -> dict:
+            return result.setdefault(dimension, {
+                "region_files": 0, "entity_files": 0, "chunks": 0, "size": 0, "used_size": 0, "entities": 0,
+                "tile_entities": 0, "inhabited_time": 0, "last_saved": None, "bounds": None, "coverage": None
+            })
+
+        for dimension, kind, count, size, chunk_count in files:
+            stats = dimension_stats(dimension)
+            stats["size"] += size
+            if kind == "region":
+                stats["region_files"] = count
+                stats["chunks"] = chunk_count
+            else:
+                stats["entity_files"] = count
+        for dimension, kind, sectors, entities, tile_entities, inhabited_time, last_saved, min_x, max_x, min_z, \
+                max_z, in_radius in chunks:
+            stats = dimension_stats(dimension)
+            stats["used_size"] += sectors * 4096
+            stats["entities"] += entities
+            stats["tile_entities"] += tile_entities
+            if kind != "region":
+                continue
+            stats["inhabited_time"] = inhabited_time
+            stats["last_saved"] = last_saved
+            stats["bounds"] = {"min_x": min_x, "max_x": max_x, "min_z": min_z, "max_z": max_z}
+            if radius is not None:
+                stats["coverage"] = in_radius / (2 * radius + 1) ** 2
+        return {**scan, "radius": radius, "dimensions": result}
+
+    def get_hotspots(self, sid: str, world: str, metric: str = "entities", dimension: Optional[str] = None,
+                     limit: int = 20) -> List[dict]:
+        """
+        The chunks with the highest value of a metric
+        :param metric: entities, tile_entities, size or inhabited_time
+        """
+        if metric not in hotspot_metrics:
+            raise ValueError(f"Unknown metric {metric}")
+        condition = "f.sid = ? AND f.world = ?"
+        args = [sid, world]
+        if dimension is not None:
+            condition += " AND f.dimension = ?"
+            args.append(dimension)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT f.dimension, c.x, c.z, SUM(c.entities) AS entities, SUM(c.tile_entities) AS tile_entities, "
+                "SUM(CASE WHEN f.kind = 'region' THEN c.sectors * 4096 ELSE 0 END) AS size, "
+                "MAX(c.inhabited_time) AS inhabited_time "
+                f"FROM chunks c JOIN region_files f ON c.file_id = f.id WHERE {condition} "
+                f"GROUP BY f.dimension, c.x, c.z ORDER BY {metric} DESC LIMIT ?", (*args, limit)
+            ).fetchall()
+        return [
+            {"dimension": dimension, "x": x, "z": z, "entities": entities, "tile_entities": tile_entities,
+             "size": size, "inhabited_time": inhabited_time}
+            for dimension, x, z, entities, tile_entities, size, inhabited_time in rows
+        ]
+
+
+async def scan_world_job(job: Job, manager: ServerManager, job_queue: JobQueue, region_index: RegionIndex, sid: str,
+                         world_name: str) -> dict:
+    """
+    Update the region index of a world. Only changed region files are parsed, in the process pool of the index.
+    The progress is the number of parsed bytes.
+    """
+    server = manager.get_server(sid)
+    if server is None:
+        raise Exception("Server not found")
+    world_path = Path(server.server_config.path) / "worlds" / world_name
+    if not world_path.is_dir():
+        raise Exception("World not found")
+    started = time.monotonic()
+
+    files = await job_queue.run_blocking(list_region_files, world_path)
+    indexed = await job_queue.run_blocking(region_index.get_indexed_files, sid, world_name)
+    changed = [key for key, stat in files.items() if key not in indexed or indexed[key][1:] != stat]
+    removed = [file_id for key, (file_id, _, _) in indexed.items() if key not in files]
+
+    total = sum(files[key][1] for key in changed)
+    processed = 0
+
+    async def scan(key: Tuple[str, str, str]):
+        nonlocal processed
+        chunks = await region_index.run_in_pool(scan_region_file, str(region_file_path(world_path, *key)))
+        processed += files[key][1]
+        job.report(processed, total)
+        return chunks
+
+    results = await asyncio.gather(*(scan(key) for key in changed))
+    scanned = {key: (*files[key], chunks) for key, chunks in zip(changed, results)}
+    await job_queue.run_blocking(region_index.update, sid, world_name, scanned, removed,
+                                 time.monotonic() - started)
+    return {"files": len(files), "scanned": len(changed), "removed": len(removed)}
+
+
+async def prune_world_job(job: Job, manager: ServerManager, job_queue: JobQueue, region_index: RegionIndex,
+                          lifecycle: LifecycleEngine, sid: str, world_name: str, radius: Optional[int] = None,
+                          center: Tuple[int, int] = (0, 0), max_inhabited_time: int = 0, dry_run: bool = True) -> dict:
+    """
+    Prune and compact all region files of a world in the process pool of the region index. The world must not be
+    loaded, so the server has to be stopped if it is the active world, and it can't be started until the job is
+    done. With dry_run, nothing is changed and the result contains the bytes that would be saved.
+    The progress is the number of processed bytes.
+    """
+    server = manager.get_server(sid)
+    if server is None:
+        raise Exception("Server not found")
+    world = server.get_world(world_name)
+    if world is None:
+        raise Exception("World not found")
+    if dry_run or server.active_world is None or server.active_world.name != world.name:
+        return await _prune_world(job, job_queue, region_index, world.path, radius, center, max_inhabited_time,
+                                  dry_run)
+    with lifecycle.guard_start(sid, f"World {world.name} is being pruned"):
+        # checked after the guard is held, so the server can't be started in between
+        if server.is_running:
+            raise Exception("The server has to be stopped to prune its active world")
+        return await _prune_world(job, job_queue, region_index, world.path, radius, center, max_inhabited_time,
+                                  dry_run)
+
+
+async def _prune_world(job: Job, job_queue: JobQueue, region_index: RegionIndex, world_path: Path,
+                       radius: Optional[int], center: Tuple[int, int], max_inhabited_time: int, dry_run: bool) -> dict:
+    files = await job_queue.run_blocking(list_region_files, world_path)
+    regions = [(dimension, name) for dimension, kind, name in files if kind == "region"]
+    total = sum(files[(dimension, "region", name)][1] for dimension, name in regions)
+    processed = 0
+
+    async def prune(dimension: str, name: str):
+        nonlocal processed
+        region_dir = str(region_file_path(world_path, dimension, "region", name).parent)
+        result = await region_index.run_in_pool(prune_region, region_dir, name, radius, center, max_inhabited_time,
+                                                dry_run)
+        processed += files[(dimension, "region", name)][1]
+        job.report(processed, total)
+        return result
+
+    results = await asyncio.gather(*(prune(dimension, name) for dimension, name in regions))
+    summary = {"dry_run": dry_run, "region_files": len(regions), "chunks_removed": 0, "files_deleted": 0,
+               "bytes_before": 0, "bytes_after": 0}
+    for result in results:
+        for key, value in result.items():
+            summary[key] += value
+    summary["bytes_saved"] = summary["bytes_before"] - summary["bytes_after"]
+    return summary
@@ -0,0 +1,488 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import struct
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import psutil
+from mc_server_interaction.interaction import MinecraftServer
+from mc_server_interaction.interaction.models import ServerStatus
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.backups import IncrementalBackupStore, create_backup_job
+from mc_server_manager_api.jobs import JobQueue, JobState
+from mc_server_manager_api.journal import write_atomic
+from mc_server_manager_api.lifecycle import LifecycleEngine
+from mc_server_manager_api.players import PlayerPoller
+
+MiB = 1024 * 1024
+
+
+class InsufficientMemoryException(Exception):
+    def __init__(self, required: int, headroom: int):
+        super().__init__(f"Not enough free memory, {required // MiB} MiB required, "
+                         f"{max(headroom, 0) // MiB} MiB free")
+        self.required = required
+        self.headroom = headroom
+
+
+@dataclass
+class ServerPolicy:
+    # stop the server after idle_timeout seconds without online players
+    hibernate: bool = False
+    idle_timeout: float = 15 * 60
+    # back up the active world before the server is stopped
+    backup: bool = True
+    incremental_backup: bool = True
+    # listen on the server port while the server is stopped and start it when a client connects
+    wake_on_connect: bool = False
+    # memory the JVM uses on top of the heap, in MiB
+    memory_overhead: int = 512
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+def _pack_varint(value: int) -> bytes:
+    data = bytearray()
+    value &= 0xFFFFFFFF
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def _parse_varint(data: bytes, pos: int = 0) -> Tuple[int, int]:
+    value = 0
+    for i in range(5):
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            if value & 0x80000000:
+                value -= 1 << 32
+            return value, pos
+    raise ValueError("Varint is too long")
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    data = b""
+    while True:
+        data += await reader.readexactly(1)
+        if not data[-1] & 0x80:
+            return _parse_varint(data)[0]
+        if len(data) >= 5:
+            raise ValueError("Varint is too long")
+
+
+async def _read_packet(reader: asyncio.StreamReader, max_length: int = 1024) -> Tuple[int, bytes]:
+    length = await _read_varint(reader)
+    if not 0 < length <= max_length:
+        raise ValueError("Invalid packet length")
+    data = await reader.readexactly(length)
+    packet_id, pos = _parse_varint(data)
+    return packet_id, data[pos:]
+
+
+def _packet(packet_id: int, payload: bytes) -> bytes:
+    data = _pack_varint(packet_id) + payload
+    return _pack_varint(len(data)) + data
+
+
+def _pack_string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return _pack_varint(len(data)) + data
+
+
+class WakeListener:
+    """
+    A stub of a stopped server on its port. It answers server list pings and login attempts with a message
+    and calls on_wake, so the real server is started when a player wants to join.
+    """
+
+    def __init__(self, sid: str, host: Optional[str], port: int, version: str, on_wake: Callable[[str], str],
+                 timeout: float = 5):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.sid = sid
+        self.host = host or None
+        self.port = port
+        self.version = version
+        self.on_wake = on_wake
+        self.timeout = timeout
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, reuse_address=True)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            await asyncio.wait_for(self._handle_connection(reader, writer), self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        first = await reader.readexactly(1)
+        if first == b"\xfe":
+            # legacy server list ping of clients before 1.7, no reply
+            self.on_wake(self.sid)
+            return
+        # the first byte is part of the length of the handshake
+        length = first[0]
+        if length & 0x80:
+            rest = b""
+            while True:
+                rest += await reader.readexactly(1)
+                if not rest[-1] & 0x80 or len(rest) >= 4:
+                    break
+            length = _parse_varint(first + rest)[0]
+        data = await reader.readexactly(length)
+        packet_id, pos = _parse_varint(data)
+        if packet_id != 0:
+            return
+        protocol, pos = _parse_varint(data, pos)
+        address_length, pos = _parse_varint(data, pos)
+        pos += address_length + 2
+        next_state, _ = _parse_varint(data, pos)
+        message = self.on_wake(self.sid)
+
+        if next_state == 1:
+            # status request, then ping
+            await _read_packet(reader)
+            status = {
+                "version": {"name": self.version, "protocol": protocol},
+                "players": {"max": 0, "online": 0},
+                "description": {"text": message}
+            }
+            writer.write(_packet(0, _pack_string(json.dumps(status))))
+            await writer.drain()
+            packet_id, payload = await _read_packet(reader)
+            if packet_id == 1:
+                writer.write(_packet(1, payload))
+                await writer.drain()
+        elif next_state == 2:
+            # login: disconnect with the message
+            writer.write(_packet(0, _pack_string(json.dumps({"text": message}))))
+            await writer.drain()
+
+
+class ServerScheduler:
+    """
+    Stops servers that had no online players for the idle timeout of their policy, after a backup of the
+    active world, and starts them again when a client connects to their port. Starts are only admitted if the
+    host has enough free memory for the heap of the server; the memory that running servers will still
+    allocate up to their heap size counts as used. Starts that don't fit may be queued until memory is freed.
+    """
+
+    def __init__(self, manager: ServerManager, lifecycle: LifecycleEngine, job_queue: JobQueue, path: Path,
+                 incremental_store: IncrementalBackupStore, player_poller: PlayerPoller, reserved_memory: int = 1024,
+                 interval: float = 5):
+        """
+        :param path: File the policies are stored in
+        :param reserved_memory: Memory in MiB that is kept free for the system and the API
+        :param interval: Seconds between two checks of idle servers and queued starts
+        """
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.lifecycle = lifecycle
+        self.job_queue = job_queue
+        self.path = path
+        self.incremental_store = incremental_store
+        self.reserved_memory = reserved_memory * MiB
+        self.interval = interval
+        self.policies: Dict[str, ServerPolicy] = {}
+        self.hibernated: Set[str] = set()
+        # sid -> time the start was queued, oldest first
+        self.queued_starts: Dict[str, float] = OrderedDict()
+        self._online: Dict[str, int] = {}
+        self._idle_since: Dict[str, float] = {}
+        self._hibernating: Set[str] = set()
+        self._listeners: Dict[str, WakeListener] = {}
+        self._watched: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+        # the policies are read by start()
+        self._loaded = False
+        lifecycle.before_start = self.before_start
+        player_poller.listeners.append(self._on_players)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for sid, policy in data.get("policies", {}).items():
+            try:
+                self.policies[sid] = ServerPolicy(**policy)
+            except TypeError:
+                self.logger.warning(f"Ignoring invalid policy of server {sid}")
+
+    def _save(self, data: bytes):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(self.path, data)
+
+    async def _save_policies(self):
+        data = json.dumps({"policies": {sid: policy.to_dict() for sid, policy in self.policies.items()}}, indent=4)
+        await asyncio.get_running_loop().run_in_executor(None, self._save, data.encode("utf-8"))
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        for sid in list(self._watched):
+            if sid not in servers:
+                asyncio.create_task(self.forget(sid))
+        for sid, server in servers.items():
+            if sid in self._watched:
+                continue
+            self._watched.add(sid)
+
+    async def forget(self, sid: str):
+        self._watched.discard(sid)
+        self.hibernated.discard(sid)
+        self.queued_starts.pop(sid, None)
+        self._online.pop(sid, None)
+        self._idle_since.pop(sid, None)
+        await self._close_listener(sid)
+        if self.policies.pop(sid, None) is not None:
+            await self._save_policies()
+
+    async def _on_players(self, sid: str, players: dict):
+        if sid in self._watched:
+            self._online[sid] = len(players.get("online_players") or [])
+
+    def start(self):
+        if not self._loaded:
+            self._load()
+            self._loaded = True
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for sid in list(self._listeners):
+            await self._close_listener(sid)
+
+    def get_policy(self, sid: str) -> ServerPolicy:
+        return self.policies.get(sid) or ServerPolicy()
+
+    async def set_policy(self, sid: str, policy: ServerPolicy):
+        server = self.manager.get_server(sid)
+        if policy.hibernate and server is not None and not server.properties.get("enable-query"):
+            # online players are only known with the query protocol
+            server.properties.set("enable-query", True)
+            server.save_properties()
+        self.policies[sid] = policy
+        self._idle_since.pop(sid, None)
+        await self._save_policies()
+        await self._update_listener(sid)
+
+    @staticmethod
+    def required_memory(server: MinecraftServer, policy: ServerPolicy) -> int:
+        return (server.server_config.ram + policy.memory_overhead) * MiB
+
+    def memory_headroom(self) -> int:
+        """
+        Memory in bytes that is available for another server
+        """
+        committed = 0
+        for sid, server in self.manager.get_servers().items():
+            if not server.is_running:
+                continue
+            try:
+                used = server.system_load["memory"]["server"]
+            except (KeyError, TypeError, psutil.Error):
+                used = 0
+            committed += max(self.required_memory(server, self.get_policy(sid)) - used, 0)
+        return psutil.virtual_memory().available - self.reserved_memory - committed
+
+    async def before_start(self, server: MinecraftServer):
+        """
+        Called by the lifecycle engine before a server is started
+        :raises InsufficientMemoryException: If the server doesn't fit into the free memory
+        """
+        sid = self._get_sid(server)
+        required = self.required_memory(server, self.get_policy(sid))
+        headroom = self.memory_headroom()
+        if required > headroom:
+            raise InsufficientMemoryException(required, headroom)
+        self.hibernated.discard(sid)
+        self.queued_starts.pop(sid, None)
+        self._idle_since.pop(sid, None)
+        # the port has to be free for the server
+        await self._close_listener(sid)
+
+    def _get_sid(self, server: MinecraftServer) -> Optional[str]:
+        for sid, candidate in self.manager.get_servers().items():
+            if candidate is server:
+                return sid
+        return None
+
+    async def request_start(self, sid: str, queue: bool = False) -> str:
+        """
+        Start a server if there is enough memory, otherwise queue the start if queue is set
+        :return: The result of the lifecycle engine or queued
+        """
+        server = self.manager.get_server(sid)
+        if server is None:
+            raise Exception("Server not found")
+        try:
+            return await self.lifecycle.start(server)
+        except InsufficientMemoryException:
+            if not queue:
+                raise
+            self.queued_starts.setdefault(sid, time.time())
+            return "queued"
+
+    def _wake(self, sid: str) -> str:
+        server = self.manager.get_server(sid)
+        if server is None:
+            return "Server not found"
+        if sid in self.queued_starts:
+            return "Server is waiting for free memory, please reconnect later"
+        self.logger.info(f"Client connected to stopped server {sid}, starting it")
+        self.queued_starts[sid] = time.time()
+        if self._task is not None:
+            asyncio.create_task(self._start_queued())
+        return "Server is starting, please reconnect in a minute"
+
+    async def _start_queued(self):
+        async with self._start_lock:
+            # in order, a large server is not starved by smaller ones
+            for sid in list(self.queued_starts):
+                server = self.manager.get_server(sid)
+                if server is None or server.is_running:
+                    self.queued_starts.pop(sid, None)
+                    continue
+                try:
+                    await self.lifecycle.start(server)
+                except InsufficientMemoryException:
+                    return
+                except Exception as e:
+                    self.logger.error(f"Failed to start queued server {sid}: {str(e) or e.__class__.__name__}")
+                self.queued_starts.pop(sid, None)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._start_queued()
+                await self._check_idle()
+                for sid in self.manager.get_servers():
+                    await self._update_listener(sid)
+            except Exception as e:
+                self.logger.exception(f"Scheduler check failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _check_idle(self):
+        now = time.time()
+        for sid, server in self.manager.get_servers().items():
+            policy = self.policies.get(sid)
+            if policy is None or not policy.hibernate or not server.is_online or sid in self._hibernating:
+                self._idle_since.pop(sid, None)
+                continue
+            if not server.properties.get("enable-query"):
+                continue
+            if self._online.get(sid, 0) > 0:
+                self._idle_since[sid] = now
+                continue
+            idle_since = self._idle_since.setdefault(sid, now)
+            if now - idle_since >= policy.idle_timeout:
+                self._idle_since.pop(sid, None)
+                asyncio.create_task(self._hibernate(sid, server, policy))
+
+    async def _hibernate(self, sid: str, server: MinecraftServer, policy: ServerPolicy):
+        self._hibernating.add(sid)
+        try:
+            self.logger.info(f"Server {sid} is idle, stopping it")
+            world = server.active_world
+            if policy.backup and world is not None:
+                # the backup job stops the server before it archives the active world
+                incremental = policy.incremental_backup
+                job = self.job_queue.submit(
+                    "backup", (sid, world.name, incremental),
+                    partial(create_backup_job, manager=self.manager, job_queue=self.job_queue, sid=sid,
+                            world_name=world.name, incremental_store=self.incremental_store if incremental else None),
+                    f"Backup world {world.name} of idle server {sid}"
+                )
+                # the server is stopped long before the archive is written, so wait for the job itself
+                while job.state not in (JobState.DONE, JobState.FAILED):
+                    await asyncio.sleep(1)
+            if server.is_running:
+                await self.lifecycle.stop(server, self.lifecycle.stop_timeout)
+            self.hibernated.add(sid)
+        finally:
+            self._hibernating.discard(sid)
+        await self._update_listener(sid)
+
+    async def _update_listener(self, sid: str):
+        server = self.manager.get_server(sid)
+        policy = self.policies.get(sid)
+        # A server that is stopped for a hibernation backup or while a job rewrites its world is started again
+        # by that job, the port has to stay free
+        listen = server is not None and policy is not None and policy.wake_on_connect and \
+            server.server_config.installed and not server.is_running and server.status == ServerStatus.STOPPED and \
+            sid not in self._hibernating and sid not in self.lifecycle.start_guards
+        if not listen:
+            await self._close_listener(sid)
+            return
+        if sid in self._listeners:
+            return
+        port = int(server.properties.get("server-port") or 25565)
+        listener = WakeListener(sid, server.properties.get("server-ip"), port, server.server_config.version,
+                                self._wake)
+        try:
+            await listener.start()
+        except OSError as e:
+            self.logger.warning(f"Failed to listen on port {port} for server {sid}: {e}")
+            return
+        self._listeners[sid] = listener
+
+    async def _close_listener(self, sid: str):
+        listener = self._listeners.pop(sid, None)
+        if listener is not None:
+            await listener.close()
+
+    def get_state(self, sid: str) -> dict:
+        listener = self._listeners.get(sid)
+        idle_since = self._idle_since.get(sid)
+        return {
+            "policy": self.get_policy(sid).to_dict(),
+            "online_players": self._online.get(sid),
+            "idle_since": idle_since,
+            "hibernated": sid in self.hibernated,
+            "queued_since": self.queued_starts.get(sid),
+            "listening": listener is not None,
+            "wake_connections": listener.connections if listener is not None else 0
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "memory_headroom": self.memory_headroom(),
+            "reserved_memory": self.reserved_memory,
+            "queued_starts": [{"sid": sid, "queued_since": queued_since}
+                              for sid, queued_since in self.queued_starts.items()],
+            "hibernated": sorted(self.hibernated),
+            "listening": sorted(self._listeners)
+        }
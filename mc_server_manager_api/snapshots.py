@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+from functools import partial
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.players import PlayerPoller
+from mc_server_manager_api.subscriptions import serialize_players
+from mc_server_manager_api.worlds import WorldIndex
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize to JSON with orjson if it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def make_etag(*parts: bytes) -> str:
+    return '"' + hashlib.sha1(b"\0".join(parts)).hexdigest() + '"'
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSONResponse that uses orjson if it is installed
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class _Section:
+    def __init__(self, body: bytes, source: Any = None):
+        self.body = body
+        self.etag = make_etag(body)
+        # the object the section was built from, the section is valid as long as this didn't change
+        self.source = source
+
+
+class _ServerSnapshot:
+    def __init__(self):
+        self.sections: Dict[str, _Section] = {}
+        self.players_message: Optional[str] = None
+
+
+class ServerSnapshots:
+    """
+    Pre-serialized sections (players, properties, worlds, backups) of every server. Players are updated by the
+    player poller, properties are invalidated by the callback of the server, worlds by the world index and
+    backups when the backups of the server change. The server response is assembled from the cached sections,
+    so only the status is serialized per request.
+    """
+    def __init__(self, manager: ServerManager, world_index: WorldIndex, player_poller: PlayerPoller):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.world_index = world_index
+        self.player_poller = player_poller
+        player_poller.listeners.append(self._on_players)
+        self._snapshots: Dict[str, _ServerSnapshot] = {}
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        for sid in list(self._snapshots):
+            if sid not in servers:
+                self._snapshots.pop(sid)
+        for sid, server in servers.items():
+            if sid in self._snapshots:
+                continue
+            self._snapshots[sid] = _ServerSnapshot()
+            server.callbacks.properties.add_callback(partial(self._on_properties, sid))
+
+    def invalidate(self, sid: str, section: Optional[str] = None):
+        snapshot = self._snapshots.get(sid)
+        if snapshot is None:
+            return
+        if section is None:
+            snapshot.sections = {}
+        else:
+            snapshot.sections.pop(section, None)
+        if section in (None, "players"):
+            snapshot.players_message = None
+
+    async def _on_players(self, sid: str, players: dict):
+        # the polled value is already a dict of lists of dicts
+        snapshot = self._snapshots.get(sid)
+        if snapshot is not None:
+            snapshot.sections["players"] = _Section(dumps(players))
+            snapshot.players_message = None
+
+    async def _on_properties(self, sid: str, *args):
+        self.invalidate(sid, "properties")
+
+    def get_section(self, sid: str, section: str) -> Optional[_Section]:
+        server = self.manager.get_server(sid)
+        snapshot = self._snapshots.get(sid)
+        if server is None or snapshot is None:
+            return None
+        cached = snapshot.sections.get(section)
+
+        if section == "players":
+            if cached is None:
+                # not polled yet, the players are never read on the event loop
+                players = self.player_poller.get(sid) or serialize_players(
+                    {"online_players": [], "op_players": [], "banned_players": []}
+                )
+                cached = _Section(dumps(players))
+        elif section == "properties":
+            # the library changes the properties in place without calling the callback, so compare with a copy
+            properties = server.properties.to_dict()
+            if cached is None or cached.source != (server.properties, properties):
+                cached = _Section(dumps(properties), (server.properties, dict(properties)))
+        elif section == "worlds":
+            # the index returns the same list as long as the worlds didn't change
+            worlds = self.world_index.get_worlds(sid)
+            if cached is None or cached.source is not worlds:
+                cached = _Section(dumps(worlds), worlds)
+        elif section == "backups":
+            backups = self.manager.backup_manager.get_backups_for_server(sid)
+            key = tuple((bid, id(backup)) for bid, backup in backups.items())
+            if cached is None or cached.source != key:
+                cached = _Section(dumps(jsonable_encoder(backups)), key)
+        else:
+            raise ValueError(f"Unknown section {section}")
+
+        if snapshot.sections.get(section) is not cached:
+            snapshot.sections[section] = cached
+            if section == "players":
+                snapshot.players_message = None
+        return cached
+
+    def get_server(self, sid: str) -> Optional[Tuple[bytes, str]]:
+        """
+        :return: The serialized server and its ETag
+        """
+        server = self.manager.get_server(sid)
+        if server is None or sid not in self._snapshots:
+            return None
+        head = dumps({
+            "name": server.server_config.name,
+            "sid": sid,
+            "version": server.server_config.version,
+            "status": server.status.name
+        })
+        worlds = self.get_section(sid, "worlds")
+        properties = self.get_section(sid, "properties")
+        backups = self.get_section(sid, "backups")
+        body = b"".join([
+            head[:-1], b',"worlds":', worlds.body, b',"properties":', properties.body,
+            b',"backups":', backups.body, b"}"
+        ])
+        return body, make_etag(head, worlds.etag.encode(), properties.etag.encode(), backups.etag.encode())
+
+    def get_players_message(self, sid: str) -> Optional[str]:
+        """
+        The serialized players websocket message
+        """
+        section = self.get_section(sid, "players")
+        if section is None:
+            return None
+        snapshot = self._snapshots[sid]
+        if snapshot.players_message is None:
+            snapshot.players_message = '{"type":"players","value":' + section.body.decode("utf-8") + "}"
+        return snapshot.players_message
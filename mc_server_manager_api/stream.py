@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+import re
+import struct
+from enum import Enum
+from functools import partial
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.broadcast import OverflowPolicy, Subscriber
+from mc_server_manager_api.console import ConsoleLogManager
+from mc_server_manager_api.jobs import JobQueue
+from mc_server_manager_api.players import PlayerPoller
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+topic_pattern = re.compile(r"^(server:(\*|[^:*]+):(output|metrics|status|players|properties)|jobs)$")
+# these topics only describe the current state, so a queued message can be replaced by a newer one
+coalesced_kinds = ("metrics", "status", "players", "properties")
+
+
+class StreamEncoding(Enum):
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+def get_stream_encodings() -> List[str]:
+    encodings = [StreamEncoding.JSON.value]
+    if msgpack is not None:
+        encodings.append(StreamEncoding.MSGPACK.value)
+    return encodings
+
+
+def _msgpack_array_header(length: int) -> bytes:
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 2 ** 16:
+        return b"\xdc" + struct.pack(">H", length)
+    return b"\xdd" + struct.pack(">I", length)
+
+
+class StreamEvent:
+    """
+    A message of a topic. It is encoded at most once per encoding, regardless of the number of subscribers.
+    """
+
+    def __init__(self, topic: str, data: Any = None, data_json: Optional[str] = None, seq: Optional[int] = None):
+        self.topic = topic
+        self._data = data
+        self._data_json = data_json
+        self.seq = seq
+        self._json: Optional[str] = None
+        self._msgpack: Optional[bytes] = None
+
+    @property
+    def data(self):
+        if self._data is None and self._data_json is not None:
+            self._data = json.loads(self._data_json)
+        return self._data
+
+    def to_json(self) -> str:
+        if self._json is None:
+            data_json = self._data_json if self._data_json is not None else json.dumps(self._data)
+            self._json = f'{{"topic":{json.dumps(self.topic)},"data":{data_json}' + \
+                         (f',"seq":{self.seq}}}' if self.seq is not None else "}")
+        return self._json
+
+    def to_msgpack(self) -> bytes:
+        if self._msgpack is None:
+            message = {"topic": self.topic, "data": self.data}
+            if self.seq is not None:
+                message["seq"] = self.seq
+            self._msgpack = msgpack.packb(message)
+        return self._msgpack
+
+
+class StreamConnection:
+    """
+    One client of /stream. Events are queued per connection and sent in batches: after the first event,
+    the connection waits flush_interval seconds and then sends all queued events as one frame.
+    """
+
+    def __init__(self, encoding: StreamEncoding = StreamEncoding.JSON, flush_interval: float = 0.05,
+                 max_queue_size: int = 1024):
+        self.encoding = encoding
+        self.flush_interval = flush_interval
+        self.topics: Set[str] = set()
+        self.subscriber = Subscriber(max_queue_size, OverflowPolicy.COALESCE)
+
+    def put(self, event: StreamEvent):
+        kind = event.topic.rsplit(":", 1)[-1]
+        self.subscriber.put(event, key=event.topic if kind in coalesced_kinds else None)
+
+    def put_control(self, message: dict):
+        self.put(StreamEvent("control", message))
+
+    def encode(self, events: List[StreamEvent]):
+        if self.encoding == StreamEncoding.MSGPACK:
+            return _msgpack_array_header(len(events)) + b"".join(event.to_msgpack() for event in events)
+        return "[" + ",".join(event.to_json() for event in events) + "]"
+
+    async def next_batch(self) -> List[StreamEvent]:
+        first = await self.subscriber.get()
+        if self.flush_interval > 0:
+            await asyncio.sleep(self.flush_interval)
+        return [first] + self.subscriber.drain()
+
+    def to_dict(self):
+        return {"topics": sorted(self.topics), "encoding": self.encoding.value, **self.subscriber.to_dict()}
+
+
+class StreamHub:
+    """
+    Routes server events and job updates to the connections of /stream. The hub registers one set of callbacks
+    per server, independent of the number of connections. Topics are server:{sid}:{kind} with the kinds output,
+    metrics, status, players and properties, and jobs. The sid may be *, to subscribe to all servers.
+    """
+    kinds = {
+        "output": "output",
+        "system_metrics": "metrics",
+        "status": "status",
+        "players": "players",
+        "properties": "properties"
+    }
+
+    def __init__(self, manager: ServerManager, job_queue: JobQueue, console_logs: Optional[ConsoleLogManager] = None,
+                 player_poller: Optional[PlayerPoller] = None):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.job_queue = job_queue
+        self.console_logs = console_logs
+        self.connections: Set[StreamConnection] = set()
+        # topic or pattern -> connections
+        self._subscriptions: Dict[str, Set[StreamConnection]] = {}
+        self._watched_sids: Set[str] = set()
+        self._jobs_subscriber: Optional[Subscriber] = None
+        self._task: Optional[asyncio.Task] = None
+        if player_poller is not None:
+            player_poller.listeners.append(self._on_players)
+
+    def watch_servers(self):
+        """
+        Register the callbacks on every server that is not watched yet. The console logs have to be
+        registered before, output events read their sequence numbers.
+        """
+        servers = self.manager.get_servers()
+        self._watched_sids.intersection_update(servers.keys())
+        for sid, server in servers.items():
+            if sid in self._watched_sids:
+                continue
+            for callback_name, kind in self.kinds.items():
+                # the players are published by the player poller, a players callback would make the server
+                # poll them on the event loop
+                if callback_name != "players":
+                    getattr(server.callbacks, callback_name).add_callback(partial(self._on_event, sid, kind))
+            self._watched_sids.add(sid)
+
+    def start(self):
+        if self._task is None:
+            self._jobs_subscriber = self.job_queue.subscribe()
+            self._task = asyncio.create_task(self._forward_jobs())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.job_queue.unsubscribe(self._jobs_subscriber)
+
+    async def _forward_jobs(self):
+        while True:
+            message = await self._jobs_subscriber.get()
+            self.publish(StreamEvent("jobs", data_json=message))
+
+    async def _on_event(self, sid: str, kind: str, value):
+        # Deleted servers keep their callbacks; ignore them instead of raising, which would unregister silently
+        if sid not in self._watched_sids:
+            return
+        seq = None
+        if kind == "status":
+            value = value.name
+        elif kind == "output" and self.console_logs is not None:
+            console_log = self.console_logs.get_console_log(sid)
+            seq = console_log.last_seq if console_log is not None else None
+        self.publish(StreamEvent(f"server:{sid}:{kind}", value, seq=seq))
+
+    async def _on_players(self, sid: str, players: dict):
+        await self._on_event(sid, "players", players)
+
+    def publish(self, event: StreamEvent):
+        connections = self._subscriptions.get(event.topic, set())
+        if event.topic.startswith("server:"):
+            kind = event.topic.rsplit(":", 1)[1]
+            wildcard = self._subscriptions.get(f"server:*:{kind}")
+            if wildcard:
+                connections = connections | wildcard
+        for connection in connections:
+            connection.put(event)
+
+    def connect(self, connection: StreamConnection):
+        self.connections.add(connection)
+
+    def disconnect(self, connection: StreamConnection):
+        self.unsubscribe(connection, list(connection.topics))
+        self.connections.discard(connection)
+
+    def subscribe(self, connection: StreamConnection, topics: List[str]):
+        invalid = [topic for topic in topics if not isinstance(topic, str) or not topic_pattern.match(topic)]
+        if invalid:
+            connection.put_control({"type": "error", "error": "Invalid topics", "topics": invalid})
+        topics = [topic for topic in topics if topic not in invalid]
+        for topic in topics:
+            connection.topics.add(topic)
+            self._subscriptions.setdefault(topic, set()).add(connection)
+        connection.put_control({"type": "subscribed", "topics": topics})
+        for topic in topics:
+            self._send_current_state(connection, topic)
+
+    def unsubscribe(self, connection: StreamConnection, topics: List[str]):
+        for topic in topics:
+            connection.topics.discard(topic)
+            connections = self._subscriptions.get(topic)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    self._subscriptions.pop(topic)
+
+    def _send_current_state(self, connection: StreamConnection, topic: str):
+        """
+        Send the current value of state topics, so clients don't have to wait for the next change
+        """
+        if topic == "jobs":
+            return
+        _, sid, kind = topic.split(":")
+        if kind not in ("status", "metrics"):
+            return
+        servers = self.manager.get_servers() if sid == "*" else {sid: self.manager.get_server(sid)}
+        for server_sid, server in servers.items():
+            if server is None:
+                continue
+            value = server.status.name if kind == "status" else server.system_load
+            connection.put(StreamEvent(f"server:{server_sid}:{kind}", value))
+
+    async def handle_message(self, connection: StreamConnection, text: str):
+        try:
+            message = json.loads(text)
+            action = message["action"]
+            topics = message.get("topics", [])
+            if not isinstance(topics, list):
+                raise ValueError("topics must be a list")
+        except (ValueError, KeyError, TypeError) as e:
+            connection.put_control({"type": "error", "error": f"Invalid message: {e}"})
+            return
+        if action == "subscribe":
+            self.subscribe(connection, topics)
+        elif action == "unsubscribe":
+            self.unsubscribe(connection, topics)
+            connection.put_control({"type": "unsubscribed", "topics": topics})
+        else:
+            connection.put_control({"type": "error", "error": f"Unknown action {action}"})
+
+    async def serve(self, websocket: WebSocket, connection: StreamConnection):
+        """
+        Handle a connection until the client disconnects
+        """
+        async def write():
+            while True:
+                frame = connection.encode(await connection.next_batch())
+                if isinstance(frame, bytes):
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+
+        async def read():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                text = message.get("text")
+                if text is None and message.get("bytes") is not None:
+                    text = message["bytes"].decode("utf-8", errors="replace")
+                if text is not None:
+                    await self.handle_message(connection, text)
+
+        self.connect(connection)
+        tasks = [asyncio.create_task(write()), asyncio.create_task(read())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.disconnect(connection)
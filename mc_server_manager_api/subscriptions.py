@@ -0,0 +1,118 @@
+import dataclasses
+import json
+import logging
+from functools import partial
+from typing import Dict, Optional, Set
+
+from mc_server_interaction.interaction import MinecraftServer
+
+from mc_server_manager_api.broadcast import OverflowPolicy, Subscriber
+from mc_server_manager_api.console import ConsoleLog
+
+
+def serialize_players(players: dict) -> dict:
+    return {
+        "online_players": [dataclasses.asdict(player) for player in players["online_players"]],
+        "op_players": [dataclasses.asdict(player) for player in players["op_players"]],
+        "banned_players": [dataclasses.asdict(player) for player in players["banned_players"]]
+    }
+
+
+class ServerSubscription:
+    """
+    The callbacks of one websocket connection to a server. Events are serialized once and queued
+    in the subscriber, a writer task sends them to the client. Call close() to remove the callbacks.
+    There is no players callback, it would make the server poll its players on the event loop. The players
+    are put by the subscription manager, which listens to the player poller.
+    """
+    callback_names = ("system_metrics", "properties", "output", "status")
+    # These only describe the current state, so an older queued value can be replaced by a newer one
+    coalesced_callback_names = ("system_metrics", "properties", "players", "status")
+    _last_event: Optional[tuple] = None
+
+    def __init__(self, sid: str, server: MinecraftServer, max_queue_size: int = 256,
+                 overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE, console_log: Optional[ConsoleLog] = None):
+        self.sid = sid
+        self.server = server
+        self.console_log = console_log
+        self.subscriber = Subscriber(max_queue_size, overflow_policy)
+        self._callbacks = {}
+
+    def register(self):
+        for callback_name in self.callback_names:
+            func = partial(self.on_event, callback_name=callback_name)
+            getattr(self.server.callbacks, callback_name).add_callback(func)
+            self._callbacks[callback_name] = func
+
+    def close(self):
+        for callback_name, func in self._callbacks.items():
+            callback = getattr(self.server.callbacks, callback_name)
+            # Rebind instead of removing in place, the list may be iterated by a running dispatch. The function
+            # may be wrapped by the instrumentation.
+            callback.installed_callbacks = [
+                f for f in callback.installed_callbacks if getattr(f, "__wrapped__", f) is not func
+            ]
+        self._callbacks = {}
+
+    async def on_event(self, output, callback_name: str):
+        self.put(output, callback_name)
+
+    def put(self, output, callback_name: str):
+        seq = None
+        if callback_name == "output" and self.console_log is not None:
+            # the console log registered its callback first, so the line is already appended
+            seq = self.console_log.last_seq
+        key = callback_name if callback_name in self.coalesced_callback_names else None
+        self.subscriber.put(self._serialize(output, callback_name, seq), key=key)
+
+    @classmethod
+    def _serialize(cls, output, callback_name: str, seq: Optional[int]) -> str:
+        """
+        All subscriptions of a server receive the same object for an event, so it is only serialized once
+        """
+        last = cls._last_event
+        if last is not None and last[0] is output and last[1] == callback_name and last[2] == seq:
+            return last[3]
+        value = output.name if callback_name == "status" else output
+        message = {"type": callback_name, "value": value}
+        if seq is not None:
+            message["seq"] = seq
+        serialized = json.dumps(message)
+        # keep a reference to the object, so its id can't be reused
+        cls._last_event = (output, callback_name, seq, serialized)
+        return serialized
+
+    def to_dict(self):
+        return self.subscriber.to_dict()
+
+
+class ServerSubscriptionManager:
+    """
+    Keeps track of the subscriptions of all servers. on_players() has to be added to the listeners of the
+    player poller.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.subscriptions: Dict[str, Set[ServerSubscription]] = {}
+
+    def subscribe(self, sid: str, server: MinecraftServer, **kwargs) -> ServerSubscription:
+        subscription = ServerSubscription(sid, server, **kwargs)
+        subscription.register()
+        self.subscriptions.setdefault(sid, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ServerSubscription):
+        subscription.close()
+        subscriptions = self.subscriptions.get(subscription.sid)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.sid)
+
+    def get_subscriptions(self, sid: str) -> Set[ServerSubscription]:
+        return self.subscriptions.get(sid, set())
+
+    async def on_players(self, sid: str, players: dict):
+        for subscription in list(self.get_subscriptions(sid)):
+            subscription.put(players, "players")
@@ -0,0 +1,368 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiofiles
+import aiohttp
+from mc_server_interaction.interaction import MinecraftServer
+from mc_server_interaction.interaction.models import ServerStatus
+from mc_server_interaction.manager import ServerManager
+from mc_server_interaction.manager.utils import AvailableMinecraftServerVersions
+from mc_server_interaction.paths import cache_dir
+
+from mc_server_manager_api.copy import CopyEngine
+from mc_server_manager_api.jobs import Job, JobQueue
+
+template_name_pattern = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+# directories the server jar extracts on the first start, they are never changed afterwards
+base_file_names = ("libraries", "versions")
+
+
+class ArtifactCache:
+    """
+    Content addressed cache of server jars. Artifacts are stored once per sha256 digest and looked up by a key
+    like server_jar:1.19.2. If the cache grows beyond max_size, the least recently used artifacts are removed.
+    Servers get copies of the artifacts, reflinks where the file system supports them, so a server can't change
+    the cached artifact and removing it from the cache doesn't affect existing servers.
+    """
+
+    def __init__(self, path: Path, max_size: int = 4 * 1024 ** 3):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.path = path
+        self.blob_dir = path / "blobs"
+        self.index_path = path / "index.json"
+        self.max_size = max_size
+        # digest -> {"size", "last_used", "keys"}, least recently used first
+        self.entries: Dict[str, dict] = OrderedDict()
+        self.keys: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._loaded = False
+
+    def load(self):
+        """
+        Read the index. It is read on first use, call it in an executor to read it earlier.
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            self.blob_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                with open(self.index_path, "r") as f:
+                    entries = json.load(f)["entries"]
+            except (OSError, KeyError, ValueError):
+                entries = {}
+            for digest, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+                if self.blob_path(digest).exists():
+                    self.entries[digest] = entry
+                    for key in entry["keys"]:
+                        self.keys[key] = digest
+            self._loaded = True
+
+    def _save(self):
+        temp_path = self.index_path.with_suffix(".part")
+        with open(temp_path, "w") as f:
+            json.dump({"entries": self.entries}, f)
+        os.replace(temp_path, self.index_path)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def get(self, key: str) -> Optional[Path]:
+        self.load()
+        with self._lock:
+            digest = self.keys.get(key)
+            if digest is None:
+                return None
+            entry = self.entries.pop(digest)
+            entry["last_used"] = time.time()
+            self.entries[digest] = entry
+            return self.blob_path(digest)
+
+    def put(self, key: str, source: Path, move: bool = False) -> Path:
+        """
+        Add a file to the cache. Blocking, run it in an executor.
+        :param move: Move the source into the cache instead of copying it
+        """
+        self.load()
+        sha256 = hashlib.sha256()
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            temp_path = path.with_suffix(".part")
+            if move:
+                os.replace(source, temp_path)
+            else:
+                shutil.copyfile(source, temp_path)
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, path)
+        elif move:
+            os.remove(source)
+
+        with self._lock:
+            entry = self.entries.pop(digest, None) or {"size": path.stat().st_size, "keys": []}
+            entry["last_used"] = time.time()
+            if key not in entry["keys"]:
+                entry["keys"].append(key)
+            old_digest = self.keys.get(key)
+            if old_digest is not None and old_digest != digest and old_digest in self.entries:
+                self.entries[old_digest]["keys"].remove(key)
+            self.keys[key] = digest
+            self.entries[digest] = entry
+            self._evict(keep=digest)
+            self._save()
+        return path
+
+    def _evict(self, keep: str):
+        size = self.size
+        for digest in list(self.entries):
+            if size <= self.max_size:
+                break
+            if digest == keep:
+                continue
+            entry = self.entries.pop(digest)
+            for key in entry["keys"]:
+                if self.keys.get(key) == digest:
+                    self.keys.pop(key)
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError as e:
+                self.logger.warning(f"Failed to remove artifact {digest}: {e}")
+            size -= entry["size"]
+            self.logger.info(f"Evicted artifact {digest} ({', '.join(entry['keys'])})")
+
+    async def get_server_jar(self, version: str, available_versions: AvailableMinecraftServerVersions,
+                             run_blocking: Callable[..., Awaitable]) -> Path:
+        """
+        The server jar of a version. It is downloaded only once, even if many servers are installed at once.
+        """
+        key = f"server_jar:{version}"
+        lock = self._key_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            path = self.get(key)
+            if path is not None:
+                return path
+            # jars downloaded by mc_server_interaction before
+            legacy_path = cache_dir / f"minecraft_server_{version}.jar"
+            if legacy_path.exists():
+                return await run_blocking(self.put, key, legacy_path)
+
+            self.logger.info(f"Downloading server jar for version {version}")
+            download_url = await available_versions.get_download_link(version)
+            temp_path = self.path / f"{uuid.uuid4().hex}.download"
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(download_url) as resp:
+                        resp.raise_for_status()
+                        async with aiofiles.open(temp_path, "wb") as f:
+                            async for chunk in resp.content.iter_chunked(64 * 1024):
+                                await f.write(chunk)
+                return await run_blocking(partial(self.put, key, temp_path, move=True))
+            finally:
+                temp_path.unlink(missing_ok=True)
+
+    def to_dict(self):
+        self.load()
+        with self._lock:
+            return {
+                "size": self.size,
+                "max_size": self.max_size,
+                "artifacts": [{"digest": digest, **entry} for digest, entry in reversed(self.entries.items())]
+            }
+
+
+@dataclass
+class ServerTemplate:
+    name: str
+    version: str
+    properties: dict = field(default_factory=dict)
+    world: bool = False
+    base_files: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+class TemplateStore:
+    """
+    Named server templates. A template bundles a version, server properties, an optional seed world and the
+    files the server jar extracts on the first start, so new servers don't have to generate them again.
+    """
+
+    def __init__(self, path: Path, copy_engine: CopyEngine):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.path = path
+        self.copy_engine = copy_engine
+        self._templates: Dict[str, ServerTemplate] = {}
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # number of running applies per template, a template directory is only replaced while it is not read
+        self._readers: Dict[str, int] = {}
+        self._readers_changed = threading.Condition()
+
+    @property
+    def templates(self) -> Dict[str, ServerTemplate]:
+        self.load()
+        return self._templates
+
+    def load(self):
+        """
+        Read the templates. They are read on first use, call it in an executor to read them earlier.
+        """
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            for entry in self.path.iterdir():
+                # temporary directories of an interrupted create or delete
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    with open(entry / "template.json", "r") as f:
+                        template = ServerTemplate(**json.load(f))
+                    self._templates[template.name] = template
+                except (OSError, TypeError, ValueError):
+                    continue
+            self._loaded = True
+
+    def template_dir(self, name: str) -> Path:
+        return self.path / name
+
+    def get(self, name: str) -> Optional[ServerTemplate]:
+        return self.templates.get(name)
+
+    def create(self, template: ServerTemplate, source_server: Optional[MinecraftServer] = None,
+               world_name: Optional[str] = None, progress: Optional[Callable[[int, int], None]] = None):
+        """
+        Save a template. With a source server, its base files and optionally a world are copied into the template.
+        The template is built in a temporary directory and renamed once no apply reads the old one.
+        Blocking, run it in an executor.
+        """
+        template_dir = self.template_dir(template.name)
+        self.load()
+        temp_dir = self.path / f".{template.name}.{uuid.uuid4().hex}"
+        temp_dir.mkdir()
+        try:
+            if source_server is not None:
+                server_path = Path(source_server.server_config.path)
+                for name in base_file_names:
+                    if (server_path / name).is_dir():
+                        self.copy_engine.copy_tree(server_path / name, temp_dir / "base" / name)
+                        template.base_files.append(name)
+                if world_name is not None:
+                    self.copy_engine.copy_tree(server_path / "worlds" / world_name, temp_dir / "world", progress)
+                    template.world = True
+            with open(temp_dir / "template.json", "w") as f:
+                json.dump(template.to_dict(), f)
+            trash = self.path / f".{template.name}.old-{uuid.uuid4().hex}"
+            with self._readers_changed:
+                self._readers_changed.wait_for(lambda: not self._readers.get(template.name))
+                if template_dir.exists():
+                    os.rename(template_dir, trash)
+                os.rename(temp_dir, template_dir)
+                self.templates[template.name] = template
+            shutil.rmtree(trash, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+    def delete(self, name: str):
+        trash = self.path / f".{name}.old-{uuid.uuid4().hex}"
+        with self._readers_changed:
+            self._readers_changed.wait_for(lambda: not self._readers.get(name))
+            self.templates.pop(name, None)
+            if self.template_dir(name).exists():
+                os.rename(self.template_dir(name), trash)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def apply(self, template: ServerTemplate, server_path: Path):
+        """
+        Copy the base files and the seed world of a template into a server. Base files are hardlinked,
+        they are never changed. Blocking, run it in an executor.
+        """
+        template_dir = self.template_dir(template.name)
+        with self._readers_changed:
+            self._readers[template.name] = self._readers.get(template.name, 0) + 1
+        try:
+            for name in template.base_files:
+                self.copy_engine.copy_tree(template_dir / "base" / name, server_path / name, override=True,
+                                           read_only=True)
+            if template.world:
+                self.copy_engine.copy_tree(template_dir / "world", server_path / "worlds" / "world", override=True)
+        finally:
+            with self._readers_changed:
+                self._readers[template.name] -= 1
+                if not self._readers[template.name]:
+                    self._readers.pop(template.name)
+                self._readers_changed.notify_all()
+
+
+async def install_server_job(job: Job, manager: ServerManager, job_queue: JobQueue, artifacts: ArtifactCache,
+                             copy_engine: CopyEngine, sid: str, template: Optional[ServerTemplate] = None,
+                             templates: Optional[TemplateStore] = None):
+    """
+    Install a server with the jar from the artifact cache and apply a template
+    """
+    server = manager.get_server(sid)
+    if server is None:
+        raise Exception("Server not found")
+    await server.set_status(ServerStatus.INSTALLING)
+    server_path = Path(server.server_config.path)
+    try:
+        jar = await artifacts.get_server_jar(server.server_config.version, manager.available_versions,
+                                             job_queue.run_blocking)
+        await job_queue.run_blocking(partial(copy_engine.copy_file, jar, server_path / "server.jar", mode=0o644))
+        if template is not None:
+            await job_queue.run_blocking(templates.apply, template, server_path)
+            for key, value in template.properties.items():
+                server.properties.set(key, value)
+            if template.world:
+                server.properties.set("level-name", "worlds/world")
+            server.save_properties()
+            server.load_worlds()
+    except BaseException:
+        await server.set_status(ServerStatus.NOT_INSTALLED)
+        raise
+    server.server_config.installed = True
+    await server.set_status(ServerStatus.STOPPED)
+    manager.config.save()
+
+
+async def install_servers_job(job: Job, manager: ServerManager, job_queue: JobQueue, artifacts: ArtifactCache,
+                              copy_engine: CopyEngine, sids: List[str], template: Optional[ServerTemplate] = None,
+                              templates: Optional[TemplateStore] = None) -> Dict[str, dict]:
+    """
+    Install several servers. The progress is the number of installed servers.
+    """
+    results = {}
+    for i, sid in enumerate(sids):
+        started = time.monotonic()
+        try:
+            await install_server_job(job, manager, job_queue, artifacts, copy_engine, sid, template, templates)
+            results[sid] = {"result": "installed"}
+        except Exception as e:
+            results[sid] = {"result": "error", "error": str(e) or e.__class__.__name__}
+        results[sid]["duration"] = time.monotonic() - started
+        job.report(i + 1, len(sids), interval=0)
+    return results
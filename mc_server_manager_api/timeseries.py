@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import partial
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+FIELDS = ("cpu", "memory_server", "memory_used", "memory_total")
+
+
+def metrics_to_values(metrics: dict) -> Dict[str, float]:
+    """
+    Convert a reading of server.system_load
+    """
+    cpu = metrics.get("cpu", {})
+    memory = metrics.get("memory", {})
+    return {
+        "cpu": float(cpu.get("percent", 0)),
+        "memory_server": float(memory.get("server", 0)),
+        "memory_used": float(memory.get("used", 0)),
+        "memory_total": float(memory.get("total", 0))
+    }
+
+
+class RingSeries:
+    """
+    Fixed size ring buffer of timestamps and values, backed by arrays of doubles
+    """
+
+    def __init__(self, capacity: int, fields: Tuple[str, ...]):
+        self.capacity = capacity
+        self.fields = fields
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.values = {field: array("d", bytes(8 * capacity)) for field in fields}
+        self.start = 0
+        self.size = 0
+
+    def append(self, timestamp: float, values: Dict[str, float]):
+        index = (self.start + self.size) % self.capacity
+        if self.size == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.size += 1
+        self.timestamps[index] = timestamp
+        for field in self.fields:
+            self.values[field][index] = values[field]
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        if not self.size:
+            return None
+        index = (self.start + self.size - 1) % self.capacity
+        return {field: self.values[field][index] for field in self.fields}
+
+    @property
+    def oldest(self) -> Optional[float]:
+        return self.timestamps[self.start] if self.size else None
+
+    def _ordered(self, data: array) -> array:
+        end = self.start + self.size
+        if end <= self.capacity:
+            return data[self.start:end]
+        return data[self.start:] + data[:end - self.capacity]
+
+    def query(self, start: float, end: float) -> Tuple[array, Dict[str, array]]:
+        """
+        All samples with start <= timestamp <= end, in chronological order
+        """
+        timestamps = self._ordered(self.timestamps)
+        lo = bisect_left(timestamps, start)
+        hi = bisect_right(timestamps, end)
+        return timestamps[lo:hi], {field: self._ordered(self.values[field])[lo:hi] for field in self.fields}
+
+    def to_bytes(self) -> bytes:
+        data = self._ordered(self.timestamps).tobytes()
+        for field in self.fields:
+            data += self._ordered(self.values[field]).tobytes()
+        return struct.pack(">I", self.size) + data
+
+    def load_bytes(self, data: bytes, offset: int = 0) -> int:
+        """
+        :return: The offset after the loaded data
+        """
+        size = struct.unpack_from(">I", data, offset)[0]
+        offset += 4
+        chunks = []
+        for _ in range(1 + len(self.fields)):
+            chunk = array("d")
+            chunk.frombytes(data[offset:offset + 8 * size])
+            chunks.append(chunk)
+            offset += 8 * size
+        keep = min(size, self.capacity)
+        for i in range(size - keep, size):
+            self.append(chunks[0][i], {field: chunks[j + 1][i] for j, field in enumerate(self.fields)})
+        return offset
+
+
+class Rollup:
+    """
+    Aggregates samples into buckets of a fixed number of seconds, storing the mean and the maximum
+    """
+
+    def __init__(self, bucket: int, capacity: int):
+        self.bucket = bucket
+        self.series = RingSeries(capacity, FIELDS + tuple(f"{field}_max" for field in FIELDS))
+        self._current: Optional[int] = None
+        self._sum: Dict[str, float] = {}
+        self._max: Dict[str, float] = {}
+        self._count = 0
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        bucket = int(timestamp // self.bucket)
+        if bucket != self._current:
+            self.flush()
+            self._current = bucket
+        for field in FIELDS:
+            self._sum[field] = self._sum.get(field, 0) + values[field]
+            self._max[field] = max(self._max.get(field, values[field]), values[field])
+        self._count += 1
+
+    def flush(self):
+        if self._current is None or not self._count:
+            return
+        values = {field: self._sum[field] / self._count for field in FIELDS}
+        values.update({f"{field}_max": self._max[field] for field in FIELDS})
+        self.series.append(self._current * self.bucket, values)
+        self._sum, self._max, self._count = {}, {}, 0
+
+
+class ServerMetricsHistory:
+    """
+    Raw samples of the last hour, one minute rollups of the last day and one hour rollups of the last 30 days.
+    Samples come from the system_metrics callback, which only fires when server.system_load changed. That is
+    cached for 5 seconds, so the raw samples are at least raw_interval apart.
+    """
+    raw_interval = 5
+
+    def __init__(self):
+        self.raw = RingSeries(3600 // self.raw_interval, FIELDS)
+        self.rollups = [Rollup(60, 1440), Rollup(3600, 720)]
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        self.raw.append(timestamp, values)
+        for rollup in self.rollups:
+            rollup.add(timestamp, values)
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        return self.raw.latest()
+
+    def query(self, start: float, end: float, step: Optional[float] = None) -> dict:
+        """
+        Uses the finest resolution that covers the start of the range and is not finer than step.
+        With a step, the samples are aggregated into buckets of step seconds. Steps below raw_interval are
+        clamped to the raw resolution.
+        """
+        if step is not None:
+            step = max(step, self.raw_interval)
+        levels = [(self.raw_interval, self.raw)] + [(rollup.bucket, rollup.series) for rollup in self.rollups]
+        resolution, series = levels[-1]
+        for level_resolution, level_series in levels:
+            if step is not None and level_resolution > step:
+                continue
+            if level_series.oldest is not None and level_series.oldest <= start:
+                resolution, series = level_resolution, level_series
+                break
+        else:
+            # nothing covers the whole range, use the finest allowed level with data
+            for level_resolution, level_series in levels:
+                if (step is None or level_resolution <= step) and level_series.size:
+                    resolution, series = level_resolution, level_series
+                    break
+
+        timestamps, values = series.query(start, end)
+        maxima = {field: values.get(f"{field}_max", values[field]) for field in FIELDS}
+        values = {field: values[field] for field in FIELDS}
+        if step is not None and step > resolution:
+            timestamps, values, maxima = self._aggregate(timestamps, values, maxima, step)
+        ret = {"resolution": resolution, "step": step or resolution, "timestamps": list(timestamps)}
+        for field in FIELDS:
+            ret[field] = list(values[field])
+            ret[f"{field}_max"] = list(maxima[field])
+        return ret
+
+    @staticmethod
+    def _aggregate(timestamps: array, values: Dict[str, array], maxima: Dict[str, array], step: float):
+        bucket_timestamps = array("d")
+        bucket_values = {field: array("d") for field in FIELDS}
+        bucket_maxima = {field: array("d") for field in FIELDS}
+        i = 0
+        while i < len(timestamps):
+            bucket = timestamps[i] // step
+            j = i
+            while j < len(timestamps) and timestamps[j] // step == bucket:
+                j += 1
+            bucket_timestamps.append(bucket * step)
+            for field in FIELDS:
+                bucket_values[field].append(sum(values[field][i:j]) / (j - i))
+                bucket_maxima[field].append(max(maxima[field][i:j]))
+            i = j
+        return bucket_timestamps, bucket_values, bucket_maxima
+
+    def to_bytes(self) -> bytes:
+        return self.raw.to_bytes() + b"".join(rollup.series.to_bytes() for rollup in self.rollups)
+
+    def load_bytes(self, data: bytes):
+        offset = self.raw.load_bytes(data)
+        for rollup in self.rollups:
+            offset = rollup.series.load_bytes(data, offset)
+
+
+class MetricsStore:
+    """
+    Keeps the history of the system metrics of all servers. The system_metrics callback is registered
+    once per server. If a path is given, the history is saved periodically and loaded on startup.
+    """
+
+    def __init__(self, manager: ServerManager, path: Optional[Path] = None, save_interval: float = 300,
+                 load: bool = True):
+        """
+        :param load: Load the saved history now. Otherwise call load_in_background(), the history is not saved
+                     before it was loaded.
+        """
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.path = path
+        self.save_interval = save_interval
+        self.histories: Dict[str, ServerMetricsHistory] = {}
+        # sids with a registered callback, the histories may be loaded before
+        self._watched: Set[str] = set()
+        self.loaded = self.path is None
+        self._task: Optional[asyncio.Task] = None
+        if self.path is not None and load:
+            self.load()
+
+    def watch_servers(self):
+        servers = self.manager.get_servers()
+        for sid in list(self.histories):
+            if sid not in servers:
+                self.histories.pop(sid)
+        self._watched.intersection_update(servers)
+        for sid, server in servers.items():
+            if sid in self._watched:
+                continue
+            self._watched.add(sid)
+            self.histories.setdefault(sid, ServerMetricsHistory())
+            server.callbacks.system_metrics.add_callback(partial(self._on_metrics, sid))
+
+    def get_history(self, sid: str) -> Optional[ServerMetricsHistory]:
+        return self.histories.get(sid)
+
+    async def _on_metrics(self, sid: str, metrics: dict):
+        history = self.histories.get(sid)
+        if history is not None and metrics:
+            history.add(time.time(), metrics_to_values(metrics))
+
+    def start(self):
+        if self.path is not None and self._task is None:
+            self._task = asyncio.create_task(self._save_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.path is not None and self.loaded:
+            self.save()
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if not self.loaded:
+                continue
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.save)
+            except OSError as e:
+                self.logger.error(f"Failed to save metrics: {e}")
+
+    def save(self):
+        """
+        Binary format: a json header line with the sids and the data length per server, followed by the data
+        """
+        data = {sid: history.to_bytes() for sid, history in list(self.histories.items())}
+        header = json.dumps({sid: len(chunk) for sid, chunk in data.items()}).encode("utf-8") + b"\n"
+        temp_path = self.path.with_suffix(".part")
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            for chunk in data.values():
+                f.write(chunk)
+        os.replace(temp_path, self.path)
+
+    def load(self):
+        self.histories = self._read()
+        self.loaded = True
+
+    async def load_in_background(self):
+        histories = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        servers = self.manager.get_servers()
+        for sid, history in histories.items():
+            # servers created meanwhile already have a new history
+            current = self.histories.get(sid)
+            if sid in servers and (current is None or current.latest() is None):
+                self.histories[sid] = history
+        self.loaded = True
+
+    def _read(self) -> Dict[str, ServerMetricsHistory]:
+        histories = {}
+        if not self.path.exists():
+            return histories
+        try:
+            with open(self.path, "rb") as f:
+                header = json.loads(f.readline())
+                for sid, length in header.items():
+                    history = ServerMetricsHistory()
+                    history.load_bytes(f.read(length))
+                    histories[sid] = history
+        except (OSError, ValueError, struct.error) as e:
+            self.logger.error(f"Failed to load metrics: {e}")
+            return {}
+        return histories
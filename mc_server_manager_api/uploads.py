@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Dict, Optional, Set
+
+from mc_server_manager_api.broadcast import Subscriber
+
+
+class UploadException(Exception):
+    pass
+
+
+class UploadLimitException(UploadException):
+    pass
+
+
+class InvalidArchiveException(UploadException):
+    pass
+
+
+class UploadOffsetException(UploadException):
+    pass
+
+
+@dataclass
+class UploadLimits:
+    # size of the uploaded archive
+    max_size: int = 8 * 1024 ** 3
+    # number of entries in the archive
+    max_entries: int = 200_000
+    # sum of the uncompressed size of all entries
+    max_uncompressed_size: int = 32 * 1024 ** 3
+    # uncompressed / compressed size, per entry and for the whole archive
+    max_ratio: int = 100
+
+
+def extract_world(archive: BinaryIO, destination: Path, limits: UploadLimits,
+                  progress: Optional[Callable[[int, int], None]] = None, chunk_size: int = 1024 * 1024):
+    """
+    Extract a zip archive with size, entry and ratio checks. Entries are streamed, so the declared sizes
+    in the archive are not trusted. This blocks, run it in an executor.
+    :param archive: Seekable binary file object of the zip archive
+    :param destination: Directory to extract into
+    :param limits: Limits to enforce
+    :param progress: Called with (extracted bytes, total bytes) after each chunk
+    :param chunk_size: Size of the chunks to extract at once
+    """
+    archive.seek(0, os.SEEK_END)
+    archive_size = archive.tell()
+    archive.seek(0)
+    if archive_size > limits.max_size:
+        raise UploadLimitException(f"Archive is larger than {limits.max_size} bytes")
+
+    try:
+        zip_file = zipfile.ZipFile(archive, "r")
+    except zipfile.BadZipFile as e:
+        raise InvalidArchiveException(str(e))
+
+    with zip_file:
+        members = zip_file.infolist()
+        if len(members) > limits.max_entries:
+            raise UploadLimitException(f"Archive contains more than {limits.max_entries} entries")
+        total = sum(member.file_size for member in members)
+        if total > limits.max_uncompressed_size or total > max(archive_size, 1) * limits.max_ratio:
+            raise UploadLimitException("Uncompressed size of the archive is too large")
+
+        destination = destination.resolve()
+        extracted = 0
+        for member in members:
+            target = (destination / member.filename).resolve()
+            if target != destination and destination not in target.parents:
+                raise InvalidArchiveException(f"Illegal path in archive: {member.filename}")
+            if member.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            member_limit = max(member.compress_size, 1) * limits.max_ratio
+            written = 0
+            with zip_file.open(member) as src, open(target, "wb") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    extracted += len(chunk)
+                    if written > member_limit or extracted > limits.max_uncompressed_size:
+                        raise UploadLimitException(f"Compression ratio of {member.filename} is too high")
+                    dst.write(chunk)
+                    if progress is not None:
+                        progress(extracted, total)
+
+
+class WorldUpload:
+    """
+    A resumable world upload. Chunks are spooled to a file in the upload directory and extracted
+    into the worlds directory of the server once the upload is complete.
+    """
+
+    def __init__(self, uid: str, sid: str, world_name: str, size: int, path: Path):
+        self.uid = uid
+        self.sid = sid
+        self.world_name = world_name
+        self.size = size
+        self.path = path
+        self.received = 0
+        self.extracted = 0
+        self.total = 0
+        self.state = "uploading"
+        self.error = None
+        self.updated_at = time.time()
+        self.subscribers: Set[Subscriber] = set()
+        # held while a chunk is written, concurrent requests for the same offset are serialized
+        self.lock = asyncio.Lock()
+
+    def to_dict(self):
+        return {
+            "uid": self.uid,
+            "sid": self.sid,
+            "world_name": self.world_name,
+            "size": self.size,
+            "received": self.received,
+            "extracted": self.extracted,
+            "total": self.total,
+            "state": self.state,
+            "error": self.error
+        }
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        subscriber.put(json.dumps(self.to_dict()))
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self):
+        self.updated_at = time.time()
+        message = json.dumps(self.to_dict())
+        for subscriber in self.subscribers:
+            subscriber.put(message)
+
+
+class WorldUploadManager:
+    """
+    Keeps track of resumable world uploads and runs the extraction in a worker thread
+    """
+
+    def __init__(self, upload_dir: Path, limits: UploadLimits = None, expire_after: int = 24 * 60 * 60):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.upload_dir = upload_dir
+        self.limits = limits or UploadLimits()
+        self.expire_after = expire_after
+        self.uploads: Dict[str, WorldUpload] = {}
+
+    async def create_upload(self, sid: str, world_name: str, size: int) -> WorldUpload:
+        if size > self.limits.max_size:
+            raise UploadLimitException(f"Archive is larger than {self.limits.max_size} bytes")
+        await self.remove_expired()
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        uid = uuid.uuid4().hex
+        upload = WorldUpload(uid, sid, world_name, size, self.upload_dir / f"{uid}.zip")
+        upload.path.touch()
+        self.uploads[uid] = upload
+        return upload
+
+    def get_upload(self, uid: str) -> Optional[WorldUpload]:
+        return self.uploads.get(uid)
+
+    async def remove_upload(self, uid: str):
+        upload = self.uploads.pop(uid, None)
+        if upload is None:
+            return
+        # wait for a chunk that is being written, requests that wait for the lock fail afterwards
+        async with upload.lock:
+            upload.state = "removed"
+            if upload.path.exists():
+                await asyncio.get_running_loop().run_in_executor(None, os.remove, upload.path)
+
+    async def remove_expired(self):
+        now = time.time()
+        for uid, upload in list(self.uploads.items()):
+            if upload.state != "extracting" and now - upload.updated_at > self.expire_after:
+                self.logger.info(f"Removing expired upload {uid}")
+                await self.remove_upload(uid)
+        # spool files of uploads that were lost by a restart
+        known = {upload.path for upload in self.uploads.values()}
+        await asyncio.get_running_loop().run_in_executor(None, self._remove_orphans, known, now)
+
+    def _remove_orphans(self, known: Set[Path], now: float):
+        for path in self.upload_dir.glob("*.zip"):
+            try:
+                if path not in known and now - path.stat().st_mtime > self.expire_after:
+                    self.logger.info(f"Removing orphaned upload file {path.name}")
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+
+    async def write_chunk(self, upload: WorldUpload, offset: int, stream: AsyncIterator[bytes]):
+        """
+        Append the body of a request to the upload. The offset has to match the already received bytes,
+        so an interrupted upload can be continued from `upload.received`.
+        """
+        async with upload.lock:
+            # checked under the lock, another request may have written at the same offset meanwhile
+            if upload.state != "uploading":
+                raise UploadException(f"Upload is {upload.state}")
+            if offset != upload.received:
+                raise UploadOffsetException(f"Expected offset {upload.received}")
+
+            loop = asyncio.get_running_loop()
+            f = await loop.run_in_executor(None, open, upload.path, "r+b")
+            try:
+                f.seek(offset)
+                f.truncate()
+                async for chunk in stream:
+                    if upload.received + len(chunk) > upload.size:
+                        raise UploadLimitException("Received more data than announced")
+                    await loop.run_in_executor(None, f.write, chunk)
+                    upload.received += len(chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+                upload.publish()
+
+    async def extract(self, upload: WorldUpload, destination: Path):
+        """
+        Extract a completely received upload. On failure, the partially extracted world is removed.
+        """
+        async with upload.lock:
+            if upload.state != "uploading":
+                raise UploadException(f"Upload is {upload.state}")
+            if upload.received != upload.size:
+                raise UploadException(f"Upload is incomplete, received {upload.received} of {upload.size} bytes")
+            upload.state = "extracting"
+        upload.publish()
+
+        loop = asyncio.get_running_loop()
+        # Report about every percent of progress to the event loop, not every chunk
+        last_reported = [0]
+
+        def progress(extracted: int, total: int):
+            upload.extracted = extracted
+            upload.total = total
+            if extracted - last_reported[0] >= total // 100:
+                last_reported[0] = extracted
+                loop.call_soon_threadsafe(upload.publish)
+
+        def run():
+            with open(upload.path, "rb") as f:
+                extract_world(f, destination, self.limits, progress)
+
+        try:
+            await loop.run_in_executor(None, run)
+        except Exception as e:
+            self.logger.error(f"Failed to extract upload {upload.uid}: {e}")
+            upload.state = "failed"
+            upload.error = str(e)
+            await loop.run_in_executor(None, shutil.rmtree, destination, True)
+            raise
+        else:
+            upload.state = "done"
+        finally:
+            upload.publish()
+            if upload.path.exists():
+                os.remove(upload.path)
@@ -1,6 +1,89 @@
+import gzip
 import pathlib
+import struct
+from typing import BinaryIO
 
 
 def is_map_directory(path: pathlib.Path) -> bool:
-    # TODO
-    return True
+    """
+    Fast check whether a directory is a Minecraft world. Every world has a level.dat file.
+    """
+    return (path / "level.dat").is_file()
+
+
+def get_world_dir_name(filename: str) -> str:
+    """
+    Build a safe directory name for a world from the name of an uploaded file
+    """
+    dir_name = filename.replace(".zip", "")
+    return "".join(c for c in dir_name if c.isalnum() or c in "_- !()[]{}")
+
+
+_NBT_STRUCTS = {
+    1: struct.Struct(">b"),
+    2: struct.Struct(">h"),
+    3: struct.Struct(">i"),
+    4: struct.Struct(">q"),
+    5: struct.Struct(">f"),
+    6: struct.Struct(">d")
+}
+_NBT_ARRAYS = {
+    7: "b",
+    11: "i",
+    12: "q"
+}
+
+
+def _read(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError()
+    return data
+
+
+def _read_nbt_string(f: BinaryIO) -> str:
+    length = struct.unpack(">H", _read(f, 2))[0]
+    return _read(f, length).decode("utf-8", errors="replace")
+
+
+def _read_nbt_payload(f: BinaryIO, tag_type: int):
+    if tag_type in _NBT_STRUCTS:
+        s = _NBT_STRUCTS[tag_type]
+        return s.unpack(_read(f, s.size))[0]
+    if tag_type in _NBT_ARRAYS:
+        length = struct.unpack(">i", _read(f, 4))[0]
+        return struct.unpack(f">{length}{_NBT_ARRAYS[tag_type]}", _read(f, length * struct.calcsize(_NBT_ARRAYS[tag_type])))
+    if tag_type == 8:
+        return _read_nbt_string(f)
+    if tag_type == 9:
+        item_type = _read(f, 1)[0]
+        length = struct.unpack(">i", _read(f, 4))[0]
+        return [_read_nbt_payload(f, item_type) for _ in range(length)]
+    if tag_type == 10:
+        compound = {}
+        while True:
+            item_type = _read(f, 1)[0]
+            if item_type == 0:
+                return compound
+            name = _read_nbt_string(f)
+            compound[name] = _read_nbt_payload(f, item_type)
+    raise ValueError(f"Unknown NBT tag type {tag_type}")
+
+
+def read_nbt(f: BinaryIO) -> dict:
+    """
+    Read an uncompressed NBT file with a compound as root tag
+    """
+    tag_type = _read(f, 1)[0]
+    if tag_type != 10:
+        raise ValueError("Root tag is not a compound")
+    _read_nbt_string(f)
+    return _read_nbt_payload(f, tag_type)
+
+
+def read_level_dat(path: pathlib.Path) -> dict:
+    """
+    Read the Data compound of the level.dat file of a world
+    """
+    with gzip.open(path, "rb") as f:
+        return read_nbt(f).get("Data", {})
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mc_server_interaction.manager.utils import AvailableMinecraftServerVersions
+
+release_pattern = re.compile(r"^\d+(\.\d+)+$")
+pre_release_pattern = re.compile(r"(-pre|-rc| Pre-Release| Release Candidate)", re.IGNORECASE)
+
+
+def get_version_type(version: str) -> str:
+    if release_pattern.match(version):
+        return "release"
+    if pre_release_pattern.search(version):
+        return "pre_release"
+    return "snapshot"
+
+
+class VersionCatalog:
+    """
+    Serves the available Minecraft versions. On startup, the cached version file is used regardless of its age,
+    the version list is refreshed in the background. Responses are serialized once per version list.
+    """
+
+    def __init__(self, available_versions: AvailableMinecraftServerVersions, ttl: float = 24 * 60 * 60,
+                 max_cached_responses: int = 64):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.available_versions = available_versions
+        self.ttl = ttl
+        self.max_cached_responses = max_cached_responses
+        self.loaded = False
+        self.last_refresh: Optional[float] = None
+        self._versions: List[str] = []
+        self._responses: Dict[Tuple, Tuple[bytes, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._load_cached()
+
+    def _load_cached(self):
+        if self.available_versions.available_versions or not os.path.exists(self.available_versions.filename):
+            self._rebuild()
+            return
+        try:
+            with open(self.available_versions.filename, "r") as f:
+                self.available_versions.available_versions = json.load(f)["versions"]
+        except (OSError, KeyError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Failed to read cached versions: {e}")
+        self._rebuild()
+
+    def _rebuild(self):
+        versions = list(self.available_versions.available_versions.keys())
+        if versions != self._versions:
+            self._versions = versions
+            self._responses = {}
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether versions are known, from the cache or a refresh
+        """
+        return bool(self._versions)
+
+    def start(self):
+        """
+        Start refreshing the version list in the background
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def refresh(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._expire_cache_file)
+        await self.available_versions.load()
+        self.last_refresh = time.time()
+        self.loaded = True
+        self._rebuild()
+
+    def _expire_cache_file(self):
+        """
+        The library uses its cache file for up to 7 days. Once the file is older than the ttl, its timestamp is
+        reset, so the next load fetches the versions. The versions in the file stay usable if the fetch fails.
+        """
+        filename = self.available_versions.filename
+        try:
+            with open(filename, "r") as f:
+                data = json.load(f)
+            if time.time() - float(data["timestamp"]) < self.ttl:
+                return
+            data["timestamp"] = 0
+            temp_filename = filename + ".part"
+            with open(temp_filename, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_filename, filename)
+        except FileNotFoundError:
+            return
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            self.logger.warning(f"Failed to expire cached versions: {e}")
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.logger.error(f"Failed to refresh Minecraft versions: {e}")
+                await asyncio.sleep(60)
+                continue
+            await asyncio.sleep(self.ttl)
+
+    def get_response(self, version_type: Optional[str] = None, limit: Optional[int] = None,
+                     offset: int = 0) -> Tuple[bytes, str]:
+        """
+        :return: The serialized response body and its ETag
+        """
+        key = (version_type, limit, offset)
+        response = self._responses.get(key)
+        if response is None:
+            versions = self._versions
+            if version_type is not None:
+                versions = [version for version in versions if get_version_type(version) == version_type]
+            # "latest" counts against the limit, so the pages don't overlap or skip a version
+            if self._versions:
+                versions = ["latest"] + versions
+            versions = versions[offset:offset + limit if limit is not None else None]
+            body = json.dumps({"available_versions": versions}).encode("utf-8")
+            response = body, '"' + hashlib.sha1(body).hexdigest() + '"'
+            if len(self._responses) >= self.max_cached_responses:
+                self._responses = {}
+            self._responses[key] = response
+        return response
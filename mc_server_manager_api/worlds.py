@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from mc_server_interaction.manager import ServerManager
+
+from mc_server_manager_api.backups import get_directory_size
+from mc_server_manager_api.utils import is_map_directory, read_level_dat
+
+
+class _IndexedWorld:
+    def __init__(self, path: Path, level_dat_mtime: int):
+        self.path = path
+        self.level_dat_mtime = level_dat_mtime
+        self.data: Optional[dict] = None
+        self.size: Optional[int] = None
+        self.size_checked = 0.0
+
+
+class _IndexedServer:
+    def __init__(self, path: Path):
+        self.path = path
+        self.dir_mtime: Optional[int] = None
+        self.worlds: Dict[str, _IndexedWorld] = {}
+        self.data: Optional[List[dict]] = None
+
+
+class WorldIndex:
+    """
+    Cached metadata of the worlds of all servers. A world is only read again, if the modification time
+    of its level.dat changed, and the worlds directory is only listed again, if its modification time changed.
+    The file system is checked in the default executor by refresh(), at most once per check_interval.
+    The size of a world is computed at most once per size_interval, independent of its level.dat.
+    """
+
+    def __init__(self, manager: ServerManager, check_interval: float = 1.0, size_interval: float = 60.0):
+        self.logger = logging.getLogger(f"MCServerManagerAPI.{self.__class__.__name__}")
+        self.manager = manager
+        self.check_interval = check_interval
+        self.size_interval = size_interval
+        self._servers: Dict[str, _IndexedServer] = {}
+        self._last_check = 0.0
+        self._lock = asyncio.Lock()
+        self._body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+
+    def get_worlds(self, sid: str) -> List[dict]:
+        """
+        The worlds of the server as of the last refresh()
+        """
+        indexed_server = self._servers.get(sid)
+        return indexed_server.data if indexed_server is not None and indexed_server.data is not None else []
+
+    async def get_all_worlds(self) -> Tuple[bytes, str]:
+        """
+        :return: The serialized response body of all worlds and its ETag
+        """
+        await self.refresh()
+        if self._body is None:
+            self._body = json.dumps(
+                {"worlds": {sid: indexed_server.data for sid, indexed_server in self._servers.items()}}
+            ).encode("utf-8")
+            self._etag = '"' + hashlib.sha1(self._body).hexdigest() + '"'
+        return self._body, self._etag
+
+    def invalidate(self, sid: Optional[str] = None):
+        """
+        Force a check of the file system on the next refresh
+        """
+        if sid is not None and sid in self._servers:
+            self._servers[sid].dir_mtime = None
+        self._last_check = 0.0
+
+    async def refresh(self):
+        """
+        Check the file system for changes, if the last check is older than check_interval
+        """
+        if time.monotonic() - self._last_check < self.check_interval:
+            return
+        async with self._lock:
+            # another refresh may have finished while waiting for the lock
+            if time.monotonic() - self._last_check < self.check_interval:
+                return
+            self._last_check = time.monotonic()
+            paths = {
+                sid: Path(server.server_config.path) / "worlds" for sid, server in self.manager.get_servers().items()
+            }
+            servers, changed = await asyncio.get_running_loop().run_in_executor(None, self._check, paths)
+            self._servers = servers
+            if changed:
+                self._body = None
+
+    def _check(self, paths: Dict[str, Path]) -> Tuple[Dict[str, _IndexedServer], bool]:
+        # runs in a worker thread, so the index is only replaced on the event loop
+        changed = set(self._servers) != set(paths)
+        servers = {}
+        for sid, path in paths.items():
+            indexed_server = self._servers.get(sid)
+            if indexed_server is None or indexed_server.path != path:
+                indexed_server = _IndexedServer(path)
+            if self._update_server(indexed_server):
+                changed = True
+            servers[sid] = indexed_server
+        return servers, changed
+
+    def _update_server(self, indexed_server: _IndexedServer) -> bool:
+        try:
+            dir_mtime = indexed_server.path.stat().st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        changed = indexed_server.data is None
+
+        if dir_mtime != indexed_server.dir_mtime:
+            indexed_server.dir_mtime = dir_mtime
+            names = set()
+            if dir_mtime is not None:
+                for entry in os.scandir(indexed_server.path):
+                    if entry.is_dir() and is_map_directory(Path(entry.path)):
+                        names.add(entry.name)
+            for name in set(indexed_server.worlds) - names:
+                indexed_server.worlds.pop(name)
+                changed = True
+            for name in names - set(indexed_server.worlds):
+                indexed_server.worlds[name] = _IndexedWorld(indexed_server.path / name, -1)
+                changed = True
+
+        now = time.monotonic()
+        for name, indexed_world in list(indexed_server.worlds.items()):
+            try:
+                level_dat_mtime = (indexed_world.path / "level.dat").stat().st_mtime_ns
+            except OSError:
+                indexed_server.worlds.pop(name)
+                changed = True
+                continue
+            if indexed_world.data is None or level_dat_mtime != indexed_world.level_dat_mtime:
+                indexed_world.level_dat_mtime = level_dat_mtime
+                indexed_world.data = self._load_world(indexed_world.path)
+                indexed_world.data["size"] = indexed_world.size
+                changed = True
+            if indexed_world.size is None or now - indexed_world.size_checked >= self.size_interval:
+                indexed_world.size_checked = now
+                size = get_directory_size(indexed_world.path)
+                if size != indexed_world.size:
+                    indexed_world.size = size
+                    # a new dict, so the cached list is not changed while it is serialized
+                    indexed_world.data = dict(indexed_world.data, size=size)
+                    changed = True
+
+        if changed:
+            indexed_server.data = [
+                indexed_server.worlds[name].data for name in sorted(indexed_server.worlds)
+            ]
+        return changed
+
+    def _load_world(self, path: Path) -> dict:
+        version = None
+        last_played = None
+        try:
+            level_data = read_level_dat(path / "level.dat")
+            version = level_data.get("Version", {}).get("Name")
+            if "LastPlayed" in level_data:
+                last_played = level_data["LastPlayed"] / 1000
+        except (OSError, EOFError, ValueError, struct.error, zlib.error) as e:
+            self.logger.warning(f"Failed to read level.dat of {path}: {e}")
+        return {
+            "name": path.name,
+            "path": str(path),
+            "version": version,
+            "type": None,
+            "size": None,
+            "last_played": last_played
+        }
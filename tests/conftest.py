@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# mc_server_interaction creates its data directories in the home directory on import
+os.environ["HOME"] = tempfile.mkdtemp(prefix="mcsm-test-home-")
+
+# the manager has to be imported first, the interaction package imports it back
+import mc_server_interaction.manager  # noqa: E402,F401
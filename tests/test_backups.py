@@ -0,0 +1,136 @@
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from mc_server_manager_api.backups import IncrementalBackupStore, restore_backup_job
+from mc_server_manager_api.jobs import Job, JobQueue
+from mc_server_manager_api.lifecycle import LifecycleEngine, ServerBusyException
+
+
+def write_world(path: Path, files: dict):
+    for rel_path, data in files.items():
+        (path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (path / rel_path).write_bytes(data)
+
+
+def read_world(path: Path) -> dict:
+    return {p.relative_to(path).as_posix(): p.read_bytes() for p in path.rglob("*") if p.is_file()}
+
+
+@pytest.fixture
+def store(tmp_path) -> IncrementalBackupStore:
+    return IncrementalBackupStore(tmp_path / "incremental", chunk_size=4)
+
+
+def test_files_are_split_into_chunks(tmp_path, store):
+    # the same chunk in two files is stored once
+    write_world(tmp_path / "world", {"level.dat": b"aaaabbbbcc", "region/r.0.0.mca": b"aaaa"})
+    manifest = store.create(tmp_path / "world", "1")
+
+    assert manifest["size"] == 14
+    assert manifest["stored_bytes"] == 10
+    assert len(manifest["files"]["level.dat"]["chunks"]) == 3
+    assert manifest["files"]["region/r.0.0.mca"]["chunks"] == manifest["files"]["level.dat"]["chunks"][:1]
+    assert len(list(store.blobs.digests())) == 3
+    assert store.load_manifest(store.manifest_path("1")) == manifest
+
+
+def test_unchanged_files_are_not_read_again(tmp_path, store):
+    write_world(tmp_path / "world", {"level.dat": b"aaaa", "region/r.0.0.mca": b"bbbb"})
+    first = store.create(tmp_path / "world", "1")
+
+    write_world(tmp_path / "world", {"region/r.0.0.mca": b"bbbbcccc"})
+    # an unchanged size and modification time is trusted, even if the content differs
+    stat = (tmp_path / "world" / "level.dat").stat()
+    (tmp_path / "world" / "level.dat").write_bytes(b"dddd")
+    os.utime(tmp_path / "world" / "level.dat", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    second = store.create(tmp_path / "world", "2", [store.manifest_path("missing"), store.manifest_path("1")])
+    assert second["stored_bytes"] == 4
+    assert second["files"]["level.dat"] == first["files"]["level.dat"]
+    assert second["files"]["region/r.0.0.mca"]["chunks"][0] == first["files"]["region/r.0.0.mca"]["chunks"][0]
+
+
+def test_restore_writes_files_and_modification_times(tmp_path, store):
+    files = {"level.dat": b"aaaabbbbcc", "region/r.0.0.mca": b"", "DIM-1/region/r.0.0.mca": b"dddd"}
+    write_world(tmp_path / "world", files)
+    os.utime(tmp_path / "world" / "level.dat", ns=(1_000_000_000, 1_000_000_000))
+    store.create(tmp_path / "world", "1")
+
+    progress = []
+    store.restore(store.manifest_path("1"), tmp_path / "restored", lambda done, total: progress.append(done))
+    assert read_world(tmp_path / "restored") == files
+    assert (tmp_path / "restored" / "level.dat").stat().st_mtime_ns == 1_000_000_000
+    assert progress[-1] == 14
+
+
+def test_garbage_collection_keeps_referenced_blobs(tmp_path, store):
+    write_world(tmp_path / "world", {"level.dat": b"aaaabbbb"})
+    store.create(tmp_path / "world", "1")
+    write_world(tmp_path / "world", {"level.dat": b"aaaacccc"})
+    store.create(tmp_path / "world", "2")
+
+    assert store.collect_garbage() == {"removed_blobs": 0, "freed_bytes": 0}
+    store.manifest_path("1").unlink()
+    assert store.collect_garbage() == {"removed_blobs": 1, "freed_bytes": 4}
+
+    store.restore(store.manifest_path("2"), tmp_path / "restored")
+    assert read_world(tmp_path / "restored") == {"level.dat": b"aaaacccc"}
+
+
+class FakeServer:
+    def __init__(self, world):
+        self.active_world = world
+        self.is_running = True
+        self.server_config = SimpleNamespace(installed=True)
+        self.calls = []
+
+    def get_world(self, name):
+        return self.active_world
+
+    async def shutdown(self):
+        self.is_running = False
+        self.calls.append("shutdown")
+
+    async def start(self):
+        self.is_running = True
+        self.calls.append("start")
+
+
+def test_server_is_started_again_if_the_restore_fails(tmp_path):
+    write_world(tmp_path / "server" / "worlds" / "world", {"level.dat": b"old"})
+    world = SimpleNamespace(name="world", path=tmp_path / "server" / "worlds" / "world")
+    server = FakeServer(world)
+    backup = SimpleNamespace(sid="s", world="world", path=str(tmp_path / "missing.zip"))
+    manager = SimpleNamespace(backup_manager=SimpleNamespace(get_backup=lambda bid: backup),
+                              get_server=lambda sid: server)
+    lifecycle = LifecycleEngine(manager)
+    guards = []
+
+    async def before_start(server):
+        guards.append(dict(lifecycle.start_guards))
+
+    lifecycle.before_start = before_start
+
+    async def run():
+        job = Job("restore", "b", None)
+        job._loop = asyncio.get_running_loop()
+        job_queue = JobQueue(workers=1)
+        try:
+            with pytest.raises(FileNotFoundError):
+                await restore_backup_job(job, manager, job_queue, lifecycle, "b")
+            # a server that is guarded by another job is not touched
+            with lifecycle.guard_start("s", "Pruning"):
+                with pytest.raises(ServerBusyException):
+                    await restore_backup_job(job, manager, job_queue, lifecycle, "b")
+        finally:
+            job_queue.executor.shutdown()
+
+    asyncio.run(run())
+    # started through the lifecycle engine, after the guard of the restore was released
+    assert server.calls == ["shutdown", "start"]
+    assert guards == [{}]
+    assert read_world(world.path) == {"level.dat": b"old"}
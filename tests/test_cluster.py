@@ -0,0 +1,129 @@
+"""
+Runs two stub servers as nodes and an aggregator in front of them, each in its own uvicorn process
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+STUB_SERVER = ROOT / "benchmarks" / "stub_server.py"
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(port: int, servers: int, env: dict) -> subprocess.Popen:
+    # mc_server_interaction allows one instance per script, its lock file is in the temporary directory
+    env = {**os.environ, **env, "TMPDIR": tempfile.mkdtemp(prefix="mcsm-test-")}
+    return subprocess.Popen(
+        [sys.executable, str(STUB_SERVER), "--port", str(port), "--servers", str(servers), "--worlds", "1",
+         "--players", "2", "--backups", "2"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_until_ready(process: subprocess.Popen, port: int, timeout: float = 60):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+@pytest.fixture(scope="module")
+def aggregator():
+    ports = {"a": get_free_port(), "b": get_free_port()}
+    processes = [start(port, 2, {"MC_SERVER_MANAGER_NODES": ""}) for port in ports.values()]
+    nodes = ",".join(f"{name}=http://127.0.0.1:{port}" for name, port in ports.items())
+    port = get_free_port()
+    processes.append(start(port, 0, {"MC_SERVER_MANAGER_NODES": nodes}))
+    try:
+        for process, process_port in zip(processes, list(ports.values()) + [port]):
+            wait_until_ready(process, process_port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+
+
+async def get_json(session: aiohttp.ClientSession, url: str):
+    async with session.get(url) as resp:
+        return resp.status, await resp.json()
+
+
+def test_servers_are_merged(aggregator):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            status, body = await get_json(session, f"{aggregator}/api/servers")
+            assert status == 200
+            assert body["errors"] == {}
+            assert sorted(server["sid"] for server in body["servers"]) == ["a-0", "a-1", "b-0", "b-1"]
+
+            async with session.ws_connect(f"{aggregator.replace('http', 'ws', 1)}/api/servers") as websocket:
+                message = json.loads((await websocket.receive(timeout=10)).data)
+            assert message["errors"] == {}
+            assert sorted(server["sid"] for server in message["servers"]) == ["a-0", "a-1", "b-0", "b-1"]
+
+    asyncio.run(run())
+
+
+def test_backups_are_forwarded(aggregator):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            status, server = await get_json(session, f"{aggregator}/api/servers/b-1")
+            assert status == 200
+            assert server["sid"] == "b-1"
+            assert sorted(server["backups"]) == ["b-1-0", "b-1-1"]
+
+            # the stub backups have no files, the node answers and not the catch-all route of the aggregator
+            async with session.post(f"{aggregator}/api/servers/backups/b-1-0/restore") as resp:
+                assert resp.status == 202
+                assert (await resp.json())["jid"].startswith("b-")
+            async with session.post(f"{aggregator}/api/servers/backups/c-1-0/restore") as resp:
+                assert resp.status == 404
+                assert (await resp.json()) == {"message": "Backup not found"}
+            async with session.get(f"{aggregator}/api/servers/backups/bulk",
+                                   params=[("bids", "a-0-0"), ("bids", "b-0-0")]) as resp:
+                assert resp.status == 400
+
+    asyncio.run(run())
+
+
+def test_stream_is_merged(aggregator):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"{aggregator.replace('http', 'ws', 1)}/api/stream",
+                                          params={"flush_interval": "0"}) as websocket:
+                await websocket.send_str(json.dumps({"action": "subscribe",
+                                                     "topics": ["server:*:status", "server:c-0:status"]}))
+                events = []
+                statuses = set()
+                end = time.monotonic() + 10
+                while len(statuses) < 4 and time.monotonic() < end:
+                    events += json.loads((await websocket.receive(timeout=10)).data)
+                    statuses = {event["topic"] for event in events if event["topic"] != "control"}
+        controls = [event["data"] for event in events if event["topic"] == "control"]
+        assert {"type": "error", "error": "Invalid topics", "topics": ["server:c-0:status"]} in controls
+        assert {"type": "subscribed", "topics": ["server:*:status"]} in controls
+        assert statuses == {f"server:{sid}:status" for sid in ("a-0", "a-1", "b-0", "b-1")}
+
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from mc_server_manager_api.commands import CommandQueue
+
+
+class FakeServer:
+    def __init__(self):
+        self.is_online = True
+        self.commands = []
+
+    async def send_command(self, command: str):
+        self.commands.append((time.monotonic(), command))
+
+
+def test_commands_are_rate_limited():
+    server = FakeServer()
+
+    async def run():
+        queue = CommandQueue("a", server, rate=20, burst=2, max_queue_size=10)
+        results = await asyncio.gather(*[queue.submit(f"say {i}") for i in range(4)])
+        assert [result["result"] for result in results] == ["sent"] * 4
+        assert queue.sent == 4
+
+    asyncio.run(run())
+    assert [command for _, command in server.commands] == ["say 0", "say 1", "say 2", "say 3"]
+    times = [sent_at for sent_at, _ in server.commands]
+    # the burst is sent at once, then one command every 50 ms
+    assert times[1] - times[0] < 0.04
+    assert times[3] - times[1] >= 0.09
+
+
+def test_identical_queued_commands_are_coalesced():
+    server = FakeServer()
+
+    async def run():
+        queue = CommandQueue("a", server, rate=20, burst=1, max_queue_size=10)
+        first = queue.submit("list")
+        second = queue.submit("list")
+        other = queue.submit("list", expect="players online")
+        assert len(queue) == 2
+        assert await first == {"command": "list", "result": "sent"}
+        assert await second == {"command": "list", "result": "sent", "coalesced": True}
+        assert queue.coalesced == 1
+
+        # once sent, the same command is queued again
+        assert await queue.submit("list") == {"command": "list", "result": "sent"}
+
+        await asyncio.sleep(0)
+        queue.on_output("There are 0 of a max of 20 players online")
+        assert (await other)["result"] == "matched"
+
+    asyncio.run(run())
+    assert [command for _, command in server.commands] == ["list", "list", "list"]
+
+
+def test_full_queue_and_invalid_commands():
+    server = FakeServer()
+
+    async def run():
+        queue = CommandQueue("a", server, rate=1, burst=0, max_queue_size=1)
+        queue.submit("say 1")
+        assert (await queue.submit("say 2"))["error"] == "Command queue is full"
+        assert (await queue.submit(" "))["error"] == "Empty command"
+        assert (await queue.submit("list", expect="("))["error"].startswith("Invalid expect")
+
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+import asyncio
+import gzip
+import json
+
+from mc_server_manager_api.console import ConsoleLog
+
+
+def fill(console_log: ConsoleLog, count: int, start: int = 1):
+    for i in range(start, start + count):
+        console_log.append(f"line {i}")
+
+
+async def wait_for_segments(console_log: ConsoleLog):
+    while console_log._writing:
+        await asyncio.sleep(0.01)
+
+
+def test_lines_are_numbered():
+    console_log = ConsoleLog(max_lines=10)
+    assert console_log.first_seq == 1
+    fill(console_log, 3)
+    assert console_log.last_seq == 3
+
+    async def run():
+        assert await console_log.get_lines(1) == [(2, "line 2"), (3, "line 3")]
+        assert await console_log.get_lines(limit=2) == [(2, "line 2"), (3, "line 3")]
+        assert await console_log.get_lines(3) == []
+        # lines of a previous run of the api
+        assert await console_log.get_lines(100, limit=1) == [(1, "line 1")]
+
+    asyncio.run(run())
+
+
+def test_ring_drops_the_oldest_lines():
+    console_log = ConsoleLog(max_lines=5)
+    fill(console_log, 8)
+    assert console_log.first_seq == 4
+    assert [seq for seq, _ in console_log.lines] == [4, 5, 6, 7, 8]
+
+    messages = asyncio.run(console_log.get_resume_messages(1))
+    assert [json.loads(message) for message in messages] == [
+        {"type": "output", "value": "line 4\nline 5\nline 6\nline 7\nline 8\n", "seq": 8, "gap": 2}
+    ]
+
+
+def test_evicted_lines_are_spilled_to_segments(tmp_path):
+    # a segment of a previous run
+    tmp_path.joinpath("1-3.jsonl.gz").write_bytes(b"")
+    console_log = ConsoleLog(max_lines=5, spill_dir=tmp_path, segment_size=3, max_segments=2)
+    assert not tmp_path.joinpath("1-3.jsonl.gz").exists()
+
+    async def run():
+        fill(console_log, 11)
+        await wait_for_segments(console_log)
+        # 1-3 and 4-6 are written, 7-11 are in the buffer
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["1-3.jsonl.gz", "4-6.jsonl.gz"]
+        with gzip.open(tmp_path / "4-6.jsonl.gz", "rt") as f:
+            assert [json.loads(line) for line in f] == [[4, "line 4"], [5, "line 5"], [6, "line 6"]]
+        assert [seq for seq, _ in await console_log.get_lines(0, None)] == list(range(1, 12))
+        assert [seq for seq, _ in await console_log.get_lines(2, 5)] == [3, 4, 5, 6, 7]
+
+        # the oldest segment is removed
+        fill(console_log, 3, start=12)
+        await wait_for_segments(console_log)
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["4-6.jsonl.gz", "7-9.jsonl.gz"]
+        assert console_log.first_seq == 4
+        assert [seq for seq, _ in await console_log.get_lines(0, None)] == list(range(4, 15))
+
+    asyncio.run(run())
+
+
+def test_resume_messages_are_paged(tmp_path):
+    console_log = ConsoleLog(max_lines=4, spill_dir=tmp_path, segment_size=2)
+
+    async def run():
+        fill(console_log, 10)
+        await wait_for_segments(console_log)
+        messages = [json.loads(message) for message in await console_log.get_resume_messages(1)]
+        assert [message["seq"] for message in messages] == [5, 9, 10]
+        assert "gap" not in messages[0]
+        assert "".join(message["value"] for message in messages) == "".join(f"line {i}\n" for i in range(2, 11))
+
+        # nothing is missing
+        assert [json.loads(message) for message in await console_log.get_resume_messages(10)] == [
+            {"type": "output", "value": "", "seq": 10}
+        ]
+
+    asyncio.run(run())
+
+
+def test_tail_message_is_cached():
+    console_log = ConsoleLog(max_lines=10, tail_size=2)
+    fill(console_log, 3)
+    message = console_log.to_message()
+    assert json.loads(message) == {"type": "output", "value": "line 2\nline 3\n", "seq": 3}
+    assert console_log.to_message() is message
+    console_log.append("line 4")
+    assert json.loads(console_log.to_message())["seq"] == 4
@@ -0,0 +1,32 @@
+import asyncio
+from types import SimpleNamespace
+
+from mc_server_interaction.interaction.server_process import Callback
+
+from mc_server_manager_api.instrumentation import Instrumentation
+
+
+def test_callbacks_added_later_are_timed():
+    names = ("output", "status", "properties", "system_metrics", "players")
+    server = SimpleNamespace(callbacks=SimpleNamespace(**{name: Callback() for name in names}))
+    manager = SimpleNamespace(get_servers=lambda: {"a": server})
+    instrumentation = Instrumentation(manager, SimpleNamespace(), SimpleNamespace(), SimpleNamespace())
+    calls = []
+
+    async def before(value):
+        calls.append(("before", value))
+
+    async def after(value):
+        calls.append(("after", value))
+
+    server.callbacks.output.add_callback(before)
+    instrumentation.watch_servers()
+    # e.g. the callback of a websocket subscription
+    server.callbacks.output.add_callback(after)
+    instrumentation.watch_servers()
+
+    asyncio.run(server.callbacks.output("line"))
+    assert calls == [("before", "line"), ("after", "line")]
+    assert [func.__wrapped__ for func in server.callbacks.output.installed_callbacks] == [before, after]
+    counts, _ = instrumentation.callback_duration.values[("output",)]
+    assert sum(counts) == 2
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+from mc_server_manager_api.journal import StateJournal, _encode_entry
+
+
+class FakeConfig:
+    def __init__(self):
+        self.servers = {}
+        self.latest_sid = -1
+        self.server_data_dir = "/servers"
+
+    def get_servers(self):
+        return self.servers
+
+    def get_latest_sid(self):
+        return self.latest_sid
+
+    def save(self):
+        pass
+
+
+class FakeManager:
+    def __init__(self):
+        self.config = FakeConfig()
+        self.servers = {}
+
+    def get_server(self, sid):
+        return self.servers.get(sid)
+
+
+def add_server(manager: FakeManager, sid: str, path, properties: dict):
+    manager.config.servers[sid] = SimpleNamespace(name=f"server{sid}", path=str(path))
+    manager.config.latest_sid = int(sid)
+    manager.servers[sid] = SimpleNamespace(properties=SimpleNamespace(
+        file_name=str(path / "server.properties"), to_dict=lambda: properties
+    ))
+
+
+def write_journal(path, entries):
+    with open(path, "ab") as f:
+        for entry in entries:
+            f.write(_encode_entry(entry))
+
+
+def test_recover_replays_the_journal(tmp_path):
+    data_file = tmp_path / "manager_data.json"
+    data_file.write_text(json.dumps({"servers": {"0": {"name": "old"}, "1": {"name": "deleted"}}, "latest_sid": 1}))
+    journal = StateJournal(tmp_path / "journal.log", data_file)
+    write_journal(journal.path, [
+        {"op": "server", "sid": "0", "config": {"name": "new"}},
+        {"op": "delete", "sid": "1"},
+        {"op": "server", "sid": "2", "config": {"name": "created"}},
+        {"op": "manager", "data": {"latest_sid": 2}}
+    ])
+
+    assert journal.recover() == 4
+    data = json.loads(data_file.read_text())
+    assert data["servers"] == {"0": {"name": "new"}, "2": {"name": "created"}}
+    assert data["latest_sid"] == 2
+    assert not journal.path.exists()
+    # nothing to replay the second time
+    assert journal.recover() == 0
+
+
+def test_recover_stops_at_a_torn_tail(tmp_path):
+    data_file = tmp_path / "manager_data.json"
+    journal = StateJournal(tmp_path / "journal.log", data_file)
+    write_journal(journal.path, [{"op": "server", "sid": "0", "config": {"name": "kept"}}])
+    torn = _encode_entry({"op": "server", "sid": "1", "config": {"name": "torn"}})
+    with open(journal.path, "ab") as f:
+        f.write(torn[:len(torn) // 2])
+
+    assert journal.recover() == 1
+    assert json.loads(data_file.read_text())["servers"] == {"0": {"name": "kept"}}
+
+
+def test_recover_stops_at_a_corrupted_entry(tmp_path):
+    data_file = tmp_path / "manager_data.json"
+    journal = StateJournal(tmp_path / "journal.log", data_file)
+    write_journal(journal.path, [{"op": "server", "sid": "0", "config": {"name": "kept"}}])
+    corrupted = bytearray(_encode_entry({"op": "server", "sid": "1", "config": {"name": "corrupted"}}))
+    corrupted[-3] ^= 0xff
+    with open(journal.path, "ab") as f:
+        f.write(bytes(corrupted))
+    write_journal(journal.path, [{"op": "server", "sid": "2", "config": {"name": "after"}}])
+
+    assert journal.recover() == 1
+    assert json.loads(data_file.read_text())["servers"] == {"0": {"name": "kept"}}
+
+
+def test_recover_replays_the_rotated_journal_first(tmp_path):
+    # a crash during compaction leaves the rotated journal and the entries written meanwhile
+    data_file = tmp_path / "manager_data.json"
+    journal = StateJournal(tmp_path / "journal.log", data_file)
+    write_journal(journal.old_path, [{"op": "server", "sid": "0", "config": {"name": "first"}}])
+    write_journal(journal.path, [{"op": "server", "sid": "0", "config": {"name": "second"}}])
+
+    assert journal.recover() == 2
+    assert json.loads(data_file.read_text())["servers"] == {"0": {"name": "second"}}
+    assert not journal.old_path.exists()
+
+
+def test_properties_are_replayed_unless_saved_later(tmp_path):
+    data_file = tmp_path / "manager_data.json"
+    data_file.write_text(json.dumps({"servers": {"0": {}, "1": {}}}))
+    manager = FakeManager()
+    paths = {}
+    for sid in ("0", "1"):
+        paths[sid] = tmp_path / sid
+        paths[sid].mkdir()
+        (paths[sid] / "server.properties").write_text("motd=journaled\n")
+        add_server(manager, sid, paths[sid], {"motd": "journaled"})
+    journal = StateJournal(tmp_path / "journal.log", data_file)
+    journal.manager = manager
+    for sid in ("0", "1"):
+        journal.record_properties(sid)
+
+    # server 0: torn by a crash during a journaled save, server 1: saved later without the journal
+    (paths["0"] / "server.properties").write_text("mo")
+    os.utime(paths["0"] / "server.properties", ns=(0, 0))
+    (paths["1"] / "server.properties").write_text("motd=saved later\n")
+    stat = os.stat(paths["1"] / "server.properties")
+    os.utime(paths["1"] / "server.properties", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert journal.recover() == 2
+    assert (paths["0"] / "server.properties").read_text() == "motd=journaled\n"
+    assert (paths["1"] / "server.properties").read_text() == "motd=saved later\n"
+
+
+def test_config_changes_are_journaled_and_compacted(tmp_path):
+    data_file = tmp_path / "manager_data.json"
+    manager = FakeManager()
+    journal = StateJournal(tmp_path / "journal.log", data_file, flush_delay=0)
+    journal.attach(manager)
+    add_server(manager, "0", tmp_path, {})
+
+    async def run():
+        manager.config.save()
+        await journal.flush()
+        # the config file is not written by save() anymore, the journal is the only copy
+        assert not data_file.exists()
+        assert journal.path.exists()
+        await journal.close()
+
+    asyncio.run(run())
+    data = json.loads(data_file.read_text())
+    assert data["servers"] == {"0": {"name": "server0", "path": str(tmp_path)}}
+    assert data["latest_sid"] == 0
+    assert not journal.path.exists()
+    assert journal.recover() == 0
@@ -0,0 +1,135 @@
+import asyncio
+import struct
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from mc_server_manager_api.lifecycle import LifecycleEngine, ServerBusyException
+from mc_server_manager_api.regions import prune_region, scan_region_file
+
+
+def chunk_nbt(inhabited_time: int, entities: int) -> bytes:
+    def name(value: str) -> bytes:
+        return struct.pack(">H", len(value)) + value.encode()
+
+    return (b"\x0a" + name("") +
+            b"\x04" + name("InhabitedTime") + struct.pack(">q", inhabited_time) +
+            b"\x09" + name("Entities") + b"\x0a" + struct.pack(">i", entities) + b"\x00" * entities +
+            b"\x00")
+
+
+def write_region(path: Path, chunks: dict, padding: int = 0):
+    """
+    :param chunks: Index in the region -> (inhabited time, entities)
+    :param padding: Unused sectors after every chunk
+    """
+    header = bytearray(8192)
+    body = b""
+    for i, (inhabited_time, entities) in sorted(chunks.items()):
+        data = zlib.compress(chunk_nbt(inhabited_time, entities))
+        payload = struct.pack(">iB", len(data) + 1, 2) + data
+        payload += b"\0" * (-len(payload) % 4096 + padding * 4096)
+        sector = 2 + len(body) // 4096
+        struct.pack_into(">i", header, i * 4, (sector << 8) | (len(payload) // 4096))
+        struct.pack_into(">i", header, 4096 + i * 4, 1000 + i)
+        body += payload
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(bytes(header) + body)
+
+
+@pytest.fixture
+def region_dir(tmp_path) -> Path:
+    return tmp_path / "world" / "region"
+
+
+def test_scan_reads_the_chunk_table(region_dir):
+    # index 33 is x=1, z=1 of region 0.0
+    write_region(region_dir / "r.0.0.mca", {0: (100, 2), 33: (5, 0)})
+    assert sorted(scan_region_file(str(region_dir / "r.0.0.mca"))) == [
+        (0, 0, 1, 1000, 100, 2, 0),
+        (1, 1, 1, 1033, 5, 0, 0)
+    ]
+
+
+def test_prune_removes_unvisited_chunks_outside_the_radius(region_dir):
+    # 0 is the center, 5 is far away but visited, 10 and 31 are far away and not visited
+    write_region(region_dir / "r.0.0.mca", {0: (0, 0), 5: (5000, 1), 10: (10, 0), 31: (0, 3)})
+    size = (region_dir / "r.0.0.mca").stat().st_size
+
+    result = prune_region(str(region_dir), "r.0.0.mca", radius=2, center=(0, 0), max_inhabited_time=100,
+                          dry_run=False)
+    assert result == {"bytes_before": size, "bytes_after": 8192 + 2 * 4096, "chunks_removed": 2,
+                      "files_deleted": 0}
+    chunks = sorted(scan_region_file(str(region_dir / "r.0.0.mca")))
+    assert [(x, z, inhabited_time) for x, z, _, _, inhabited_time, _, _ in chunks] == [(0, 0, 0), (5, 0, 5000)]
+    # the timestamps are kept
+    assert [timestamp for _, _, _, timestamp, _, _, _ in chunks] == [1000, 1005]
+
+
+def test_prune_also_rewrites_the_entities_file(region_dir):
+    write_region(region_dir / "r.0.0.mca", {0: (0, 0), 10: (0, 0)})
+    entities_path = region_dir.parent / "entities" / "r.0.0.mca"
+    write_region(entities_path, {0: (0, 1), 10: (0, 4)})
+
+    prune_region(str(region_dir), "r.0.0.mca", radius=2, center=(0, 0), max_inhabited_time=0, dry_run=False)
+    assert [(x, z, entities) for x, z, _, _, _, entities, _ in scan_region_file(str(entities_path))] == [(0, 0, 1)]
+
+
+def test_compaction_removes_unused_sectors(region_dir):
+    write_region(region_dir / "r.0.0.mca", {0: (1, 0), 1: (2, 0)}, padding=3)
+    before = sorted(scan_region_file(str(region_dir / "r.0.0.mca")))
+
+    result = prune_region(str(region_dir), "r.0.0.mca", radius=None, center=(0, 0), max_inhabited_time=0,
+                          dry_run=False)
+    assert result["bytes_before"] == 8192 + 2 * 4 * 4096
+    assert result["bytes_after"] == 8192 + 2 * 4096
+    assert result["chunks_removed"] == 0
+    assert (region_dir / "r.0.0.mca").stat().st_size == result["bytes_after"]
+    after = sorted(scan_region_file(str(region_dir / "r.0.0.mca")))
+    # only the number of sectors changed
+    assert [chunk[:2] + chunk[3:] for chunk in after] == [chunk[:2] + chunk[3:] for chunk in before]
+    assert [chunk[2] for chunk in after] == [1, 1]
+
+
+def test_dry_run_changes_nothing(region_dir):
+    write_region(region_dir / "r.0.0.mca", {0: (0, 0), 10: (0, 0)}, padding=1)
+    data = (region_dir / "r.0.0.mca").read_bytes()
+
+    result = prune_region(str(region_dir), "r.0.0.mca", radius=2, center=(0, 0), max_inhabited_time=0,
+                          dry_run=True)
+    assert result == {"bytes_before": len(data), "bytes_after": 8192 + 4096, "chunks_removed": 1,
+                      "files_deleted": 0}
+    assert (region_dir / "r.0.0.mca").read_bytes() == data
+
+
+def test_a_region_without_chunks_is_deleted(region_dir):
+    write_region(region_dir / "r.1.0.mca", {0: (0, 0)})
+    result = prune_region(str(region_dir), "r.1.0.mca", radius=2, center=(0, 0), max_inhabited_time=0,
+                          dry_run=False)
+    assert result["files_deleted"] == 1
+    assert result["bytes_after"] == 0
+    assert not (region_dir / "r.1.0.mca").exists()
+
+
+def test_a_guarded_server_is_not_started():
+    started = []
+
+    async def start():
+        started.append(True)
+
+    server = SimpleNamespace(server_config=SimpleNamespace(installed=True), is_running=False, start=start)
+    lifecycle = LifecycleEngine(SimpleNamespace(get_server=lambda sid: server if sid == "0" else None))
+
+    async def run():
+        with lifecycle.guard_start("0", "World world is being pruned"):
+            with pytest.raises(ServerBusyException, match="being pruned"):
+                await lifecycle.start(server)
+            with pytest.raises(ServerBusyException):
+                with lifecycle.guard_start("0", "Another prune"):
+                    pass
+        assert await lifecycle.start(server) == "started"
+
+    asyncio.run(run())
+    assert started == [True]
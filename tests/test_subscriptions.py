@@ -0,0 +1,35 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from mc_server_manager_api.subscriptions import ServerSubscriptionManager
+
+
+class FakeCallback:
+    def __init__(self):
+        self.installed_callbacks = []
+
+    def add_callback(self, func):
+        self.installed_callbacks.append(func)
+
+
+def test_players_come_from_the_player_poller():
+    callbacks = SimpleNamespace(**{name: FakeCallback() for name in
+                                   ("system_metrics", "properties", "output", "players", "status")})
+    server = SimpleNamespace(callbacks=callbacks)
+    subscriptions = ServerSubscriptionManager()
+    subscription = subscriptions.subscribe("a", server)
+    # a players callback would make the server poll its players on the event loop
+    assert callbacks.players.installed_callbacks == []
+    assert len(callbacks.status.installed_callbacks) == 1
+
+    players = {"online_players": [{"name": "Steve"}], "op_players": [], "banned_players": []}
+    asyncio.run(subscriptions.on_players("a", players))
+    asyncio.run(subscriptions.on_players("b", players))
+    assert [json.loads(message) for message in subscription.subscriber.drain()] == [
+        {"type": "players", "value": players}
+    ]
+
+    subscriptions.unsubscribe(subscription)
+    assert callbacks.status.installed_callbacks == []
+    assert subscriptions.get_subscriptions("a") == set()
@@ -0,0 +1,27 @@
+from mc_server_manager_api.timeseries import FIELDS, ServerMetricsHistory
+
+
+def sample(value: float) -> dict:
+    return {field: value for field in FIELDS}
+
+
+def test_raw_tier_holds_an_hour_at_the_metrics_cadence():
+    history = ServerMetricsHistory()
+    # one sample every 5 seconds, like the system_metrics callback, for two hours
+    end = 7200
+    for timestamp in range(0, end, history.raw_interval):
+        history.add(timestamp, sample(timestamp))
+
+    assert history.raw.size == history.raw.capacity
+    assert history.raw.oldest == end - 3600
+
+    result = history.query(end - 600, end)
+    assert result["resolution"] == history.raw_interval
+    assert result["timestamps"][:2] == [end - 600, end - 595]
+
+    # older than the raw tier, the minute rollups are used
+    result = history.query(end - 3700, end)
+    assert result["resolution"] == 60
+    # a step below the raw resolution is raised to it
+    result = history.query(end - 60, end, step=1)
+    assert result["resolution"] == result["step"] == history.raw_interval
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+from mc_server_manager_api.uploads import InvalidArchiveException, UploadException, UploadLimitException, \
+    UploadLimits, WorldUploadManager, extract_world
+
+
+def make_archive(files: dict) -> io.BytesIO:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in files.items():
+            zip_file.writestr(name, data)
+    archive.seek(0)
+    return archive
+
+
+def test_extract_world(tmp_path):
+    archive = make_archive({"level.dat": b"level", "region/r.0.0.mca": b"region"})
+    progress = []
+    extract_world(archive, tmp_path / "world", UploadLimits(), lambda done, total: progress.append((done, total)))
+    assert (tmp_path / "world" / "level.dat").read_bytes() == b"level"
+    assert (tmp_path / "world" / "region" / "r.0.0.mca").read_bytes() == b"region"
+    assert progress[-1] == (11, 11)
+
+
+@pytest.mark.parametrize("name", ["../evil", "region/../../evil", "/tmp/evil"])
+def test_paths_outside_the_destination_are_rejected(tmp_path, name):
+    archive = make_archive({"level.dat": b"level", name: b"evil"})
+    with pytest.raises(InvalidArchiveException):
+        extract_world(archive, tmp_path / "world", UploadLimits())
+    assert not (tmp_path / "evil").exists()
+
+
+def test_total_size_and_ratio_are_limited(tmp_path):
+    archive = make_archive({"level.dat": b"\0" * 1024 * 1024})
+    with pytest.raises(UploadLimitException):
+        extract_world(archive, tmp_path / "world", UploadLimits(max_ratio=10))
+    with pytest.raises(UploadLimitException):
+        extract_world(archive, tmp_path / "world", UploadLimits(max_uncompressed_size=1024))
+    with pytest.raises(UploadLimitException):
+        extract_world(archive, tmp_path / "world", UploadLimits(max_size=1024))
+
+
+def test_ratio_is_limited_per_entry(tmp_path):
+    # the random data keeps the ratio of the whole archive low, the zeros compress far better than allowed
+    archive = make_archive({"random": os.urandom(400 * 1024), "zeros": b"\0" * 1024 * 1024})
+    with pytest.raises(UploadLimitException, match="zeros"):
+        extract_world(archive, tmp_path / "world", UploadLimits(max_ratio=4), chunk_size=64 * 1024)
+
+
+def test_entries_are_limited(tmp_path):
+    archive = make_archive({f"{i}.dat": b"" for i in range(5)})
+    with pytest.raises(UploadLimitException):
+        extract_world(archive, tmp_path / "world", UploadLimits(max_entries=4))
+
+
+def test_invalid_archive(tmp_path):
+    with pytest.raises(InvalidArchiveException):
+        extract_world(io.BytesIO(b"not a zip file"), tmp_path / "world", UploadLimits())
+
+
+def test_remove_upload_waits_for_a_chunk(tmp_path):
+    uploads = WorldUploadManager(tmp_path / "uploads")
+
+    async def run():
+        upload = await uploads.create_upload("a", "world", 8)
+        written = asyncio.Event()
+        release = asyncio.Event()
+
+        async def stream():
+            yield b"1234"
+            written.set()
+            await release.wait()
+            yield b"5678"
+
+        write = asyncio.create_task(uploads.write_chunk(upload, 0, stream()))
+        await written.wait()
+        remove = asyncio.create_task(uploads.remove_upload(upload.uid))
+        await asyncio.sleep(0.05)
+        assert upload.path.exists()
+        release.set()
+        await write
+        await remove
+        assert not upload.path.exists()
+        assert uploads.get_upload(upload.uid) is None
+        # a request that got the upload before it was removed
+        with pytest.raises(UploadException):
+            await uploads.write_chunk(upload, 8, stream())
+
+    asyncio.run(run())
+
+
+def test_orphaned_upload_files_expire(tmp_path):
+    uploads = WorldUploadManager(tmp_path / "uploads", expire_after=60)
+    uploads.upload_dir.mkdir()
+    orphan = uploads.upload_dir / "orphan.zip"
+    orphan.write_bytes(b"data")
+    recent = uploads.upload_dir / "recent.zip"
+    recent.write_bytes(b"data")
+    os.utime(orphan, (time.time() - 120, time.time() - 120))
+
+    async def run():
+        upload = await uploads.create_upload("a", "world", 8)
+        os.utime(upload.path, (time.time() - 120, time.time() - 120))
+        await uploads.remove_expired()
+        return upload
+
+    upload = asyncio.run(run())
+    assert not orphan.exists()
+    assert recent.exists()
+    assert upload.path.exists()
@@ -0,0 +1,18 @@
+import json
+from types import SimpleNamespace
+
+from mc_server_manager_api.versions import VersionCatalog
+
+
+def test_latest_counts_against_the_limit(tmp_path):
+    versions = {"1.20.1": {}, "1.20": {}, "23w31a": {}, "1.19.4": {}}
+    catalog = VersionCatalog(SimpleNamespace(available_versions=versions, filename=str(tmp_path / "versions.json")))
+
+    def page(**kwargs):
+        return json.loads(catalog.get_response(**kwargs)[0])["available_versions"]
+
+    assert page(limit=2) == ["latest", "1.20.1"]
+    assert page(limit=2, offset=2) == ["1.20", "23w31a"]
+    assert page(limit=2, offset=4) == ["1.19.4"]
+    assert page(version_type="release", limit=3) == ["latest", "1.20.1", "1.20"]
+    assert page() == ["latest"] + list(versions)